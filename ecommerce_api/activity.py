@@ -0,0 +1,100 @@
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("last_login",)
+
+
+class ActivityBuffer:
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pid = None
+
+    def record(self, user_id, column, timestamp):
+        if column not in COLUMNS:
+            raise Exception(f"Unknown activity column {column}")
+
+        if not settings.ACTIVITY_FLUSH_INTERVAL:
+            return write_activity(column, {user_id: timestamp})
+
+        with self.lock:
+            latest = self.pending.setdefault(column, {})
+            if user_id not in latest or timestamp > latest[user_id]:
+                latest[user_id] = timestamp
+            size = sum(len(values) for values in self.pending.values())
+
+        self.start()
+        if size >= settings.ACTIVITY_MAX_PENDING:
+            self.wakeup.set()
+
+    def start(self):
+        # the flusher belongs to the process that records, so start it lazily after any fork
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(settings.ACTIVITY_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.safe_flush()
+            connection.close()
+
+    def safe_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Could not flush user activity")
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        for column, values in pending.items():
+            write_activity(column, values)
+
+
+def write_activity(column, values):
+    from user_controller.models import User
+
+    if not values:
+        return
+
+    if connection.vendor != "postgresql":
+        for user_id, timestamp in values.items():
+            User.objects.filter(id=user_id).update(**{column: timestamp})
+        return
+
+    table = User._meta.db_table
+    rows = ", ".join(["(%s, %s::timestamptz)"] * len(values))
+    params = [item for row in values.items() for item in row]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} AS u SET {column} = v.at FROM (VALUES {rows}) AS v(id, at) "
+            f"WHERE u.id = v.id AND (u.{column} IS NULL OR u.{column} < v.at)",
+            params
+        )
+
+
+activity_buffer = ActivityBuffer()
+atexit.register(activity_buffer.safe_flush)
+
+
+def record_activity(user_id, column, timestamp=None):
+    activity_buffer.record(user_id, column, timestamp or timezone.now())
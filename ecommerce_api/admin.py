@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimated_count(model, using="default"):
+    # the planner's row estimate, summed over the partitions of a partitioned table
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return None
+
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT SUM(GREATEST(reltuples, 0))::bigint FROM pg_class
+            WHERE oid = to_regclass(%(table)s)
+               OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%(table)s))
+        """, {"table": table})
+        return cursor.fetchone()[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    # an exact COUNT(*) scans the whole table, so unfiltered lists of big tables use the
+    # estimate instead; filtered lists are usually small enough to count
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate and estimate >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # newest first off the primary key; the models' created_at orderings have no index that
+    # also covers the -pk Django adds to make the order total, so they sort the whole table
+    ordering = ("-id",)
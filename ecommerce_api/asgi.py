@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_api.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.urls import path
+from channels.routing import ProtocolTypeRouter, URLRouter
+from .consumers import GraphqlSubscriptionConsumer
+
+application = ProtocolTypeRouter({
+    'http': django_application,
+    'websocket': URLRouter([
+        path('graphview/', GraphqlSubscriptionConsumer.as_asgi()),
+    ]),
+})
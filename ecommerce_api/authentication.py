@@ -1,37 +1,74 @@
+import math
+import time
+import uuid
 from datetime import datetime
 import jwt
 from django.conf import settings
+from .caches import TTLCache
+from .revocation import revocation_list
+
+token_cache = TTLCache(settings.TOKEN_CACHE_SIZE)
+user_cache = TTLCache(settings.TOKEN_CACHE_SIZE)
+
 
 class TokenManager:
+    ACCESS_LIFETIME = 24*60
+    REFRESH_LIFETIME = 7*24*60
+
     @staticmethod
     def get_token(exp, payload, token_type="access"):
-        exp = datetime.now().timestamp() + (exp * 60)
+        now = datetime.now().timestamp()
+        exp = now + (exp * 60)
 
         return jwt.encode(
-            {"exp":exp, "type": token_type, **payload},
+            {"exp":exp, "iat": now, "jti": uuid.uuid4().hex, "type": token_type, **payload},
             settings.SECRET_KEY,
             algorithm="HS256"
         )
 
     @staticmethod
     def decode_token(token):
-        try:
-            decoded = jwt.decode(token, key=settings.SECRET_KEY, algorithms="HS256")
-        except jwt.DecodeError:
-            return None
+        decoded = token_cache.get(token)
+
+        if decoded is None:
+            try:
+                decoded = jwt.decode(token, key=settings.SECRET_KEY, algorithms="HS256")
+            except jwt.InvalidTokenError:
+                return None
 
-        if datetime.now().timestamp() > decoded["exp"]:
+            if datetime.now().timestamp() > decoded["exp"]:
+                return None
+
+            token_cache.set(token, decoded, decoded["exp"])
+
+        if revocation_list.is_revoked(decoded):
             return None
 
         return decoded
 
+    @staticmethod
+    def revoke_token(token):
+        decoded = TokenManager.decode_token(token)
+
+        if not decoded:
+            return False
+
+        revocation_list.revoke(decoded)
+        token_cache.delete(token)
+        return True
+
+    @staticmethod
+    def revoke_user(user_id):
+        revocation_list.revoke_user(user_id, TokenManager.REFRESH_LIFETIME)
+        user_cache.delete(user_id)
+
     @staticmethod
     def get_access(payload):
-        return TokenManager.get_token(24*60, payload)
+        return TokenManager.get_token(TokenManager.ACCESS_LIFETIME, payload)
 
     @staticmethod
     def get_refresh(payload):
-        return TokenManager.get_token(7*24*60, payload, "refresh")
+        return TokenManager.get_token(TokenManager.REFRESH_LIFETIME, payload, "refresh")
 
 
 class Authentication:
@@ -44,15 +81,22 @@ class Authentication:
         if not data:
             return None
 
-        return self.get_user(data["user_id"])
+        return self.get_user(data["user_id"], data["exp"])
 
-    def validate_request(self):
+    def get_token(self):
         authorization = self.request.headers.get("AUTHORIZATION", None)
 
         if not authorization:
             return None
 
-        token = authorization[4:]
+        return authorization[4:]
+
+    def validate_request(self):
+        token = self.get_token()
+
+        if not token:
+            return None
+
         decoded_data = TokenManager.decode_token(token)
 
         if not decoded_data:
@@ -61,11 +105,25 @@ class Authentication:
         return decoded_data
 
     @staticmethod
-    def get_user(user_id):
+    def get_user(user_id, expires_at=None):
         from user_controller.models import User
 
+        # keep plain field values rather than the instance so every request gets
+        # a fresh object without related objects cached from an earlier one
+        fields = [field.attname for field in User._meta.concrete_fields]
+        snapshot = user_cache.get(user_id)
+        if snapshot is not None:
+            return User.from_db("default", fields, snapshot)
+
         try:
             user = User.objects.get(id=user_id)
-            return user
         except User.DoesNotExist:
             return None
+
+        expires_at = min(expires_at or math.inf, time.time() + settings.USER_CACHE_SECONDS)
+        user_cache.set(user_id, [getattr(user, field) for field in fields], expires_at)
+        return user
+
+    @staticmethod
+    def forget_user(user_id):
+        user_cache.delete(user_id)
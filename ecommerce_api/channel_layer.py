@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+
+MESSAGE = ("Subscription broadcasts need CHANNEL_REDIS_URL to reach websockets served by another process, "
+           "or CHANNEL_LAYER_IN_MEMORY=True when one process serves both HTTP and websockets")
+
+
+def shared_layer_configured():
+    return bool(settings.CHANNEL_REDIS_URL) or settings.CHANNEL_LAYER_IN_MEMORY
+
+
+def require_shared_layer():
+    # called before a mutation commits, so a broadcast that would reach nobody fails the request
+    # instead of going out on a layer only this process listens to
+    if not shared_layer_configured():
+        raise ImproperlyConfigured(MESSAGE)
+
+
+def check_channel_layer(app_configs, **kwargs):
+    # management commands don't broadcast, so they only warn
+    if shared_layer_configured():
+        return []
+    return [checks.Warning(MESSAGE, id="ecommerce_api.W001")]
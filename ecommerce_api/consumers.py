@@ -0,0 +1,21 @@
+import channels_graphql_ws
+from channels.db import database_sync_to_async
+
+from .authentication import Authentication, TokenManager
+from .schema import schema
+
+
+class GraphqlSubscriptionConsumer(channels_graphql_ws.GraphqlWsConsumer):
+    schema = schema
+    send_keepalive_every = 30
+
+    async def on_connect(self, payload):
+        authorization = (payload or {}).get("Authorization", None)
+        decoded_data = None
+        if authorization:
+            decoded_data = await database_sync_to_async(TokenManager.decode_token)(authorization[4:])
+
+        self.scope["user"] = None
+        if decoded_data:
+            self.scope["user"] = await database_sync_to_async(Authentication.get_user)(
+                decoded_data["user_id"], decoded_data["exp"])
@@ -0,0 +1,41 @@
+import math
+from functools import partial
+
+from django.conf import settings
+from graphql import parse, validate
+from graphql.backend.base import GraphQLDocument
+from graphql.backend.core import GraphQLCoreBackend
+from graphql.execution import ExecutionResult, execute
+
+from .caches import TTLCache
+
+
+class DocumentBackend(GraphQLCoreBackend):
+    # parsing and validating cost as much as running a small query, so each distinct
+    # query text is done once and its document reused until it falls out of the LRU
+    def __init__(self, maxsize, executor=None):
+        super().__init__(executor)
+        self.documents = TTLCache(maxsize)
+
+    def document_from_string(self, schema, document_string):
+        document = self.documents.get(document_string)
+        if document is None:
+            document = self.build(schema, document_string)
+            self.documents.set(document_string, document, math.inf)
+        return document
+
+    def build(self, schema, document_string):
+        document_ast = parse(document_string)
+        errors = validate(schema, document_ast)
+
+        if errors:
+            run = lambda *args, **kwargs: ExecutionResult(errors=errors, invalid=True)
+        else:
+            run = partial(execute, schema, document_ast, **self.execute_params)
+
+        document = GraphQLDocument(schema, document_string, document_ast, run)
+        document.errors = errors
+        return document
+
+
+document_backend = DocumentBackend(settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
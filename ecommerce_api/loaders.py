@@ -0,0 +1,75 @@
+import threading
+from collections import deque
+
+from graphql.execution.executors.sync import SyncExecutor
+from promise import Promise
+from promise.dataloader import DataLoader
+from promise.schedulers.immediate import ImmediateScheduler
+
+
+class BatchExecutor(SyncExecutor):
+    # channels_graphql_ws switches the promise trampoline off process-wide, after which
+    # every DataLoader.load() dispatches on its own. Loaders of a request use this as their
+    # scheduler instead, so dispatches queue up until the synchronous pass is done.
+    def __init__(self):
+        self.local = threading.local()
+
+    @property
+    def jobs(self):
+        if not hasattr(self.local, "jobs"):
+            self.local.jobs = deque()
+        return self.local.jobs
+
+    def call(self, fn):
+        self.jobs.append(fn)
+
+    def wait(self, promise, timeout=None):
+        ImmediateScheduler().wait(promise, timeout)
+
+    def wait_until_finished(self):
+        while self.jobs:
+            self.jobs.popleft()()
+
+
+batch_executor = BatchExecutor()
+
+
+def get_loader(info, loader_class, *args):
+    loaders = getattr(info.context, "loaders", None)
+    if loaders is None:
+        loaders = info.context.loaders = {}
+
+    key = (loader_class, args)
+    if key not in loaders:
+        loaders[key] = loader_class(*args)
+        loaders[key]._scheduler = getattr(info.context, "batch_executor", None)
+
+    return loaders[key]
+
+
+class TopPerParentLoader(DataLoader):
+    # the first `limit` children of every parent in one query per database, ranked with ROW_NUMBER()
+    def __init__(self, model, parent_field, order_by, limit, databases=("default",)):
+        super().__init__()
+        self.model = model
+        self.parent_field = parent_field
+        self.order_by = order_by
+        self.limit = limit
+        self.databases = databases
+
+    def batch_load_fn(self, parent_ids):
+        table = self.model._meta.db_table
+        column = self.model._meta.get_field(self.parent_field).column
+        placeholders = ", ".join(["%s"] * len(parent_ids))
+
+        children = {int(parent_id): [] for parent_id in parent_ids}
+        for database in self.databases:
+            for item in self.model.objects.using(database).raw(f"""
+                SELECT * FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY {column} ORDER BY {self.order_by}) AS row_number
+                    FROM {table} WHERE {column} IN ({placeholders})
+                ) ranked WHERE row_number <= %s ORDER BY {column}, row_number
+            """, [*parent_ids, self.limit]):
+                children[getattr(item, column)].append(item)
+
+        return Promise.resolve([children[int(parent_id)] for parent_id in parent_ids])
@@ -1,9 +1,13 @@
 from .permissions import resolve_paginated
+from .slow_queries import current_operation
 
 
 class CustomAuthMiddleware(object):
     def resolve(self, next, root, info, **kwargs):
-        info.context.user = self.authorize_user(info)
+        # once per request, operations batched into it share the result
+        if not getattr(info.context, "user_resolved", False):
+            info.context.user = self.authorize_user(info)
+            info.context.user_resolved = True
         return next(root, info, **kwargs)
 
     @staticmethod
@@ -23,6 +27,16 @@ class CustomPaginationMiddleware(object):
 
         if is_paginated:
             page = kwargs.pop("page", 1)
-            return resolve_paginated(next(root, info, **kwargs).value, info, page)
+            size = kwargs.pop("size", None)
+            return resolve_paginated(next(root, info, **kwargs).value, info, page, size)
 
         return next(root, info, **kwargs)
+
+
+class QueryContextMiddleware(object):
+    def resolve(self, next, root, info, **kwargs):
+        # lets the slow-query log tell which resolver a query came from
+        operation = current_operation.get()
+        if operation is not None:
+            operation["path"] = info.path
+        return next(root, info, **kwargs)
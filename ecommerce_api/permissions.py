@@ -15,7 +15,13 @@ def is_authenticated(func):
     return wrapper
 
 
+PAGINATED_TYPES = {}
+
+
 def paginate(model_type):
+    # graphene needs one type per name, fields sharing a model type share its page type
+    if model_type in PAGINATED_TYPES:
+        return PAGINATED_TYPES[model_type]
 
     structure = {
         "total": graphene.Int(),
@@ -26,11 +32,16 @@ def paginate(model_type):
         "results": graphene.List(model_type)
     }
 
-    return type(f"{model_type}Paginated", (graphene.ObjectType,), structure )
+    PAGINATED_TYPES[model_type] = type(f"{model_type}Paginated", (graphene.ObjectType,), structure )
+    return PAGINATED_TYPES[model_type]
+
+def get_page_size(size=None):
+    default = settings.GRAPHENE.get("PAGE_SIZE", 10)
+    return min(max(size or default, 1), settings.GRAPHENE.get("MAX_PAGE_SIZE", default))
 
-def resolve_paginated(query_data, info, page_info):
+def resolve_paginated(query_data, info, page_info, size=None):
     def get_paginated_data(qs, paginated_type, page):
-        page_size = settings.GRAPHENE.get("PAGE_SIZE", 10)
+        page_size = get_page_size(size)
 
         try:
             qs.count()
@@ -49,7 +60,7 @@ def resolve_paginated(query_data, info, page_info):
 
         result = paginated_type.graphene_type (
             total=p.num_pages,
-            size=qs.count(),
+            size=p.count,
             current=page_obj.number,
             has_next=page_obj.has_next(),
             has_prev=page_obj.has_previous(),
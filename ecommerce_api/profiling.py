@@ -0,0 +1,118 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+from datetime import datetime
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.utils.text import slugify
+
+from .authentication import Authentication
+
+HEADER = "X-Profile"
+SALT = "graphql-profile"
+
+
+def profile_token():
+    return signing.TimestampSigner(salt=SALT).sign("profile")
+
+
+def profiling_allowed(request):
+    token = request.headers.get(HEADER, None)
+    if not token:
+        return False
+
+    try:
+        signing.TimestampSigner(salt=SALT).unsign(token, max_age=settings.GRAPHQL_PROFILING["TOKEN_MAX_AGE"])
+        return True
+    except signing.BadSignature:
+        pass
+
+    user = Authentication(request).authenticate()
+    return bool(user and user.is_staff)
+
+
+def frame_stack(frame):
+    stack = []
+    while frame is not None:
+        stack.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class Profile:
+    # samples the request's thread from another one, so the profiled code runs untraced
+    def __init__(self):
+        self.thread_id = threading.get_ident()
+        self.operations = []
+        self.queries = []
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, name="graphql-profile", daemon=True)
+        self.wrappers = ExitStack()
+        self.started = time.perf_counter()
+
+    def start(self):
+        for alias in connections:
+            self.wrappers.enter_context(connections[alias].execute_wrapper(self.query_logger(alias)))
+        self.sampler.start()
+        return self
+
+    def sample(self):
+        interval = settings.GRAPHQL_PROFILING["SAMPLE_INTERVAL"]
+        while not self.stopped.wait(interval):
+            frame = sys._current_frames().get(self.thread_id, None)
+            if frame is not None:
+                self.stacks[frame_stack(frame)] += 1
+
+    def query_logger(self, alias):
+        def log_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                self.queries.append({
+                    "database": alias,
+                    "sql": sql,
+                    "params": None if many else params,
+                    "started_ms": round((started - self.started) * 1000, 3),
+                    "ms": round((time.perf_counter() - started) * 1000, 3),
+                })
+        return log_query
+
+    def finish(self, status):
+        self.stopped.set()
+        self.sampler.join()
+        self.wrappers.close()
+
+        name = slugify("-".join(self.operations))[:80] or "anonymous"
+        profile_id = f"{datetime.now():%Y%m%d-%H%M%S}-{name}-{uuid.uuid4().hex[:6]}"
+        directory = settings.GRAPHQL_PROFILING["DIRECTORY"]
+        os.makedirs(directory, exist_ok=True)
+
+        with open(os.path.join(directory, f"{profile_id}.folded"), "w") as output:
+            for stack, count in self.stacks.most_common():
+                output.write(f"{stack} {count}\n")
+
+        with open(os.path.join(directory, f"{profile_id}.json"), "w") as output:
+            json.dump({
+                "operations": self.operations,
+                "status": status,
+                "ms": round((time.perf_counter() - self.started) * 1000, 3),
+                "samples": sum(self.stacks.values()),
+                "sample_interval_ms": settings.GRAPHQL_PROFILING["SAMPLE_INTERVAL"] * 1000,
+                "sql_ms": round(sum(query["ms"] for query in self.queries), 3),
+                "queries": self.queries,
+            }, output, indent=2, default=str)
+
+        return profile_id
+
+
+def start_profile(request):
+    return Profile().start() if profiling_allowed(request) else None
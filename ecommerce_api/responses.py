@@ -0,0 +1,95 @@
+import gzip
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+django_default = DjangoJSONEncoder().default
+
+
+def encode_json(data):
+    if orjson is None:
+        return json.dumps(data, separators=(",", ":"), cls=DjangoJSONEncoder)
+    return orjson.dumps(data, default=django_default).decode()
+
+
+def accepted_encodings(header):
+    encodings = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0
+        encodings[name.strip().lower()] = quality
+    return encodings
+
+
+def choose_encoding(header):
+    encodings = accepted_encodings(header or "")
+    if brotli is not None and encodings.get("br", 0) > 0:
+        return "br"
+    if encodings.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(content, encoding):
+    if encoding == "br":
+        return brotli.compress(content, quality=settings.GRAPHQL_RESPONSE["BROTLI_QUALITY"])
+    return gzip.compress(content, compresslevel=settings.GRAPHQL_RESPONSE["GZIP_LEVEL"])
+
+
+def make_etag(content):
+    return '"{}"'.format(hashlib.blake2b(content, digest_size=16).hexdigest())
+
+
+def etag_matches(header, etag):
+    # If-None-Match compares weakly, so a W/ added by a proxy still matches; the compressed
+    # representations carry a suffix, any of them revalidates the body
+    for tag in (header or "").split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag.strip('"').split("-")[0] == etag.strip('"'):
+            return True
+    return False
+
+
+def finalize_response(request, response, cacheable):
+    content = response.content
+    response["Vary"] = "Accept-Encoding, Authorization"
+
+    etag = None
+    if cacheable and response.status_code == 200:
+        etag = make_etag(content)
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            response.status_code = 304
+            response.content = b""
+            return response
+
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding and len(content) >= settings.GRAPHQL_RESPONSE["COMPRESS_MIN_BYTES"]:
+        response.content = compress(content, encoding)
+        response["Content-Encoding"] = encoding
+        if etag:
+            response["ETag"] = f'{etag[:-1]}-{encoding}"'
+
+    return response
@@ -0,0 +1,114 @@
+import hashlib
+import math
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(self.size // 8 + 1)
+
+    def positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big")
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, key):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self.positions(key))
+
+
+class RevocationList:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.bloom = BloomFilter(settings.REVOCATION_BLOOM_CAPACITY, settings.REVOCATION_BLOOM_ERROR_RATE)
+        self.users = {}
+        self.last_id = 0
+        self.refreshed_at = 0
+        self.rebuilt_at = time.time()
+
+    def load(self, rows):
+        for row_id, key, user_id, revoked_before in rows:
+            self.bloom.add(key)
+            if revoked_before:
+                self.users[user_id] = max(revoked_before.timestamp(), self.users.get(user_id, 0))
+            self.last_id = max(self.last_id, row_id)
+
+    def refresh(self):
+        from user_controller.models import RevokedToken
+
+        now = time.time()
+        if now - self.refreshed_at < settings.REVOCATION_REFRESH_SECONDS:
+            return
+
+        with self.lock:
+            if now - self.refreshed_at < settings.REVOCATION_REFRESH_SECONDS:
+                return
+
+            # rebuilding now and then drops revocations of tokens that expired anyway
+            if now - self.rebuilt_at > settings.REVOCATION_REBUILD_SECONDS:
+                RevokedToken.objects.filter(expires_at__lt=timezone.now()).delete()
+                self.reset()
+
+            self.load(RevokedToken.objects.filter(id__gt=self.last_id).values_list(
+                "id", "key", "user_id", "revoked_before"))
+            self.refreshed_at = now
+
+    def is_revoked(self, claims):
+        from user_controller.models import RevokedToken
+
+        self.refresh()
+
+        if claims.get("iat", 0) <= self.users.get(claims.get("user_id"), -1):
+            return True
+
+        jti = claims.get("jti", None)
+        if jti and jti in self.bloom:
+            return RevokedToken.objects.filter(key=jti).exists()
+
+        return False
+
+    def revoke(self, claims):
+        from user_controller.models import RevokedToken
+
+        if not claims.get("jti", None):
+            return
+
+        RevokedToken.objects.get_or_create(key=claims["jti"], defaults={
+            "user_id": claims.get("user_id"),
+            "expires_at": timezone.datetime.fromtimestamp(claims["exp"], timezone.utc),
+        })
+        with self.lock:
+            self.bloom.add(claims["jti"])
+
+    def revoke_user(self, user_id, lifetime):
+        from user_controller.models import RevokedToken
+
+        now = timezone.now()
+        # a new row every time: other workers only pick up ids above the last one they loaded
+        with transaction.atomic():
+            RevokedToken.objects.filter(user_id=user_id, revoked_before__isnull=False).delete()
+            RevokedToken.objects.create(
+                key=f"user:{user_id}:{uuid.uuid4().hex}",
+                user_id=user_id,
+                revoked_before=now,
+                expires_at=now + timezone.timedelta(minutes=lifetime),
+            )
+        with self.lock:
+            self.users[user_id] = now.timestamp()
+
+
+revocation_list = RevocationList()
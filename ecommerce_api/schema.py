@@ -1,7 +1,7 @@
 import graphene
 
-from user_controller.schema import schema as user_schema
-from product_controller.schema import schema as product_schema
+from user_controller import schema as user_schema
+from product_controller import schema as product_schema
 
 
 class Query(user_schema.Query, product_schema.Query, graphene.ObjectType):
@@ -12,4 +12,8 @@ class Mutation(user_schema.Mutation, product_schema.Mutation, graphene.ObjectTyp
     pass
 
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
\ No newline at end of file
+class Subscription(product_schema.Subscription, graphene.ObjectType):
+    pass
+
+
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
\ No newline at end of file
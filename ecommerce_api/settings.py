@@ -1,6 +1,7 @@
+from datetime import datetime, timezone
 from pathlib import Path
 import os
-from decouple import config
+from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -20,6 +21,9 @@ ALLOWED_HOSTS = []
 
 # Application definition
 
+# the channels app pulls in daphne and twisted, which WSGI workers never use
+SERVE_WEBSOCKETS = config('SERVE_WEBSOCKETS', default=True, cast=bool)
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -28,8 +32,11 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'graphene_django',
+    *(['channels'] if SERVE_WEBSOCKETS else []),
     'user_controller',
     'product_controller',
+    'task_controller',
+    'query_controller',
     'corsheaders'
 ]
 
@@ -65,6 +72,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'ecommerce_api.wsgi.application'
+ASGI_APPLICATION = 'ecommerce_api.asgi.application'
 
 
 # Database
@@ -84,9 +92,20 @@ DATABASES = {
         'PASSWORD': DB_PASSWORD,
         'HOST': DB_HOST,
         'PORT': DB_PORT,
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=0, cast=int),
     }
 }
 
+# products, their images and comments, and request carts can be sharded by business onto extra
+# databases on the same server; the default database stays the home shard and keeps everything else
+SHARD_DATABASES = config('SHARD_DATABASES', default='', cast=Csv())
+for shard in SHARD_DATABASES:
+    DATABASES[shard] = {**DATABASES['default'], 'NAME': shard}
+
+CATALOG_SHARDS = ['default', *SHARD_DATABASES] if SHARD_DATABASES else []
+DATABASE_ROUTERS = ['product_controller.sharding.ShardRouter'] if CATALOG_SHARDS else []
+SHARD_MAP_CACHE_SECONDS = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -153,9 +172,141 @@ GRAPHENE = {
     'SCHEMA': 'ecommerce_api.schema.schema',
     'MIDDLEWARE': [
         'ecommerce_api.middlewares.CustomAuthMiddleware',
-        'ecommerce_api.middlewares.CustomPaginationMiddleware'
+        'ecommerce_api.middlewares.CustomPaginationMiddleware',
+        'ecommerce_api.middlewares.QueryContextMiddleware'
     ],
-    'PAGE_SIZE': 20
+    'PAGE_SIZE': 20,
+    'MAX_PAGE_SIZE': 100,
+    'NESTED_LIST_SIZE': 10,
+    'MAX_NESTED_LIST_SIZE': 50,
+}
+
+GRAPHQL_ADMISSION = {
+    'RATE_LIMIT_BACKEND': config('RATE_LIMIT_BACKEND', default='local'),
+    'RATE': 20,
+    'BURST': 100,
+    'DEFAULT_WEIGHT': 1,
+    'WEIGHTS': {
+        'products': 5,
+        'loginUser': 50,
+        'registerUser': 50,
+        'getAccess': 10,
+    },
+    'QUERY_IN_FLIGHT': config('QUERY_IN_FLIGHT', default=32, cast=int),
+    'MAX_IN_FLIGHT': config('MAX_IN_FLIGHT', default=64, cast=int),
+    'PRIORITY_OPERATIONS': ['completePayment', 'createCartItem'],
+    'TRUST_X_FORWARDED_FOR': config('TRUST_X_FORWARDED_FOR', default=False, cast=bool),
+}
+
+CORS_ALLOW_ALL_ORIGINS = True
+
+CHANNEL_REDIS_URL = config("CHANNEL_REDIS_URL", default="")
+
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    }
+}
+
+if CHANNEL_REDIS_URL:
+    CHANNEL_LAYERS['default'] = {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {'hosts': [CHANNEL_REDIS_URL]},
+    }
+
+# subscription broadcasts go out from whichever worker ran the mutation, a WSGI one by default, and
+# only reach subscribers on ASGI through a layer shared between processes; the in-memory layer is
+# for a single process serving both, like runserver. ecommerce_api.channel_layer checks it
+CHANNEL_LAYER_IN_MEMORY = config("CHANNEL_LAYER_IN_MEMORY", default=False, cast=bool)
+
+REQUEST_CART_PARTITIONING = config("REQUEST_CART_PARTITIONING", default=False, cast=bool)
+REQUEST_CART_PARTITIONS_AHEAD = config("REQUEST_CART_PARTITIONS_AHEAD", default=3, cast=int)
+REQUEST_CART_RECENT_DAYS = config("REQUEST_CART_RECENT_DAYS", default=90, cast=int)
+# rows fetched per round trip, and written per chunk, by the order export
+ORDER_EXPORT_CHUNK_SIZE = 2000
+
+CATALOG_OUTBOX_SETTLE_SECONDS = 2
+# how long an id skipped by a consumer is looked for again before it is taken as rolled back
+CATALOG_OUTBOX_GAP_SECONDS = 10 * 60
+
+TASK_QUEUES = {
+    "default": {"concurrency": 2},
+}
+TASK_LEASE_SECONDS = 300
+TASK_POLL_INTERVAL = 1
+TOKEN_CACHE_SIZE = 10000
+USER_CACHE_SECONDS = 60
+REVOCATION_REFRESH_SECONDS = 5
+REVOCATION_REBUILD_SECONDS = 60 * 60
+REVOCATION_BLOOM_CAPACITY = 100000
+REVOCATION_BLOOM_ERROR_RATE = 0.01
+
+# seconds of activity timestamps that may be lost on a crash, 0 writes them straight away
+ACTIVITY_FLUSH_INTERVAL = config("ACTIVITY_FLUSH_INTERVAL", default=10, cast=int)
+ACTIVITY_MAX_PENDING = 1000
+
+PRODUCT_FACET_PRICE_BOUNDS = [0, 1000, 5000, 10000, 50000, 100000]
+PRODUCT_FACETS_CACHE_SECONDS = 60
+
+# roughly 190MB per million product names in each process
+AUTOCOMPLETE_MAX_ENTRIES = 1000000
+AUTOCOMPLETE_MAX_LIMIT = 20
+AUTOCOMPLETE_SYNC_SECONDS = 5
+
+RELATED_PRODUCTS_TOP_K = 20
+
+# scores double every half-life after the epoch, move it forward and run
+# recompute_popularity every few years to keep them within float range
+POPULARITY_EPOCH = datetime(2026, 1, 1, tzinfo=timezone.utc)
+POPULARITY_HALF_LIFE_HOURS = 72
+POPULARITY_WINDOW_HALF_LIVES = 10
+POPULARITY_WEIGHTS = {
+    "wish": 1,
+    "cart": 2,
+    "purchase": 5,
+}
+
+GRAPHQL_BATCH = {
+    'MAX_SIZE': config('GRAPHQL_BATCH_MAX_SIZE', default=10, cast=int),
+    'PARALLEL': config('GRAPHQL_BATCH_PARALLEL', default=False, cast=bool),
+    'WORKERS': 4,
+}
+
+GRAPHQL_RESPONSE = {
+    'COMPRESS_MIN_BYTES': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
 }
 
-CORS_ALLOW_ALL_ORIGINS = True
\ No newline at end of file
+GRAPHQL_DOCUMENT_CACHE_SIZE = 1000
+
+GRAPHQL_WARMUP = {
+    'ENABLED': config('GRAPHQL_WARMUP', default=False, cast=bool),
+    # JSON list of {"query": ..., "count": ...}, the most used operations are validated first
+    'OPERATIONS_FILE': config('GRAPHQL_WARMUP_OPERATIONS', default=''),
+    'TOP_OPERATIONS': 50,
+}
+
+# graphview requests carrying X-Profile, from staff or with a token from the profile_token command,
+# are sampled and saved here as folded stacks (flamegraph.pl, speedscope) next to their SQL log
+GRAPHQL_PROFILING = {
+    'DIRECTORY': config('GRAPHQL_PROFILE_DIR', default=str(BASE_DIR / 'profiles')),
+    'SAMPLE_INTERVAL': 0.002,
+    'TOKEN_MAX_AGE': 60 * 60,
+}
+
+# queries slower than this are aggregated by fingerprint into SlowQuery, 0 turns the log off;
+# on postgres the flusher thread runs a sample of the slow SELECTs again under EXPLAIN (ANALYZE, BUFFERS),
+# locking SELECTs and ones that only call functions just get a plain EXPLAIN
+SLOW_QUERY_LOG = {
+    'THRESHOLD_MS': config('SLOW_QUERY_THRESHOLD_MS', default=500, cast=int),
+    'EXPLAIN_SAMPLE_RATE': 0.05,
+    'FLUSH_INTERVAL': 10,
+}
+
+# admin lists of tables above this many rows show the planner's estimate instead of COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# carts hold their stock this long; the sweeper hands expired holds back
+CART_RESERVATION_SECONDS = 15 * 60
+STOCK_COUNTER_SLOTS = 8
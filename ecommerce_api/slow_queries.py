@@ -0,0 +1,180 @@
+import atexit
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# the GraphQL operation being executed and the path of the resolver that ran last; queries
+# a DataLoader batches up are put down to whichever resolver triggered the batch
+current_operation = ContextVar("current_operation", default=None)
+
+explaining = threading.local()
+
+LITERALS = (
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\(\?(?:, \?)*\)"), "(...)"),
+    (re.compile(r"\s+"), " "),
+)
+
+# EXPLAIN ANALYZE runs the statement: locks would be taken and functions like setval() or
+# pg_advisory_lock() would act again, so these only get a plain EXPLAIN, which runs nothing
+LOCKING = re.compile(r"\bFOR (?:UPDATE|NO KEY UPDATE|SHARE|KEY SHARE)\b|\bSKIP LOCKED\b|\bNOWAIT\b", re.I)
+SIDE_EFFECTS = re.compile(
+    r"\b(?:setval|nextval|pg_(?:try_)?advisory\w*|pg_notify|set_config|pg_cancel_backend|pg_terminate_backend|lo_\w+)\s*\(",
+    re.I)
+READS_TABLE = re.compile(r"\bFROM\b", re.I)
+
+
+def normalize(sql):
+    for pattern, replacement in LITERALS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(query):
+    return hashlib.sha1(query.encode()).hexdigest()
+
+
+def can_analyze(query):
+    # a SELECT reading no table only calls functions; literals are gone from the normalized query
+    return bool(READS_TABLE.search(query)) and not LOCKING.search(query) and not SIDE_EFFECTS.search(query)
+
+
+def redact(params):
+    # numbers and dates are kept to reproduce the query, text may be a password, token or email
+    if isinstance(params, dict):
+        return {name: redact(value) for name, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [redact(value) for value in params]
+    if isinstance(params, (str, bytes, bytearray, memoryview)):
+        return "<redacted>"
+    return params
+
+
+def explain(alias, sql, params, analyze=True):
+    explaining.active = True
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {sql}" if analyze else f"EXPLAIN {sql}", params)
+            return "\n".join(row[0] for row in cursor.fetchall())
+    except Exception:
+        logger.warning("Could not EXPLAIN slow query", exc_info=True)
+        return ""
+    finally:
+        explaining.active = False
+
+
+class SlowQueryBuffer:
+    def __init__(self):
+        self.pending = {}
+        self.explains = {}
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def record(self, db, sql, params, many, ms):
+        query = normalize(sql)
+        key = fingerprint(query)
+        operation = current_operation.get()
+
+        with self.lock:
+            entry = self.pending.get(key, None)
+            if entry is None:
+                entry = self.pending[key] = {
+                    "query": query, "database": db.alias, "calls": 0, "total_ms": 0, "max_ms": 0, "plan": "",
+                }
+            entry["calls"] += 1
+            entry["total_ms"] += ms
+            entry["last_seen"] = timezone.now()
+            if ms > entry["max_ms"]:
+                entry.update({
+                    "max_ms": ms,
+                    "operation": operation["name"] if operation else "",
+                    "path": ".".join(str(part) for part in operation["path"] or []) if operation else "",
+                    "example": sql if many else f"{sql}\n-- params: {redact(params)!r}",
+                })
+            # EXPLAIN ANALYZE runs the query again, so only a sample of SELECTs, once per flush,
+            # and on the flusher's own connection rather than the request's
+            if key not in self.explains and not many and db.vendor == "postgresql" \
+                    and sql.lstrip()[:6].upper() == "SELECT" \
+                    and random.random() < settings.SLOW_QUERY_LOG["EXPLAIN_SAMPLE_RATE"]:
+                self.explains[key] = (db.alias, sql, params, can_analyze(query))
+
+        self.start()
+
+    def start(self):
+        # the flusher belongs to the process that records, so start it lazily after any fork
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(settings.SLOW_QUERY_LOG["FLUSH_INTERVAL"])
+            self.safe_flush()
+            connections.close_all()
+
+    def safe_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Could not flush slow queries")
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            explains, self.explains = self.explains, {}
+
+        for key, (alias, sql, params, analyze) in explains.items():
+            pending[key]["plan"] = explain(alias, sql, params, analyze)
+
+        write_slow_queries(pending)
+
+
+def write_slow_queries(entries):
+    from query_controller.models import SlowQuery
+
+    for key, entry in entries.items():
+        slowest = {field: entry[field] for field in ("max_ms", "operation", "path", "example")}
+        _, created = SlowQuery.objects.get_or_create(fingerprint=key, defaults=entry)
+        if created:
+            continue
+
+        SlowQuery.objects.filter(fingerprint=key).update(
+            calls=F("calls") + entry["calls"], total_ms=F("total_ms") + entry["total_ms"],
+            last_seen=entry["last_seen"])
+        SlowQuery.objects.filter(fingerprint=key, max_ms__lt=entry["max_ms"]).update(**slowest)
+        if entry["plan"]:
+            SlowQuery.objects.filter(fingerprint=key).update(plan=entry["plan"])
+
+
+slow_query_buffer = SlowQueryBuffer()
+atexit.register(slow_query_buffer.safe_flush)
+
+
+def log_slow_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    ms = (time.perf_counter() - started) * 1000
+
+    if ms >= settings.SLOW_QUERY_LOG["THRESHOLD_MS"] and not getattr(explaining, "active", False):
+        slow_query_buffer.record(context["connection"], sql, params, many, ms)
+    return result
@@ -0,0 +1,409 @@
+import gzip
+import json
+import math
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from product_controller.models import Cart
+from product_controller.tests import GraphQLTestCase
+from user_controller.models import User
+from . import documents
+from .authentication import TokenManager
+from .documents import document_backend
+from .profiling import HEADER, profile_token
+from .responses import brotli, etag_matches
+from .slow_queries import SlowQueryBuffer, fingerprint, normalize, redact
+from .throttling import LocalBucketStore, CacheBucketStore, LoadShedder, operation_cost, in_flight_limit, load_shedder
+from .views import describe_operation
+from .warmup import top_operations, warm_up
+
+
+def admission(**config):
+    return override_settings(GRAPHQL_ADMISSION={**settings.GRAPHQL_ADMISSION, **config})
+
+
+class DescribeOperationTests(SimpleTestCase):
+    def test_root_fields(self):
+        self.assertEqual(describe_operation("{ products { total } categories { total } }", None),
+                         ("query", ["products", "categories"]))
+
+    def test_fragments_at_the_root(self):
+        query = """
+            mutation Login {
+                ...login
+                ... on Mutation { registerUser(email: "a", password: "b") { status } }
+            }
+            fragment login on Mutation {
+                loginUser(email: "a", password: "b") { access }
+                ...again
+            }
+            fragment again on Mutation { ...login getAccess(refresh: "c") { access } }
+        """
+        self.assertEqual(describe_operation(query, "Login"), ("mutation", ["loginUser", "getAccess", "registerUser"]))
+        self.assertEqual(operation_cost(describe_operation(query, "Login")[1]), 100)
+
+    def test_operation_name(self):
+        query = "query A { products { total } } mutation B { completePayment { status } }"
+        self.assertEqual(describe_operation(query, "B"), ("mutation", ["completePayment"]))
+        self.assertEqual(describe_operation(query, "C"), (None, []))
+        self.assertEqual(describe_operation("{", None), (None, []))
+
+
+class ThrottleTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_buckets(self):
+        for store in (LocalBucketStore(), CacheBucketStore()):
+            with self.subTest(store=type(store).__name__):
+                self.assertEqual(store.consume("key", 6, rate=1, burst=10), 0)
+                self.assertEqual(store.consume("other", 6, rate=1, burst=10), 0)
+                # four tokens left, two more take two seconds to come back
+                self.assertAlmostEqual(store.consume("key", 6, rate=1, burst=10), 2, places=1)
+
+    def test_buckets_refill(self):
+        for store in (LocalBucketStore(), CacheBucketStore()):
+            with self.subTest(store=type(store).__name__), mock.patch("time.monotonic") as monotonic, \
+                    mock.patch("time.time") as now:
+                monotonic.return_value = now.return_value = 1000
+                store.consume("key", 10, rate=1, burst=10)
+                monotonic.return_value = now.return_value = 1005
+                self.assertEqual(store.consume("key", 5, rate=1, burst=10), 0)
+                self.assertGreater(store.consume("key", 1, rate=1, burst=10), 0)
+
+    def test_cost_is_capped_at_the_burst(self):
+        with admission(BURST=60):
+            self.assertEqual(operation_cost(["loginUser", "registerUser"]), 60)
+            self.assertEqual(operation_cost([]), 1)
+
+    def test_shedder(self):
+        shedder = LoadShedder()
+        self.assertTrue(shedder.acquire(2))
+        self.assertTrue(shedder.acquire(2))
+        self.assertFalse(shedder.acquire(2))
+        shedder.release()
+        self.assertTrue(shedder.acquire(2))
+
+    def test_in_flight_limits(self):
+        with admission(QUERY_IN_FLIGHT=3, MAX_IN_FLIGHT=5):
+            self.assertEqual(in_flight_limit("query", ["products"]), 3)
+            self.assertEqual(in_flight_limit("mutation", ["loginUser"]), 5)
+            self.assertEqual(in_flight_limit("mutation", ["completePayment", "createCartItem"]), math.inf)
+            self.assertEqual(in_flight_limit("mutation", ["completePayment", "loginUser"]), 5)
+
+
+class AdmissionTests(GraphQLTestCase):
+    def tearDown(self):
+        load_shedder.in_flight = 0
+
+    def test_rate_limit(self):
+        spread = "{ ...list } fragment list on Query { products { total } }"
+
+        with admission(RATE=1, BURST=10):
+            self.assertEqual(self.graphql("{ products { total } }").status_code, 200)
+            # products spread in from a fragment cost their full weight
+            self.assertEqual(self.graphql(spread).status_code, 200)
+            response = self.graphql(spread)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response["Retry-After"]), 4)
+
+    def test_buckets_are_per_client(self):
+        with admission(RATE=1, BURST=5):
+            self.assertEqual(self.graphql("{ products { total } }", REMOTE_ADDR="10.0.0.1").status_code, 200)
+            self.assertEqual(self.graphql("{ products { total } }", REMOTE_ADDR="10.0.0.1").status_code, 429)
+            self.assertEqual(self.graphql("{ products { total } }", REMOTE_ADDR="10.0.0.2").status_code, 200)
+
+    def test_load_shedding(self):
+        # a burst big enough that nothing here is throttled
+        with admission(QUERY_IN_FLIGHT=2, MAX_IN_FLIGHT=4, BURST=1000):
+            load_shedder.in_flight = 2
+            response = self.graphql("{ categories { total } }")
+            self.assertEqual((response.status_code, response["Retry-After"]), (503, "1"))
+
+            # mutations have more room, and priority ones are never shed
+            self.assertEqual(len(self.errors('mutation { loginUser(email: "a", password: "b") { access } }')), 1)
+            load_shedder.in_flight = 4
+            self.assertEqual(self.graphql('mutation { loginUser(email: "a", password: "b") { access } }').status_code, 503)
+            self.assertEqual(len(self.errors("mutation { completePayment { status } }")), 1)
+            self.assertEqual(load_shedder.in_flight, 4)
+
+
+def batch_settings(**config):
+    return override_settings(GRAPHQL_BATCH={**settings.GRAPHQL_BATCH, **config})
+
+
+class BatchTests(GraphQLTestCase):
+    def batch(self, operations, user=None):
+        headers = {}
+        if user:
+            headers["HTTP_AUTHORIZATION"] = f"JWT {TokenManager.get_token(5, {'user_id': user.id})}"
+        return self.client.post("/graphview/", operations, content_type="application/json", **headers)
+
+    def test_answers_in_order(self):
+        _, products = self.create_catalog(2)
+        with self.assertLogs("graphql.execution.utils", "ERROR"):
+            response = self.batch([
+                {"id": 1, "query": "query($id: ID!) { product(id: $id) { name } }", "variables": {"id": products[1].id}},
+                {"id": 2, "query": "{ categories { results { name } } }"},
+                {"id": 3, "query": "{ product(id: 0) { name } }"},
+            ])
+
+        self.assertEqual(response.status_code, 200)
+        content = response.json()
+        self.assertEqual([item["id"] for item in content], [1, 2, 3])
+        self.assertEqual(content[0]["data"], {"product": {"name": "Product1"}})
+        self.assertEqual(content[1]["data"], {"categories": {"results": [{"name": "Category"}]}})
+        # one failing operation doesn't fail the others
+        self.assertEqual(content[2]["errors"][0]["message"], "Product matching query does not exist.")
+
+    def test_mutations_drop_loader_caches(self):
+        _, products = self.create_catalog(1)
+        user = User.objects.create_user("buyer@example.com", "password", first_name="first", last_name="last")
+        in_cart = {"query": "{ products { results { inCart } } }"}
+
+        content = self.batch([
+            in_cart,
+            {"query": "mutation($id: ID!) { createCartItem(productId: $id, quantity: 1) { cartItem { id } } }",
+             "variables": {"id": products[0].id}},
+            in_cart,
+        ], user).json()
+
+        self.assertEqual([item["data"]["products"]["results"][0]["inCart"] for item in (content[0], content[2])],
+                         [False, True])
+        self.assertTrue(Cart.objects.filter(user=user).exists())
+
+    def test_size_limit(self):
+        with batch_settings(MAX_SIZE=2):
+            response = self.batch([{"query": "{ categories { total } }"}] * 3)
+        self.assertEqual(response.status_code, 400)
+
+    def test_authenticates_once(self):
+        user = User.objects.create_user("buyer@example.com", "password", first_name="first", last_name="last")
+        with mock.patch("ecommerce_api.authentication.Authentication.get_user", return_value=user) as get_user:
+            content = self.batch([{"query": "{ me { email } }"}] * 3, user).json()
+
+        self.assertEqual([item["data"]["me"]["email"] for item in content], ["buyer@example.com"] * 3)
+        get_user.assert_called_once()
+
+
+class ParallelBatchTests(TransactionTestCase):
+    # the operations run on threads of their own, with connections that only see committed rows
+    def test_queries_run_in_parallel(self):
+        _, products = GraphQLTestCase.create_catalog(3)
+        query = "query($id: ID!) { product(id: $id) { name } }"
+        operations = [{"id": product.id, "query": query, "variables": {"id": product.id}} for product in products]
+
+        with batch_settings(PARALLEL=True), ThreadPoolExecutor(2) as pool, \
+                mock.patch("ecommerce_api.views.get_batch_pool", return_value=pool) as get_pool:
+            content = self.client.post("/graphview/", operations, content_type="application/json").json()
+
+        self.assertEqual(get_pool.call_count, len(operations))
+
+        self.assertEqual([item["data"]["product"]["name"] for item in content],
+                         ["Product0", "Product1", "Product2"])
+
+
+class ResponseTests(GraphQLTestCase):
+    query = "{ products { results { name description } } }"
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalog(10)
+
+    def test_etag_revalidation(self):
+        response = self.graphql(self.query)
+        etag = response["ETag"]
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+
+        for header in (etag, f"W/{etag}", f'"other", {etag}', f'{etag[:-1]}-gzip"', f'W/{etag[:-1]}-br"', "*"):
+            with self.subTest(header):
+                response = self.graphql(self.query, HTTP_IF_NONE_MATCH=header)
+                self.assertEqual((response.status_code, response.content), (304, b""))
+
+        self.assertEqual(self.graphql(self.query, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_mutations_are_not_cached(self):
+        with self.assertLogs("graphql.execution.utils", "ERROR"):
+            response = self.graphql('mutation { loginUser(email: "a", password: "b") { access } }',
+                                    HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+
+    @override_settings(GRAPHQL_RESPONSE={**settings.GRAPHQL_RESPONSE, "COMPRESS_MIN_BYTES": 100})
+    def test_compression(self):
+        self.assertEqual(self.graphql("{ categories { total } }", HTTP_ACCEPT_ENCODING="gzip").get("Content-Encoding"), None)
+        plain = self.graphql(self.query)
+        self.assertNotIn("Content-Encoding", plain)
+
+        response = self.graphql(self.query, HTTP_ACCEPT_ENCODING="gzip;q=0.5, identity")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response["ETag"], f'{plain["ETag"][:-1]}-gzip"')
+
+        if brotli is None:
+            return
+        response = self.graphql(self.query, HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+
+    def test_etag_matches(self):
+        self.assertFalse(etag_matches(None, '"abc"'))
+        self.assertFalse(etag_matches('W/"abcd"', '"abc"'))
+        self.assertTrue(etag_matches(' W/"abc" ', '"abc"'))
+
+
+class ProfilingTests(GraphQLTestCase):
+    query = "{ products { results { name } } }"
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalog(2)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        profiling = override_settings(GRAPHQL_PROFILING={**settings.GRAPHQL_PROFILING, "DIRECTORY": self.directory})
+        profiling.enable()
+        self.addCleanup(profiling.disable)
+
+    def profile(self, profile_id):
+        with open(os.path.join(self.directory, f"{profile_id}.json")) as profile:
+            return json.load(profile)
+
+    def test_token(self):
+        output = StringIO()
+        call_command("profile_token", stdout=output)
+        header, token = output.getvalue().splitlines()[0].split(": ")
+        self.assertEqual(header, HEADER)
+
+        response = self.graphql(self.query, HTTP_X_PROFILE=token)
+        profile_id = response["X-Profile-Id"]
+        self.assertIn("-products-", profile_id)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, f"{profile_id}.folded")))
+
+        profile = self.profile(profile_id)
+        self.assertEqual((profile["operations"], profile["status"]), (["products"], 200))
+        self.assertTrue(any("product_controller_product" in query["sql"] for query in profile["queries"]))
+        self.assertEqual(profile["sql_ms"], round(sum(query["ms"] for query in profile["queries"]), 3))
+
+    def test_staff_need_no_token(self):
+        staff = User.objects.create_superuser("admin@example.com", "password")
+        self.assertIn("X-Profile-Id", self.graphql(self.query, staff, HTTP_X_PROFILE="1"))
+
+        user = User.objects.create_user("user@example.com", "password", first_name="first", last_name="last")
+        self.assertNotIn("X-Profile-Id", self.graphql(self.query, user, HTTP_X_PROFILE="1"))
+
+    def test_unprofiled_requests(self):
+        self.assertNotIn("X-Profile-Id", self.graphql(self.query))
+        self.assertNotIn("X-Profile-Id", self.graphql(self.query, HTTP_X_PROFILE=f"{profile_token()}x"))
+        with override_settings(GRAPHQL_PROFILING={**settings.GRAPHQL_PROFILING, "TOKEN_MAX_AGE": -1}):
+            self.assertNotIn("X-Profile-Id", self.graphql(self.query, HTTP_X_PROFILE=profile_token()))
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+@override_settings(SLOW_QUERY_LOG={**settings.SLOW_QUERY_LOG, "EXPLAIN_SAMPLE_RATE": 1})
+class SlowQueryTests(SimpleTestCase):
+    def setUp(self):
+        self.buffer = SlowQueryBuffer()
+        self.buffer.start = mock.Mock()
+        self.db = mock.Mock(alias="default", vendor="postgresql")
+
+    def record(self, sql, params=(), many=False):
+        self.buffer.record(self.db, sql, params, many, 600)
+        return self.buffer.pending[fingerprint(normalize(sql))]
+
+    def test_params_are_redacted(self):
+        sql = "SELECT id FROM users WHERE email = %s AND password = %s AND id = %s AND joined < %s"
+        joined = date(2020, 1, 1)
+        entry = self.record(sql, ["user@example.com", b"hash", 7, joined])
+
+        self.assertEqual(entry["query"], "SELECT id FROM users WHERE email = ? AND password = ? AND id = ? AND joined < ?")
+        self.assertEqual(entry["example"], f"{sql}\n-- params: ['<redacted>', '<redacted>', 7, {joined!r}]")
+        self.assertNotIn("user@example.com", str(entry))
+        self.assertEqual(redact({"token": "secret", "ids": (1, "two")}), {"token": "<redacted>", "ids": [1, "<redacted>"]})
+
+        # executemany params are left out altogether
+        entry = self.record("INSERT INTO users (email) VALUES (%s)", [["user@example.com"]], many=True)
+        self.assertEqual(entry["example"], "INSERT INTO users (email) VALUES (%s)")
+
+    def test_only_plain_selects_are_analyzed(self):
+        statements = {
+            "SELECT id FROM products WHERE id = %s": True,
+            "SELECT id FROM products WHERE id = %s FOR UPDATE": False,
+            "SELECT id FROM products FOR NO KEY UPDATE SKIP LOCKED": False,
+            "SELECT id FROM products FOR SHARE NOWAIT": False,
+            "SELECT setval(pg_get_serial_sequence('products', 'id'), 10)": False,
+            "SELECT pg_advisory_xact_lock(%s)": False,
+            "SELECT nextval('products_id_seq') FROM generate_series(1, 3)": False,
+            "SELECT 1": False,
+        }
+        for sql in statements:
+            self.record(sql, [1])
+        # writes are never explained
+        self.record("UPDATE products SET price = %s", [1])
+
+        analyzed = {sql: analyze for _, sql, _, analyze in self.buffer.explains.values()}
+        self.assertEqual(analyzed, statements)
+
+        cursor = mock.MagicMock()
+        with mock.patch("ecommerce_api.slow_queries.connections") as connections, \
+                mock.patch("ecommerce_api.slow_queries.write_slow_queries"):
+            connections.__getitem__.return_value.cursor.return_value.__enter__.return_value = cursor
+            self.buffer.flush()
+        explained = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertIn("EXPLAIN (ANALYZE, BUFFERS) SELECT id FROM products WHERE id = %s", explained)
+        self.assertIn("EXPLAIN SELECT id FROM products WHERE id = %s FOR UPDATE", explained)
+        self.assertIn("EXPLAIN SELECT pg_advisory_xact_lock(%s)", explained)
+        self.assertEqual(sum(statement.startswith("EXPLAIN (ANALYZE") for statement in explained), 1)
+
+
+class WarmUpTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        document_backend.documents.clear()
+
+    def operations_file(self, operations):
+        operations_file = tempfile.NamedTemporaryFile("w", suffix=".json")
+        json.dump(operations, operations_file)
+        operations_file.flush()
+        self.addCleanup(operations_file.close)
+        return operations_file.name
+
+    def test_documents_are_parsed_once(self):
+        with mock.patch.object(documents, "parse", wraps=documents.parse) as parse:
+            for _ in range(3):
+                self.data("{ categories { total } }")
+            self.graphql("{ categories { missing } }")
+            self.graphql("{ categories { missing } }")
+        self.assertEqual(parse.call_count, 2)
+
+    def test_top_operations(self):
+        path = self.operations_file([
+            {"query": "a", "count": 1}, {"query": "b", "count": 5}, {"query": "c"}, {"query": "d", "count": 3}
+        ])
+        self.assertEqual(top_operations(path, 2), ["b", "d"])
+
+    def test_warm_up(self):
+        path = self.operations_file([
+            {"query": "{ categories { total } }", "count": 2}, {"query": "{ missing }", "count": 1}
+        ])
+        config = {**settings.GRAPHQL_WARMUP, "OPERATIONS_FILE": path}
+
+        with override_settings(GRAPHQL_WARMUP=config), mock.patch("product_controller.autocomplete.prefix_index") as index, \
+                self.assertLogs("ecommerce_api.warmup") as logs:
+            warm_up()
+
+        self.assertIsNotNone(document_backend.documents.get("{ categories { total } }"))
+        self.assertTrue(document_backend.documents.get("{ missing }").errors)
+        self.assertIn("Warmed up 2 operation(s), 1 invalid", logs.output[-1])
+        index.build.assert_called_once()
+        index.start.assert_called_once()
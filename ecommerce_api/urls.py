@@ -3,10 +3,12 @@ from django.contrib import admin
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
-from graphene_file_upload.django import FileUploadGraphQLView
 from django.views.decorators.csrf import csrf_exempt
+from .views import GraphQLView
+from product_controller.views import export_request_carts
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphview/', csrf_exempt(FileUploadGraphQLView.as_view(graphiql=True)))
+    path('graphview/', csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path('exports/request-carts/', export_request_carts)
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
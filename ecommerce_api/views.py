@@ -0,0 +1,200 @@
+import copy
+import math
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseBadRequest
+from graphene_django.views import HttpError
+from graphene_file_upload.django import FileUploadGraphQLView
+from graphql import parse
+from graphql.language.ast import Field, FragmentDefinition, FragmentSpread, InlineFragment, OperationDefinition
+
+from .authentication import Authentication
+from .documents import document_backend
+from .loaders import batch_executor
+from .profiling import start_profile
+from .slow_queries import current_operation
+from .responses import encode_json, finalize_response
+from .throttling import throttle, in_flight_limit, load_shedder
+
+
+def root_fields(selection_set, fragments, seen=()):
+    # fragments spread at the root select root fields too, and are costed like them
+    fields = []
+    for selection in selection_set.selections:
+        if isinstance(selection, Field):
+            fields.append(selection.name.value)
+        elif isinstance(selection, InlineFragment):
+            fields += root_fields(selection.selection_set, fragments, seen)
+        elif isinstance(selection, FragmentSpread):
+            name = selection.name.value
+            if name in fragments and name not in seen:
+                fields += root_fields(fragments[name].selection_set, fragments, (*seen, name))
+    return fields
+
+
+def describe_operation(query, operation_name):
+    document = document_backend.documents.get(query)
+    try:
+        document = document.document_ast if document else parse(query)
+    except Exception:
+        return None, []
+
+    fragments = {
+        definition.name.value: definition for definition in document.definitions
+        if isinstance(definition, FragmentDefinition)
+    }
+    for definition in document.definitions:
+        if not isinstance(definition, OperationDefinition):
+            continue
+        if operation_name and (not definition.name or definition.name.value != operation_name):
+            continue
+
+        return definition.operation, root_fields(definition.selection_set, fragments)
+
+    return None, []
+
+
+batch_pool = None
+
+
+def get_batch_pool():
+    global batch_pool
+    if batch_pool is None:
+        batch_pool = ThreadPoolExecutor(settings.GRAPHQL_BATCH["WORKERS"], thread_name_prefix="graphql-batch")
+    return batch_pool
+
+
+def rejection(status, message, retry_after):
+    response = HttpResponse(status=status)
+    response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return HttpError(response, message)
+
+
+class GraphQLView(FileUploadGraphQLView):
+    def dispatch(self, request, *args, **kwargs):
+        request.operation_types = []
+        request.profile = start_profile(request)
+        if request.profile:
+            return self.profiled_dispatch(request, *args, **kwargs)
+
+        return self.finalize(request, super().dispatch(request, *args, **kwargs))
+
+    def profiled_dispatch(self, request, *args, **kwargs):
+        status = None
+        try:
+            response = self.finalize(request, super().dispatch(request, *args, **kwargs))
+            status = response.status_code
+        finally:
+            profile_id = request.profile.finish(status)
+
+        response["X-Profile-Id"] = profile_id
+        return response
+
+    @staticmethod
+    def finalize(request, response):
+        if not response.get("Content-Type", "").startswith("application/json"):
+            return response
+
+        cacheable = bool(request.operation_types) and all(
+            operation_type == "query" for operation_type in request.operation_types)
+        return finalize_response(request, response, cacheable)
+
+    def get_backend(self, request):
+        return document_backend
+
+    def json_encode(self, request, d, pretty=False):
+        if self.pretty or pretty or request.GET.get("pretty"):
+            return super().json_encode(request, d, pretty)
+        return encode_json(d)
+
+    def parse_body(self, request):
+        # a JSON array is a batch of operations, answered with an array in the same order
+        if self.get_content_type(request) == "application/json" and request.body.lstrip()[:1] == b"[":
+            self.batch = True
+
+        data = super().parse_body(request)
+        if not self.batch:
+            return data
+
+        if len(data) > settings.GRAPHQL_BATCH["MAX_SIZE"]:
+            raise HttpError(HttpResponseBadRequest(
+                f"Batches are limited to {settings.GRAPHQL_BATCH['MAX_SIZE']} operations"))
+
+        # a profiled batch stays on the request's thread, the only one sampled
+        if settings.GRAPHQL_BATCH["PARALLEL"] and not request.profile and len(data) > 1 and all(
+            isinstance(entry, dict)
+            and describe_operation(entry.get("query") or "", entry.get("operationName"))[0] == "query"
+            for entry in data
+        ):
+            request.user = Authentication(request).authenticate()
+            request.user_resolved = True
+            return [get_batch_pool().submit(self.get_parallel_response, request, entry) for entry in data]
+
+        return data
+
+    def can_display_graphiql(self, request, data):
+        return not self.batch and super().can_display_graphiql(request, data)
+
+    def get_response(self, request, data, show_graphiql=False):
+        if isinstance(data, Future):
+            return data.result()
+        return super().get_response(request, data, show_graphiql)
+
+    def get_parallel_response(self, request, data):
+        # queries only, each on its own thread and connection; auth is still shared,
+        # loaders are not since they aren't thread-safe
+        operation_request = copy.copy(request)
+        operation_request.loaders = {}
+        try:
+            return super().get_response(operation_request, data)
+        finally:
+            connection.close()
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        if not query:
+            return super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql)
+
+        operation_type, fields = describe_operation(query, operation_name)
+        request.operation_types.append(operation_type)
+        name = operation_name or "-".join(fields) or operation_type
+        if request.profile:
+            request.profile.operations.append(name)
+
+        retry_after = throttle(self.client_key(request), fields)
+        if retry_after:
+            raise rejection(429, "Too many requests, slow down", retry_after)
+
+        if not load_shedder.acquire(in_flight_limit(operation_type, fields)):
+            raise rejection(503, "Server is busy, try again shortly", 1)
+
+        self.executor = request.batch_executor = batch_executor
+        batch_executor.jobs.clear()
+        operation = current_operation.set({"name": name, "path": None})
+        try:
+            return super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql)
+        finally:
+            current_operation.reset(operation)
+            load_shedder.release()
+            # later operations of the batch must not read what a mutation changed from a loader cache
+            if operation_type != "query":
+                request.loaders = {}
+
+    @staticmethod
+    def client_key(request):
+        try:
+            decoded_data = Authentication(request).validate_request()
+        except Exception:
+            decoded_data = None
+
+        if decoded_data:
+            return f"user:{decoded_data['user_id']}"
+
+        address = request.META.get("REMOTE_ADDR", "")
+        if settings.GRAPHQL_ADMISSION["TRUST_X_FORWARDED_FOR"]:
+            address = request.META.get("HTTP_X_FORWARDED_FOR", address).split(",")[0].strip()
+
+        return f"ip:{address}"
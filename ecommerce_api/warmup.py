@@ -0,0 +1,51 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+from graphene_django.settings import graphene_settings
+
+from .documents import document_backend
+
+logger = logging.getLogger(__name__)
+
+
+def top_operations(path, limit):
+    with open(path) as operations_file:
+        operations = json.load(operations_file)
+
+    operations.sort(key=lambda operation: operation.get("count", 0), reverse=True)
+    return [operation["query"] for operation in operations[:limit]]
+
+
+def warm_up():
+    # meant to run in each worker before it takes traffic; connections opened in a
+    # preloading master would be shared across the forked workers
+    config = settings.GRAPHQL_WARMUP
+    started = time.perf_counter()
+
+    schema = graphene_settings.SCHEMA
+    operations = top_operations(config["OPERATIONS_FILE"], config["TOP_OPERATIONS"]) \
+        if config["OPERATIONS_FILE"] else []
+
+    invalid = 0
+    for query in operations:
+        try:
+            errors = document_backend.document_from_string(schema, query).errors
+        except Exception as e:
+            errors = [e]
+
+        if errors:
+            invalid += 1
+            logger.warning("Warm-up operation is invalid: %s", errors[0])
+
+    for alias in connections:
+        connections[alias].ensure_connection()
+
+    from product_controller.autocomplete import prefix_index
+    prefix_index.build()
+    prefix_index.start()
+
+    logger.info("Warmed up %s operation(s), %s invalid, in %.0fms",
+                len(operations), invalid, (time.perf_counter() - started) * 1000)
@@ -12,5 +12,12 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_api.settings')
+os.environ.setdefault('SERVE_WEBSOCKETS', 'False')
 
 application = get_wsgi_application()
+
+from django.conf import settings
+
+if settings.GRAPHQL_WARMUP['ENABLED']:
+    from .warmup import warm_up
+    warm_up()
@@ -1,11 +1,79 @@
 from django.contrib import admin
+
+from ecommerce_api.admin import LargeTableAdmin
 from .models import (
-    Category, Business, Product, ProductComment, 
-    ProductImage, Wish, Cart, RequestCart
-) 
+    Category, Business, Product, ProductComment,
+    ProductImage, Wish, WishProduct, Cart, RequestCart
+)
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ("name", "created_at")
+    # on postgres Django gives unique varchar columns (category and business name, user email)
+    # a varchar_pattern_ops index that LIKE 'x%' uses; product name has its own
+    search_fields = ("name__startswith",)
+
+
+@admin.register(Business)
+class BusinessAdmin(admin.ModelAdmin):
+    list_display = ("name", "user", "created_at")
+    list_select_related = ("user",)
+    autocomplete_fields = ("user",)
+    search_fields = ("name__startswith",)
+
+
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ("name", "business", "category", "price", "total_available", "created_at")
+    autocomplete_fields = ("business", "category")
+    search_fields = ("name__startswith",)
+
+    def get_queryset(self, request):
+        # __str__ reads the business, autocomplete results included; the changelist ignores
+        # list_select_related once the queryset already has one, so category is joined here too
+        return super().get_queryset(request).select_related("business", "category")
+
+
+@admin.register(ProductImage)
+class ProductImageAdmin(LargeTableAdmin):
+    list_display = ("__str__", "is_cover", "created_at")
+    list_select_related = ("product__business", "image")
+    autocomplete_fields = ("product",)
+    raw_id_fields = ("image",)
+
+
+@admin.register(ProductComment)
+class ProductCommentAdmin(LargeTableAdmin):
+    list_display = ("product", "user", "rate", "created_at")
+    list_select_related = ("product__business", "user")
+    autocomplete_fields = ("product", "user")
+
+
+class WishProductInline(admin.TabularInline):
+    model = WishProduct
+    autocomplete_fields = ("product",)
+    readonly_fields = ("created_at",)
+    extra = 0
+
+
+@admin.register(Wish)
+class WishAdmin(LargeTableAdmin):
+    list_display = ("user", "created_at")
+    list_select_related = ("user",)
+    autocomplete_fields = ("user",)
+    inlines = (WishProductInline,)
+
+
+@admin.register(Cart)
+class CartAdmin(LargeTableAdmin):
+    list_display = ("__str__", "quantity", "created_at")
+    list_select_related = ("product", "user")
+    autocomplete_fields = ("product", "user")
 
 
-admin.site.register((
-    Category, Business, Product, ProductComment, 
-    ProductImage, Wish, Cart, RequestCart,
-))
+@admin.register(RequestCart)
+class RequestCartAdmin(LargeTableAdmin):
+    list_display = ("product", "business", "user", "quantity", "price", "created_at")
+    list_select_related = ("product__business", "business", "user")
+    autocomplete_fields = ("product", "business", "user")
@@ -1,5 +1,75 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.db import connections, transaction
+from django.db.models.signals import post_migrate, post_save, post_delete
+
+
+def create_request_cart_partitions(sender, **kwargs):
+    from .partitions import partitioning_enabled, ensure_partitions
+    from .tasks import schedule_partition_maintenance
+
+    if partitioning_enabled():
+        ensure_partitions()
+        schedule_partition_maintenance()
+
+
+def drop_new_cross_shard_constraints(sender, **kwargs):
+    from .sharding import sharding_enabled, shards, drop_cross_shard_constraints
+
+    # tables added after rebalance_shards --prepare come with foreign keys to products again
+    if sharding_enabled() and all(connections[alias].vendor == "postgresql" for alias in shards()):
+        drop_cross_shard_constraints()
+
+
+def replicate_saved_row(sender, instance, using, created, **kwargs):
+    from .models import Business
+    from .sharding import HOME, sharding_enabled, replicate, place_business
+
+    if not sharding_enabled() or using != HOME:
+        return
+
+    if created and sender is Business:
+        place_business(instance)
+    transaction.on_commit(lambda: replicate(sender, instance))
+
+
+def replicate_deleted_row(sender, instance, using, **kwargs):
+    from .sharding import HOME, sharding_enabled, replicate
+
+    if sharding_enabled() and using == HOME:
+        transaction.on_commit(lambda: replicate(sender, instance, deleted=True))
+
+
+def emit_category_saved(sender, instance, using, created, **kwargs):
+    from . import outbox
+    from .sharding import HOME
+
+    # shard copies are saved through here too, the event is only for the row at home
+    if using == HOME:
+        outbox.emit(outbox.CATEGORY, outbox.CREATED if created else outbox.UPDATED, instance.id, name=instance.name)
+
+
+def emit_category_deleted(sender, instance, using, **kwargs):
+    from . import outbox
+    from .sharding import HOME
+
+    if using == HOME:
+        outbox.emit(outbox.CATEGORY, outbox.DELETED, instance.id)
 
 
 class ProductControllerConfig(AppConfig):
     name = 'product_controller'
+
+    def ready(self):
+        from ecommerce_api.channel_layer import check_channel_layer
+        from .models import Category, Business
+
+        checks.register(check_channel_layer)
+
+        post_migrate.connect(create_request_cart_partitions, sender=self)
+        post_migrate.connect(drop_new_cross_shard_constraints, sender=self)
+        for model in (Category, Business):
+            post_save.connect(replicate_saved_row, sender=model)
+            post_delete.connect(replicate_deleted_row, sender=model)
+        post_save.connect(emit_category_saved, sender=Category)
+        post_delete.connect(emit_category_deleted, sender=Category)
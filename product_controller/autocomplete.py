@@ -0,0 +1,178 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Category, Business, Product, CatalogEvent
+from . import outbox
+
+# smallest tables first so they always fit under AUTOCOMPLETE_MAX_ENTRIES
+KINDS = {
+    outbox.CATEGORY: Category,
+    outbox.BUSINESS: Business,
+    outbox.PRODUCT: Product,
+}
+SEPARATOR = "\x00"
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(kind, entity_id, name):
+    # one string per entry: sorts by the lowered name, and carries everything needed to answer
+    return SEPARATOR.join((name.lower(), kind, str(entity_id), name))
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.keys = None
+        self.entries = {}
+        self.position = 0
+        self.gaps = {}
+        self.pid = None
+
+    def build(self):
+        from .sharding import HOME, shards
+
+        settled = timezone.now() - timedelta(seconds=settings.CATALOG_OUTBOX_SETTLE_SECONDS)
+        position = CatalogEvent.objects.filter(created_at__lte=settled).aggregate(
+            position=Max("id"))["position"] or 0
+        keys, entries = [], {kind: {} for kind in KINDS}
+
+        for kind, model in KINDS.items():
+            # products come from every shard, the other tables are whole at home
+            for alias in (shards() if model is Product else [HOME]):
+                rows = model.objects.using(alias).order_by().values_list("id", "name").iterator(chunk_size=10000)
+                for entity_id, name in rows:
+                    if len(keys) >= settings.AUTOCOMPLETE_MAX_ENTRIES:
+                        break
+                    # a business being moved has its products on two shards for a moment
+                    if entity_id in entries[kind]:
+                        continue
+                    key = make_key(kind, entity_id, name)
+                    keys.append(key)
+                    entries[kind][entity_id] = key
+
+        keys.sort()
+
+        with self.lock:
+            self.keys, self.entries, self.position, self.gaps = keys, entries, position, {}
+
+    def add(self, kind, entity_id, name):
+        self.remove(kind, entity_id)
+        if len(self.keys) >= settings.AUTOCOMPLETE_MAX_ENTRIES:
+            return
+
+        key = make_key(kind, entity_id, name)
+        bisect.insort(self.keys, key)
+        self.entries[kind][entity_id] = key
+
+    def remove(self, kind, entity_id):
+        key = self.entries[kind].pop(entity_id, None)
+        if key is None:
+            return
+
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            del self.keys[index]
+
+    def apply(self, event):
+        if event.entity not in self.entries:
+            return
+
+        if event.action == outbox.DELETED:
+            self.remove(event.entity, event.entity_id)
+        elif "name" in event.data:
+            self.add(event.entity, event.entity_id, event.data["name"])
+
+    def sync(self):
+        # only the sync thread moves the position, the lock just keeps searches off half-applied events
+        while True:
+            events = outbox.read_events(self.position, 1000, self.gaps)
+            with self.lock:
+                for event in events:
+                    self.apply(event)
+            fresh = sum(1 for event in events if event.id > self.position)
+            self.position, self.gaps = outbox.advance(self.position, self.gaps, events)
+            if fresh < 1000:
+                break
+
+    def start(self):
+        # the sync thread belongs to the process that searches, so start it lazily after any fork
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+
+        threading.Thread(target=self.run, name="autocomplete-sync", daemon=True).start()
+
+    def run(self):
+        while True:
+            try:
+                if self.keys is None:
+                    self.build()
+                self.sync()
+            except Exception:
+                logger.exception("Could not sync the autocomplete index")
+            finally:
+                connection.close()
+            time.sleep(settings.AUTOCOMPLETE_SYNC_SECONDS)
+
+    def search(self, prefix, limit):
+        # built by warm_up() before a worker takes traffic, or by the sync thread in the background
+        self.start()
+        if self.keys is None:
+            return search_tables(prefix, limit)
+
+        prefix = prefix.lower().replace(SEPARATOR, "")
+        results = []
+        last = None
+
+        with self.lock:
+            index = bisect.bisect_left(self.keys, prefix)
+            while index < len(self.keys) and len(results) < limit:
+                key = self.keys[index]
+                index += 1
+                if not key.startswith(prefix):
+                    break
+
+                lowered, kind, entity_id, name = key.split(SEPARATOR)
+                # same names sort next to each other, suggest each only once
+                if (lowered, kind) == last:
+                    continue
+                last = (lowered, kind)
+                results.append({"kind": kind, "id": int(entity_id), "name": name})
+
+        return results
+
+
+def search_tables(prefix, limit):
+    from .sharding import scatter
+
+    # the prefix indexes on name, until this worker's index is built; these match case as typed
+    results = []
+    for kind, model in KINDS.items():
+        query = model.objects.filter(name__startswith=prefix).only("id", "name").order_by("name")
+        if model is Product:
+            query = scatter(query)
+        results += [(item.name.lower(), kind, item.id, item.name) for item in query[:limit]]
+
+    suggestions, last = [], None
+    for lowered, kind, entity_id, name in sorted(results):
+        if (lowered, kind) != last and len(suggestions) < limit:
+            suggestions.append({"kind": kind, "id": entity_id, "name": name})
+        last = (lowered, kind)
+    return suggestions
+
+
+prefix_index = PrefixIndex()
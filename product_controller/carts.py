@@ -0,0 +1,72 @@
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Count, F, FloatField, Sum
+from django.utils import timezone
+
+from .models import Business, Cart, Product, RequestCart
+from .sharding import sharding_enabled, get_products, bulk_create_by_business
+
+
+def cart_products(user_id):
+    # carts live at home and products on their business's shard, so prices are fetched per shard
+    carts = list(Cart.objects.filter(user_id=user_id).values_list("product_id", "quantity"))
+    products = get_products({product_id for product_id, _ in carts}, Product.objects.only("id", "business_id", "price"))
+    return [(products[product_id], quantity) for product_id, quantity in carts]
+
+
+def business_subtotals(user_id):
+    if not sharding_enabled():
+        return list(Cart.objects.filter(user_id=user_id).values(
+            business_id=F("product__business_id"), business_name=F("product__business__name")
+        ).annotate(
+            items=Count("id"), units=Sum("quantity"),
+            subtotal=Sum(F("quantity") * F("product__price"), output_field=FloatField())
+        ).order_by("business_id"))
+
+    totals = defaultdict(lambda: {"items": 0, "units": 0, "subtotal": 0})
+    for product, quantity in cart_products(user_id):
+        row = totals[product.business_id]
+        row["items"] += 1
+        row["units"] += quantity
+        row["subtotal"] += quantity * product.price
+
+    names = dict(Business.objects.filter(id__in=totals).values_list("id", "name"))
+    return [
+        {"business_id": business_id, "business_name": names.get(business_id), **row}
+        for business_id, row in sorted(totals.items())
+    ]
+
+
+def order_carts(user_id):
+    created_at = timezone.now()
+
+    if sharding_enabled():
+        return bulk_create_by_business(RequestCart, [
+            RequestCart(
+                user_id=user_id,
+                business_id=product.business_id,
+                product_id=product.id,
+                quantity=quantity,
+                price=quantity * product.price
+            ) for product, quantity in cart_products(user_id)
+        ])
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO {RequestCart._meta.db_table} (user_id, business_id, product_id, quantity, price, created_at)
+            SELECT cart.user_id, product.business_id, cart.product_id, cart.quantity,
+                cart.quantity * product.price, %s
+            FROM {Cart._meta.db_table} cart
+            JOIN {Product._meta.db_table} product ON product.id = cart.product_id
+            WHERE cart.user_id = %s
+            RETURNING id, business_id, product_id, quantity, price
+        """, [connection.ops.adapt_datetimefield_value(created_at), user_id])
+        rows = cursor.fetchall()
+
+    return [
+        RequestCart(
+            id=id, user_id=user_id, business_id=business_id, product_id=product_id,
+            quantity=quantity, price=price, created_at=created_at
+        ) for id, business_id, product_id, quantity, price in rows
+    ]
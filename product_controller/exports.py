@@ -0,0 +1,64 @@
+import csv
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from ecommerce_api.responses import encode_json
+from .models import RequestCart
+
+COLUMNS = ("id", "created_at", "user_id", "product_id", "product__name", "quantity", "price")
+HEADER = ("id", "created_at", "user_id", "product_id", "product_name", "quantity", "price")
+
+
+class Lines:
+    # csv.writer wants a file, this one just hands back what it is given
+    def write(self, value):
+        return value
+
+
+def order_rows(db, business_id, start_date=None, end_date=None, product_ids=None):
+    query = RequestCart.objects.using(db).filter(business_id=business_id)
+
+    if start_date:
+        query = query.filter(created_at__gte=timezone.make_aware(datetime.combine(start_date, time.min)))
+
+    if end_date:
+        query = query.filter(created_at__lt=timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min)))
+
+    if product_ids:
+        query = query.filter(product_id__in=product_ids)
+
+    # a server-side cursor on postgres, so only one chunk of rows is ever held in memory
+    chunk_size = settings.ORDER_EXPORT_CHUNK_SIZE
+    return query.order_by("created_at", "id").values_list(*COLUMNS).iterator(chunk_size=chunk_size)
+
+
+def csv_lines(rows):
+    writer = csv.writer(Lines())
+    yield writer.writerow(HEADER)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield encode_json(dict(zip(HEADER, row))) + "\n"
+
+
+def batched(lines, size):
+    # one write per chunk of rows rather than one per row
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+FORMATS = {
+    "csv": (csv_lines, "text/csv"),
+    "jsonl": (jsonl_lines, "application/x-ndjson"),
+}
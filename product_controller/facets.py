@@ -0,0 +1,103 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, Q
+from graphql.language.ast import Field
+
+FACETS = {"total", "categories", "businesses", "prices", "ratings"}
+RATINGS = range(1, 6)
+
+
+def requested_facets(info):
+    selections = info.field_asts[0].selection_set.selections
+    if not all(isinstance(selection, Field) for selection in selections):
+        return FACETS
+    return {selection.name.value for selection in selections} & FACETS
+
+
+def price_buckets(bounds):
+    bounds = sorted(set(bounds))
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+def count_facets(query, facets, price_bounds):
+    result = {}
+
+    # totals, price buckets and ratings come out of a single row of conditional counts
+    if facets & {"total", "prices", "ratings"}:
+        buckets = price_buckets(price_bounds)
+        aggregates = {"total": Count("id")}
+        counted = query
+
+        for index, (low, high) in enumerate(buckets):
+            condition = Q(price__gte=low) if high is None else Q(price__gte=low, price__lt=high)
+            aggregates[f"price_{index}"] = Count("id", filter=condition)
+
+        if "ratings" in facets:
+            counted = query.annotate(rating=Avg("product_comments__rate"))
+            for rating in RATINGS:
+                aggregates[f"rating_{rating}"] = Count("id", filter=Q(rating__gte=rating, rating__lt=rating + 1))
+
+        row = counted.order_by().aggregate(**aggregates)
+        result["total"] = row["total"]
+        result["prices"] = [
+            {"min": low, "max": high, "count": row[f"price_{index}"]} for index, (low, high) in enumerate(buckets)
+        ]
+        if "ratings" in facets:
+            result["ratings"] = [{"rating": rating, "count": row[f"rating_{rating}"]} for rating in RATINGS]
+
+    # categories and businesses share one GROUP BY over the pairs, summed up here
+    if facets & {"categories", "businesses"}:
+        categories, businesses = {}, {}
+        rows = query.order_by().values(
+            "category_id", "category__name", "business_id", "business__name").annotate(count=Count("id"))
+
+        for row in rows:
+            for counts, key in ((categories, "category"), (businesses, "business")):
+                item = counts.setdefault(row[f"{key}_id"], {
+                    "id": row[f"{key}_id"], "name": row[f"{key}__name"], "count": 0})
+                item["count"] += row["count"]
+
+        result["categories"] = sorted(categories.values(), key=lambda item: -item["count"])
+        result["businesses"] = sorted(businesses.values(), key=lambda item: -item["count"])
+
+    return result
+
+
+def merge_facets(parts):
+    # every product sits on one shard, so each shard's counts simply add up
+    result = {}
+    for part in parts:
+        if "total" in part:
+            result["total"] = result.get("total", 0) + part["total"]
+
+        for name, key in (("prices", "min"), ("ratings", "rating"), ("categories", "id"), ("businesses", "id")):
+            if name not in part:
+                continue
+            merged = result.setdefault(name, {})
+            for item in part[name]:
+                merged.setdefault(item[key], dict(item, count=0))["count"] += item["count"]
+
+    for name in ("prices", "ratings"):
+        if name in result:
+            result[name] = list(result[name].values())
+    for name in ("categories", "businesses"):
+        if name in result:
+            result[name] = sorted(result[name].values(), key=lambda item: -item["count"])
+
+    return result
+
+
+def get_facets(query, signature, facets, price_bounds, databases=("default",)):
+    key = "product-facets:" + hashlib.sha1(json.dumps(
+        [signature, sorted(facets), price_bounds], sort_keys=True, default=str
+    ).encode()).hexdigest()
+
+    result = cache.get(key)
+    if result is None:
+        result = merge_facets([count_facets(query.using(database), facets, price_bounds) for database in databases])
+        cache.set(key, result, settings.PRODUCT_FACETS_CACHE_SECONDS)
+
+    return result
@@ -0,0 +1,75 @@
+from collections import Counter
+
+from django.db.models import Count
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from .models import Product, Wish, Cart, RelatedProduct
+from .sharding import sharding_enabled, shards, get_products
+from .stock import available
+
+
+class WishedLoader(DataLoader):
+    def __init__(self, user_id):
+        super().__init__()
+        self.user_id = user_id
+
+    def batch_load_fn(self, product_ids):
+        wished = set(Wish.products.through.objects.filter(
+            wish__user_id=self.user_id, product_id__in=product_ids
+        ).values_list("product_id", flat=True))
+
+        return Promise.resolve([product_id in wished for product_id in product_ids])
+
+
+class InCartLoader(DataLoader):
+    def __init__(self, user_id):
+        super().__init__()
+        self.user_id = user_id
+
+    def batch_load_fn(self, product_ids):
+        in_cart = set(Cart.objects.filter(
+            user_id=self.user_id, product_id__in=product_ids
+        ).values_list("product_id", flat=True))
+
+        return Promise.resolve([product_id in in_cart for product_id in product_ids])
+
+
+class RelatedProductsLoader(DataLoader):
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+
+    def batch_load_fn(self, product_ids):
+        related = {product_id: [] for product_id in product_ids}
+        # ordering by the product itself would join the products at home only
+        items = RelatedProduct.objects.filter(product_id__in=product_ids, rank__lte=self.limit).order_by("product_id", "rank")
+        if not sharding_enabled():
+            for item in items.select_related("related"):
+                related[item.product_id].append(item.related)
+            return Promise.resolve([related[product_id] for product_id in product_ids])
+
+        items = list(items)
+        products = get_products([item.related_id for item in items])
+        for item in items:
+            if item.related_id in products:
+                related[item.product_id].append(products[item.related_id])
+
+        return Promise.resolve([related[product_id] for product_id in product_ids])
+
+
+class AvailableLoader(DataLoader):
+    def batch_load_fn(self, product_ids):
+        totals = available(product_ids)
+        return Promise.resolve([totals.get(product_id, None) for product_id in product_ids])
+
+
+class CategoryCountLoader(DataLoader):
+    # one GROUP BY per shard, added up
+    def batch_load_fn(self, category_ids):
+        counts = Counter()
+        for alias in shards():
+            counts.update(dict(Product.objects.using(alias).filter(category_id__in=category_ids).values_list(
+                "category_id").annotate(total=Count("id")).order_by()))
+
+        return Promise.resolve([counts[int(category_id)] for category_id in category_ids])
@@ -0,0 +1,27 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from product_controller.partitions import archive_request_carts
+
+
+class Command(BaseCommand):
+    help = "Export RequestCart rows older than a date to gzipped CSV files and remove them from the table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--before", required=True, type=date.fromisoformat,
+                            help="Archive orders created before this date (YYYY-MM-DD)")
+        parser.add_argument("--output-dir", default="archive")
+        parser.add_argument("--keep-detached", action="store_true",
+                            help="Detach cold partitions without dropping them")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Archiving requires PostgreSQL")
+
+        archived = archive_request_carts(options["before"], options["output_dir"], not options["keep_detached"])
+
+        for path in archived:
+            self.stdout.write(f"archived {path}")
+        self.stdout.write(self.style.SUCCESS(f"Archived {len(archived)} file(s)"))
@@ -0,0 +1,54 @@
+import gzip
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from graphene_django.settings import graphene_settings
+from graphene_django.views import instantiate_middleware
+
+from ecommerce_api import responses
+from ecommerce_api.schema import schema
+
+QUERY = """{
+  products(size: %d) {
+    total size current
+    results { id name price description totalAvailable createdAt category { name } business { name } }
+  }
+}"""
+
+
+class Command(BaseCommand):
+    help = "Measure serialization time and bytes on the wire of products pages per page size"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10,20,50,100", help="Comma separated page sizes")
+        parser.add_argument("--repeat", type=int, default=50, help="Encodings timed per page size")
+
+    def handle(self, *args, **options):
+        middleware = list(instantiate_middleware(graphene_settings.MIDDLEWARE))
+        self.stdout.write(f"encoder: {'orjson' if responses.orjson else 'json'}, "
+                          f"brotli: {'yes' if responses.brotli else 'not installed'}")
+        self.stdout.write(f"{'size':>5} {'rows':>5} {'bytes':>9} {'gzip':>8} {'br':>8} {'json ms':>8} {'fast ms':>8}")
+
+        for size in [int(size) for size in options["sizes"].split(",")]:
+            result = schema.execute(QUERY % size, context=RequestFactory().post("/graphview/"), middleware=middleware)
+            data = {"data": result.data}
+            rows = len(result.data["products"]["results"])
+
+            json_ms = self.time(lambda: json.dumps(data, separators=(",", ":")), options["repeat"])
+            fast_ms = self.time(lambda: responses.encode_json(data), options["repeat"])
+
+            content = responses.encode_json(data).encode()
+            gzipped = len(gzip.compress(content, compresslevel=6))
+            brotlied = len(responses.brotli.compress(content, quality=5)) if responses.brotli else "-"
+
+            self.stdout.write(f"{size:>5} {rows:>5} {len(content):>9} {gzipped:>8} {brotlied:>8} "
+                              f"{json_ms:>8.3f} {fast_ms:>8.3f}")
+
+    @staticmethod
+    def time(encode, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            encode()
+        return (time.perf_counter() - start) * 1000 / repeat
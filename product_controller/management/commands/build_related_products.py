@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from product_controller.related import build_related_products, import_numpy
+
+
+class Command(BaseCommand):
+    help = "Build the top-K related products of every product from co-purchase and co-wish signals"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top-k", type=int, help="Neighbours to keep per product, defaults to RELATED_PRODUCTS_TOP_K")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Products scored per matrix product")
+        parser.add_argument("--incremental", action="store_true",
+                            help="Only rescore products ordered since the last build")
+
+    def handle(self, *args, **options):
+        try:
+            import_numpy()
+        except Exception as e:
+            raise CommandError(e)
+
+        total = build_related_products(options["top_k"] or settings.RELATED_PRODUCTS_TOP_K, options["batch_size"], options["incremental"])
+
+        self.stdout.write(self.style.SUCCESS(f"Stored {total} related product rows"))
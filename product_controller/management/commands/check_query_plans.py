@@ -0,0 +1,132 @@
+import json
+import random
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from user_controller.models import User
+from user_controller.schema import Query as UserQuery
+from product_controller.models import Category, Business, Product, ProductImage, Cart, RequestCart
+from product_controller.schema import Query
+
+
+class RollbackSeed(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the querysets built by the resolvers and fail on sequential scans over large tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0,
+                            help="Number of synthetic products/orders to insert (rolled back afterwards)")
+        parser.add_argument("--max-seq-rows", type=int, default=1000,
+                            help="Fail when a Seq Scan touches a table with more rows than this")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Query plan checks require PostgreSQL")
+
+        failures = []
+        try:
+            with transaction.atomic():
+                if options["seed"]:
+                    self.seed(options["seed"])
+                failures = self.check_plans(options["max_seq_rows"])
+                raise RollbackSeed()
+        except RollbackSeed:
+            pass
+
+        if failures:
+            for name, relation, rows in failures:
+                self.stderr.write(f"{name}: Seq Scan on {relation} (~{rows} rows)")
+            raise CommandError(f"{len(failures)} query plan(s) use sequential scans")
+
+        self.stdout.write(self.style.SUCCESS("All resolver query plans use indexes"))
+
+    def check_plans(self, max_seq_rows):
+        sizes = self.table_sizes()
+        failures = []
+
+        for name, queryset in self.resolver_querysets():
+            plan = json.loads(queryset.explain(format="json"))
+            for relation in self.seq_scans(plan[0]["Plan"]):
+                rows = sizes.get(relation, 0)
+                if rows > max_seq_rows:
+                    failures.append((name, relation, rows))
+            self.stdout.write(f"checked {name}")
+
+        return failures
+
+    def resolver_querysets(self):
+        business = Business.objects.select_related("user").first()
+        product = Product.objects.first()
+        if not business or not product:
+            raise CommandError("The database has no businesses/products, run with --seed")
+
+        info = SimpleNamespace(context=SimpleNamespace(user=business.user))
+        page_size = settings.GRAPHENE.get("PAGE_SIZE", 10)
+
+        return [
+            ("users", UserQuery.resolve_users(None, info)[:page_size]),
+            ("categories", Query.resolve_categories(None, info)),
+            ("carts", Query.resolve_carts(None, info)),
+            ("request_carts", Query.resolve_request_carts(None, info)),
+            ("products", Query.resolve_products(None, info)[:page_size]),
+            ("products(mine)", Query.resolve_products(None, info, mine=True)[:page_size]),
+            ("products(category)", Query.resolve_products(None, info, category=product.category.name)[:page_size]),
+            ("products(sort_by)", Query.resolve_products(None, info, sort_by="created_at")[:page_size]),
+            ("products(price)", Query.resolve_products(None, info, sort_by="price", is_asc=True)[:page_size]),
+            ("products(popularity)", Query.resolve_products(None, info, sort_by="popularity")[:page_size]),
+            ("product", Product.objects.filter(id=product.id)),
+            ("product name check", Product.objects.filter(business_id=business.id, name=product.name)),
+        ]
+
+    @classmethod
+    def seq_scans(cls, node, limited=False):
+        # a Seq Scan feeding straight into a Limit stops after one page
+        if node.get("Node Type") == "Seq Scan" and not limited:
+            yield node["Relation Name"]
+        for child in node.get("Plans", []):
+            yield from cls.seq_scans(child, node.get("Node Type") == "Limit")
+
+    @staticmethod
+    def table_sizes():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relname, reltuples::bigint FROM pg_class WHERE relkind IN ('r', 'p')")
+            return dict(cursor.fetchall())
+
+    def seed(self, total):
+        users = User.objects.bulk_create([
+            User(email=f"seed-{i}@example.com", first_name="seed", last_name="seed", password="!")
+            for i in range(max(total // 50, 10))
+        ])
+        businesses = Business.objects.bulk_create([
+            Business(user=user, name=f"seed-business-{i}") for i, user in enumerate(users[: len(users) // 2])
+        ])
+        categories = Category.objects.bulk_create([
+            Category(name=f"seed-category-{i}") for i in range(20)
+        ])
+        products = Product.objects.bulk_create([
+            Product(
+                category=random.choice(categories), business=random.choice(businesses),
+                name=f"seed-product-{i}", price=random.randint(1, 1000), total_available=10,
+                total_count=10, description="seed"
+            ) for i in range(total)
+        ], batch_size=1000)
+        Cart.objects.bulk_create([
+            Cart(product=random.choice(products), user=random.choice(users))
+            for _ in range(total)
+        ], batch_size=1000)
+        RequestCart.objects.bulk_create([
+            RequestCart(
+                product=item, business_id=item.business_id, user=random.choice(users),
+                quantity=1, price=item.price
+            ) for item in random.choices(products, k=total)
+        ], batch_size=1000)
+
+        with connection.cursor() as cursor:
+            for model in (User, Business, Category, Product, ProductImage, Cart, RequestCart):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
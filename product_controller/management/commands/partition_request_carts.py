@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from product_controller.partitions import convert_to_partitioned, ensure_partitions
+from product_controller.tasks import schedule_partition_maintenance
+
+
+class Command(BaseCommand):
+    help = "Convert RequestCart to monthly partitions, create the coming months' and schedule a daily task to keep ahead"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--convert", action="store_true",
+                            help="Convert the existing table into a partitioned table first")
+        parser.add_argument("--ahead", type=int, help="Number of future months to create partitions for")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Partitioning requires PostgreSQL")
+
+        if options["convert"] and convert_to_partitioned(options["ahead"]):
+            self.stdout.write("Converted RequestCart into a partitioned table")
+
+        partitions = ensure_partitions(options["ahead"])
+        if not partitions:
+            raise CommandError("RequestCart is not partitioned, run with --convert")
+
+        schedule_partition_maintenance()
+
+        self.stdout.write(self.style.SUCCESS(f"Partitions ready up to {partitions[-1]}"))
@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SCRIPT = """
+import importlib, json, sys, time
+started = time.perf_counter()
+importlib.import_module(sys.argv[1])
+loaded = time.perf_counter()
+from graphene_django.settings import graphene_settings
+graphene_settings.SCHEMA
+print(json.dumps({"application": loaded - started, "schema": time.perf_counter() - loaded}))
+"""
+
+TARGETS = {
+    "wsgi": "ecommerce_api.wsgi",
+    "asgi": "ecommerce_api.asgi",
+}
+
+
+class Command(BaseCommand):
+    help = "Profile the imports done while a worker boots, grouped by top-level package"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--target", choices=sorted(TARGETS), default="wsgi")
+        parser.add_argument("--top", type=int, default=20, help="Packages and modules to list")
+
+    def handle(self, *args, **options):
+        # this process has already imported everything, so boot a fresh interpreter
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", SCRIPT, TARGETS[options["target"]]],
+            env=env, cwd=settings.BASE_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        if process.returncode:
+            raise CommandError(process.stderr.strip().splitlines()[-1])
+
+        packages = defaultdict(int)
+        modules = []
+        for line in process.stderr.splitlines():
+            if not line.startswith("import time:") or "[us]" in line:
+                continue
+            own, cumulative, name = line[len("import time:"):].split("|")
+            packages[name.strip().split(".")[0]] += int(own)
+            modules.append((int(cumulative), name.rstrip()))
+
+        phases = json.loads(process.stdout.strip().splitlines()[-1])
+        self.stdout.write(f"application {phases['application'] * 1000:.0f}ms, "
+                          f"schema {phases['schema'] * 1000:.0f}ms, "
+                          f"imports {sum(packages.values()) / 1000:.0f}ms")
+
+        self.stdout.write(f"\n{'self ms':>8}  package")
+        for name, own in sorted(packages.items(), key=lambda item: -item[1])[:options["top"]]:
+            self.stdout.write(f"{own / 1000:>8.1f}  {name}")
+
+        self.stdout.write(f"\n{'cum ms':>8}  module")
+        for cumulative, name in sorted(modules, reverse=True)[:options["top"]]:
+            self.stdout.write(f"{cumulative / 1000:>8.1f}  {name}")
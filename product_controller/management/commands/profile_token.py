@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ecommerce_api.profiling import HEADER, profile_token
+
+
+class Command(BaseCommand):
+    help = "Print a signed header that turns on profiling for graphview requests"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{HEADER}: {profile_token()}")
+        self.stdout.write(f"valid for {settings.GRAPHQL_PROFILING['TOKEN_MAX_AGE']} seconds, "
+                          f"profiles are saved to {settings.GRAPHQL_PROFILING['DIRECTORY']}")
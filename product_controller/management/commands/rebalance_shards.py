@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from product_controller.models import Business
+from product_controller.sharding import (
+    sharding_enabled, shards, shard_loads, business_db, move_business, prepare_shards
+)
+
+
+class Command(BaseCommand):
+    help = "Show how businesses spread over the catalog shards and move them between shards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prepare", action="store_true",
+                            help="Copy reference tables, drop cross-shard foreign keys and interleave ids")
+        parser.add_argument("--business", type=int, help="Business to move, with --to")
+        parser.add_argument("--to", help="Shard to move the business to")
+        parser.add_argument("--auto", action="store_true",
+                            help="Move businesses from the fullest shard to the emptiest while it evens them out")
+        parser.add_argument("--max-moves", type=int, default=10)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if not sharding_enabled():
+            raise CommandError("Sharding is off, set SHARD_DATABASES first")
+
+        if options["prepare"]:
+            if not prepare_shards():
+                self.stdout.write("Foreign keys and id sequences are only rewritten on postgres")
+            self.stdout.write("Shards prepared")
+
+        if options["business"]:
+            if options["to"] not in shards():
+                raise CommandError(f"--to must be one of {', '.join(shards())}")
+            if not Business.objects.filter(id=options["business"]).exists():
+                raise CommandError(f"Business {options['business']} does not exist")
+            self.move(options["business"], options["to"], options["dry_run"])
+
+        if options["auto"]:
+            for business_id, target in self.plan(shard_loads(), options["max_moves"]):
+                self.move(business_id, target, options["dry_run"])
+
+        for alias, businesses in shard_loads().items():
+            self.stdout.write(f"{alias}: {len(businesses)} businesses, {sum(businesses.values())} products")
+
+    def move(self, business_id, target, dry_run):
+        source = business_db(business_id)
+        if dry_run:
+            self.stdout.write(f"Would move business {business_id} from {source} to {target}")
+            return
+
+        moved = move_business(business_id, target)
+        self.stdout.write(f"Moved business {business_id} from {source} to {target}, {moved} rows")
+
+    @staticmethod
+    def plan(loads, max_moves):
+        totals = {alias: sum(businesses.values()) for alias, businesses in loads.items()}
+        moves = []
+
+        while len(moves) < max_moves:
+            fullest = max(totals, key=totals.get)
+            emptiest = min(totals, key=totals.get)
+            gap = totals[fullest] - totals[emptiest]
+
+            # the business whose move brings the two closest to even
+            candidates = [(size, business_id) for business_id, size in loads[fullest].items() if 0 < size < gap]
+            if not candidates:
+                break
+            size, business_id = max(candidates, key=lambda item: min(item[0], gap - item[0]))
+
+            moves.append((business_id, emptiest))
+            loads[emptiest][business_id] = loads[fullest].pop(business_id)
+            totals[fullest] -= size
+            totals[emptiest] += size
+
+        return moves
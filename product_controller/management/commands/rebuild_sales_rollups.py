@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from product_controller.rollups import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per business/product/day sales rollups from RequestCart rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--business", type=int, help="Only rebuild the rollups of this business id")
+
+    def handle(self, *args, **options):
+        total = rebuild_sales_rollups(options["business"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} sales rollup rows"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from product_controller.popularity import recompute_popularity
+
+
+class Command(BaseCommand):
+    help = "Recompute every product's popularity score from carts, wishes and orders"
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Recomputing popularity requires PostgreSQL")
+
+        total = recompute_popularity()
+        self.stdout.write(self.style.SUCCESS(f"Recomputed the popularity of {total} products"))
@@ -0,0 +1,30 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from product_controller.outbox import next_batch, acknowledge
+
+
+class Command(BaseCommand):
+    help = "Print catalog change events as JSON lines for a consumer and advance its cursor"
+
+    def add_arguments(self, parser):
+        parser.add_argument("consumer")
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--follow", action="store_true", help="Keep polling for new events")
+        parser.add_argument("--poll-interval", type=float, default=1)
+
+    def handle(self, *args, **options):
+        while True:
+            events = next_batch(options["consumer"], options["batch_size"])
+
+            for event in events:
+                self.stdout.write(json.dumps(event.as_dict()))
+
+            if events:
+                acknowledge(options["consumer"], events)
+            elif options["follow"]:
+                time.sleep(options["poll_interval"])
+            else:
+                break
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def partition_request_carts(apps, schema_editor):
+    from product_controller.partitions import partitioning_enabled, convert_to_partitioned
+
+    if partitioning_enabled():
+        convert_to_partitioned()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_controller', '0003_salesrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_request_carts, migrations.RunPython.noop),
+    ]
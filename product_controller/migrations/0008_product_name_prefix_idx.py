@@ -0,0 +1,17 @@
+# Generated by Django 3.1.5 on 2026-10-19 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_controller', '0007_product_popularity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name'], name='product_name_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
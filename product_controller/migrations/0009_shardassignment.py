@@ -0,0 +1,23 @@
+# Generated by Django 3.1.5 on 2026-10-19 08:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_controller', '0008_product_name_prefix_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardAssignment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.CharField(max_length=100)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('business', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='shard_assignment', to='product_controller.business')),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.5 on 2026-10-19 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_controller', '0010_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40, unique=True)),
+                ('query', models.TextField()),
+                ('database', models.CharField(max_length=100)),
+                ('calls', models.BigIntegerField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('max_ms', models.FloatField(default=0)),
+                ('operation', models.CharField(blank=True, max_length=255)),
+                ('path', models.TextField(blank=True)),
+                ('example', models.TextField(blank=True)),
+                ('plan', models.TextField(blank=True)),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+                ('last_seen', models.DateTimeField()),
+            ],
+        ),
+    ]
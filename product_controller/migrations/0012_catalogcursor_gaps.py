@@ -0,0 +1,18 @@
+# Generated by Django 3.1.5 on 2026-10-19 08:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_controller', '0011_slow_queries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogcursor',
+            name='gaps',
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def date_existing_wishes(apps, schema_editor):
+    # when each product was wished isn't known, the wish list's own date is the closest there is
+    Wish = apps.get_model('product_controller', 'Wish')
+    WishProduct = apps.get_model('product_controller', 'WishProduct')
+    WishProduct.objects.update(
+        created_at=Subquery(Wish.objects.filter(id=OuterRef('wish_id')).values('created_at')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_controller', '0012_catalogcursor_gaps'),
+    ]
+
+    operations = [
+        # the table Django made for Wish.products becomes an explicit model
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='WishProduct',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product_controller.product')),
+                        ('wish', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product_controller.wish')),
+                    ],
+                    options={
+                        'db_table': 'product_controller_wish_products',
+                        'unique_together': {('wish', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='wish',
+                    name='products',
+                    field=models.ManyToManyField(related_name='products_wished', through='product_controller.WishProduct', to='product_controller.Product'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='wishproduct',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(date_existing_wishes, migrations.RunPython.noop),
+    ]
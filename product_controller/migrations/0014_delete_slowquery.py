@@ -0,0 +1,16 @@
+# Generated by Django 3.1.5 on 2026-10-19 09:03
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_controller', '0013_wishproduct'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='SlowQuery',
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.1.5 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_controller', '0014_delete_slowquery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordedSale',
+            fields=[
+                ('request_cart_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('business_id', models.IntegerField(db_index=True)),
+            ],
+        ),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, connection, transaction
+from django.utils import timezone
 from user_controller.models import ImageUpload, User
 
 
@@ -28,6 +29,7 @@ class Product(models.Model):
     total_available = models.PositiveIntegerField()
     total_count = models.PositiveIntegerField()
     description = models.TextField()
+    popularity = models.FloatField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     update_at = models.DateTimeField(auto_now=True)
 
@@ -36,6 +38,15 @@ class Product(models.Model):
 
     class Meta:
         ordering = ("-created_at",)
+        indexes = [
+            models.Index(fields=["-created_at"], name="product_created_idx"),
+            models.Index(fields=["business", "-created_at"], name="product_business_created_idx"),
+            models.Index(fields=["category", "-created_at"], name="product_category_created_idx"),
+            models.Index(fields=["business", "name"], name="product_business_name_idx"),
+            models.Index(fields=["price", "id"], name="product_price_idx"),
+            models.Index(fields=["popularity", "id"], name="product_popularity_idx"),
+            models.Index(fields=["name"], name="product_name_prefix_idx", opclasses=["varchar_pattern_ops"]),
+        ]
 
 
 class ProductImage(models.Model):
@@ -48,6 +59,11 @@ class ProductImage(models.Model):
     def __str__(self):
         return f"{self.product.business.name} - {self.product.name} - {self.image}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["product"], name="productimage_cover_idx", condition=models.Q(is_cover=True)),
+        ]
+
 
 class ProductComment(models.Model):
     product = models.ForeignKey(Product, related_name="product_comments", on_delete=models.CASCADE)
@@ -57,11 +73,73 @@ class ProductComment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+class WishManager(models.Manager):
+    def toggle_product(self, user_id, product_id):
+        from .sharding import product_db
+
+        # wishes live at home and products may not, so the product is only looked up, on its own
+        # shard, once a row was added; removing a wish never needs it
+        with transaction.atomic():
+            removed, added = self.remove_or_add(user_id, product_id)
+            if removed:
+                return False
+            if not added:
+                # the user's first wish
+                self.get_or_create(user_id=user_id)
+                self.remove_or_add(user_id, product_id)
+
+            if not Product.objects.using(product_db(product_id)).filter(id=product_id).exists():
+                raise Product.DoesNotExist()
+            return True
+
+    def remove_or_add(self, user_id, product_id):
+        through = self.model.products.through
+        now = timezone.now()
+
+        if connection.vendor != "postgresql":
+            removed, _ = through.objects.filter(wish__user_id=user_id, product_id=product_id).delete()
+            wish_id = self.filter(user_id=user_id).values_list("id", flat=True).first()
+            if removed or not wish_id:
+                return removed, 0
+            through.objects.create(wish_id=wish_id, product_id=product_id, created_at=now)
+            return 0, 1
+
+        params = {"user": user_id, "product": product_id, "now": now}
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH removed AS (
+                    DELETE FROM {through._meta.db_table} t USING {self.model._meta.db_table} w
+                    WHERE t.wish_id = w.id AND w.user_id = %(user)s AND t.product_id = %(product)s
+                    RETURNING t.id
+                ), added AS (
+                    INSERT INTO {through._meta.db_table} (wish_id, product_id, created_at)
+                    SELECT w.id, %(product)s, %(now)s FROM {self.model._meta.db_table} w
+                    WHERE w.user_id = %(user)s AND NOT EXISTS (SELECT 1 FROM removed)
+                    ON CONFLICT DO NOTHING
+                    RETURNING id
+                )
+                SELECT (SELECT COUNT(*) FROM removed), (SELECT COUNT(*) FROM added)
+            """, params)
+            return cursor.fetchone()
+
+
 class Wish(models.Model):
     user = models.OneToOneField(User, related_name="user_wish", on_delete=models.CASCADE)
-    products = models.ManyToManyField(Product, related_name="products_wished")
+    products = models.ManyToManyField(Product, related_name="products_wished", through="WishProduct")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = WishManager()
+
+
+class WishProduct(models.Model):
+    wish = models.ForeignKey(Wish, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        db_table = "product_controller_wish_products"
+        unique_together = ("wish", "product")
+
 
 class Cart(models.Model):
     product = models.ForeignKey(Product, related_name="product_carts", on_delete=models.CASCADE)
@@ -74,6 +152,9 @@ class Cart(models.Model):
 
     class Meta:
         ordering = ("-created_at",)
+        indexes = [
+            models.Index(fields=["user", "-created_at"], name="cart_user_created_idx"),
+        ]
 
 
 class RequestCart(models.Model):
@@ -86,4 +167,109 @@ class RequestCart(models.Model):
 
     class Meta:
         ordering = ("created_at",)
+        indexes = [
+            models.Index(fields=["business", "created_at"], name="reqcart_business_created_idx"),
+        ]
+
+
+
+class SalesRollup(models.Model):
+    business = models.ForeignKey(Business, related_name="business_sales", on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name="product_sales", on_delete=models.CASCADE)
+    day = models.DateField()
+    revenue = models.FloatField(default=0)
+    units = models.IntegerField(default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ("day",)
+        constraints = [
+            models.UniqueConstraint(fields=["business", "day", "product"], name="salesrollup_business_day_product"),
+        ]
+
+
+class RecordedSale(models.Model):
+    # the orders already counted into SalesRollup, so a record_sales task that runs after a rebuild,
+    # or twice, adds nothing; plain ids since orders may live on another shard
+    request_cart_id = models.BigIntegerField(primary_key=True)
+    business_id = models.IntegerField(db_index=True)
+
+
+class CatalogEvent(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    entity = models.CharField(max_length=20)
+    entity_id = models.IntegerField()
+    action = models.CharField(max_length=10)
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.id} {self.entity}:{self.entity_id} {self.action}"
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "entity": self.entity,
+            "entity_id": self.entity_id,
+            "action": self.action,
+            "data": self.data,
+            "at": self.created_at.isoformat(),
+        }
+
+    class Meta:
+        ordering = ("id",)
+
+
+class CatalogCursor(models.Model):
+    consumer = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    # ids below position not seen yet, as {id: when they were first missed}
+    gaps = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.consumer} @ {self.position}"
+
+
+class RelatedProduct(models.Model):
+    product = models.ForeignKey(Product, related_name="related_products", on_delete=models.CASCADE)
+    related = models.ForeignKey(Product, related_name="+", on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ("product", "rank")
+        constraints = [
+            models.UniqueConstraint(fields=["product", "rank"], name="relatedproduct_product_rank"),
+        ]
+
+
+class ShardAssignment(models.Model):
+    business = models.OneToOneField(Business, related_name="shard_assignment", on_delete=models.CASCADE)
+    shard = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.business_id} @ {self.shard}"
+
+
+class StockCounter(models.Model):
+    # a product's unreserved stock spread over a few rows so concurrent carts rarely queue on one lock
+    product = models.ForeignKey(Product, related_name="stock_counters", on_delete=models.CASCADE)
+    slot = models.PositiveSmallIntegerField()
+    available = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "slot"], name="stockcounter_product_slot"),
+        ]
+
 
+class StockReservation(models.Model):
+    # kept when its cart goes away so the sweeper still hands the stock back
+    cart = models.ForeignKey(Cart, related_name="reservations", on_delete=models.SET_NULL, null=True)
+    product = models.ForeignKey(Product, related_name="+", on_delete=models.CASCADE)
+    slot = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
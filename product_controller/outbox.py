@@ -0,0 +1,80 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CatalogEvent, CatalogCursor
+
+CATEGORY = "category"
+PRODUCT = "product"
+PRODUCT_IMAGE = "product_image"
+BUSINESS = "business"
+COMMENT = "comment"
+CART = "cart"
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+
+def product_data(product):
+    return {
+        "name": product.name,
+        "price": product.price,
+        "total_available": product.total_available,
+        "category_id": product.category_id,
+        "business_id": product.business_id,
+    }
+
+
+def emit(entity, action, entity_id, **data):
+    return CatalogEvent.objects.create(entity=entity, action=action, entity_id=entity_id, data=data)
+
+
+def emit_many(entity, action, entity_ids, **data):
+    return CatalogEvent.objects.bulk_create([
+        CatalogEvent(entity=entity, action=action, entity_id=entity_id, data=data) for entity_id in entity_ids
+    ])
+
+
+def read_events(after=0, limit=100, gaps=()):
+    # ids are handed out before commit, so give in-flight transactions a moment to land
+    settled = timezone.now() - timedelta(seconds=settings.CATALOG_OUTBOX_SETTLE_SECONDS)
+    events = list(CatalogEvent.objects.filter(id__gt=after, created_at__lte=settled)[:limit])
+    if gaps:
+        # ids skipped earlier whose transaction has committed since
+        events = sorted(list(CatalogEvent.objects.filter(id__in=[int(gap) for gap in gaps])) + events,
+                        key=lambda event: event.id)
+    return events
+
+
+def advance(position, gaps, events):
+    # ids below the new position that weren't delivered belong to transactions that were still
+    # open, or rolled back; they are read again until they show up or CATALOG_OUTBOX_GAP_SECONDS pass
+    now = time.time()
+    delivered = {event.id for event in events}
+    gaps = {
+        gap: missed_at for gap, missed_at in gaps.items()
+        if int(gap) not in delivered and now - missed_at < settings.CATALOG_OUTBOX_GAP_SECONDS
+    }
+
+    new_position = max([position, *delivered])
+    for missing in range(position + 1, new_position):
+        if missing not in delivered:
+            gaps[str(missing)] = now
+
+    return new_position, gaps
+
+
+def next_batch(consumer, limit=100):
+    cursor, _ = CatalogCursor.objects.get_or_create(consumer=consumer)
+    return read_events(cursor.position, limit, cursor.gaps)
+
+
+@transaction.atomic
+def acknowledge(consumer, events):
+    cursor = CatalogCursor.objects.select_for_update().get(consumer=consumer)
+    cursor.position, cursor.gaps = advance(cursor.position, cursor.gaps, events)
+    cursor.save(update_fields=["position", "gaps", "updated_at"])
@@ -0,0 +1,173 @@
+import gzip
+import os
+import re
+from datetime import date
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import RequestCart
+
+TABLE = RequestCart._meta.db_table
+PARTITION_PATTERN = re.compile(rf"^{TABLE}_p(\d{{4}})(\d{{2}})$")
+
+
+def partitioning_enabled():
+    return settings.REQUEST_CART_PARTITIONING and connection.vendor == "postgresql"
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def current_month():
+    return timezone.now().date().replace(day=1)
+
+
+def partition_name(month):
+    return f"{TABLE}_p{month:%Y%m}"
+
+
+def is_partitioned(cursor):
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [TABLE]
+    )
+    return cursor.fetchone() is not None
+
+
+def list_partitions(cursor):
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname", [TABLE]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def create_partition(cursor, month):
+    name = partition_name(month)
+    bounds = f"FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+
+    cursor.execute("SELECT to_regclass(%s), to_regclass(%s)", [name, f"{TABLE}_default"])
+    exists, default = cursor.fetchone()
+    if exists:
+        return
+
+    if not default:
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES {bounds}")
+        return
+
+    # rows that landed in the default partition while this month had none would make
+    # CREATE ... PARTITION OF fail, so they are moved into the new table before attaching it
+    with transaction.atomic():
+        cursor.execute(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {default} WHERE created_at >= %s AND created_at < %s RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved", [month, add_months(month, 1)]
+        )
+        cursor.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES {bounds}")
+
+
+def ensure_partitions(months_ahead=None):
+    if months_ahead is None:
+        months_ahead = settings.REQUEST_CART_PARTITIONS_AHEAD
+
+    months = [add_months(current_month(), count) for count in range(months_ahead + 1)]
+
+    with connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return []
+
+        for month in months:
+            create_partition(cursor, month)
+
+    return [partition_name(month) for month in months]
+
+
+def convert_to_partitioned(months_ahead=None):
+    if months_ahead is None:
+        months_ahead = settings.REQUEST_CART_PARTITIONS_AHEAD
+
+    old_table = f"{TABLE}_unpartitioned"
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return False
+
+        cursor.execute(
+            "SELECT pg_get_indexdef(indexrelid) FROM pg_index "
+            "WHERE indrelid = to_regclass(%s) AND NOT indisprimary", [TABLE]
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'", [TABLE]
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        sequence = cursor.fetchone()[0]
+        cursor.execute(f"SELECT MIN(created_at) FROM {TABLE}")
+        first = cursor.fetchone()[0]
+
+        cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {old_table}")
+        cursor.execute(
+            f"CREATE TABLE {TABLE} (LIKE {old_table} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"
+        )
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id")
+        cursor.execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+
+        month = first.date().replace(day=1) if first else current_month()
+        last = add_months(current_month(), months_ahead)
+        while month <= last:
+            create_partition(cursor, month)
+            month = add_months(month, 1)
+
+        cursor.execute(f"INSERT INTO {TABLE} SELECT * FROM {old_table}")
+        cursor.execute(f"DROP TABLE {old_table}")
+
+        # the partition key has to be part of every unique constraint
+        cursor.execute(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id, created_at)")
+        for definition in indexes:
+            cursor.execute(definition.replace(old_table, TABLE))
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}")
+
+    return True
+
+
+def export_rows(cursor, query, path):
+    with gzip.open(path, "wt", newline="") as output:
+        cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH CSV HEADER", output)
+
+
+def archive_request_carts(before, output_dir, drop=True):
+    os.makedirs(output_dir, exist_ok=True)
+    archived = []
+
+    with connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            path = os.path.join(output_dir, f"{TABLE}_before_{before:%Y%m%d}.csv.gz")
+            with transaction.atomic():
+                export_rows(cursor, f"SELECT * FROM {TABLE} WHERE created_at < '{before.isoformat()}'", path)
+                cursor.execute(f"DELETE FROM {TABLE} WHERE created_at < %s", [before])
+            return [path]
+
+        for name in list_partitions(cursor):
+            match = PARTITION_PATTERN.match(name)
+            if not match:
+                continue
+
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            if add_months(month, 1) > before:
+                continue
+
+            path = os.path.join(output_dir, f"{name}.csv.gz")
+            export_rows(cursor, f"SELECT * FROM {name}", path)
+            with transaction.atomic():
+                cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+                if drop:
+                    cursor.execute(f"DROP TABLE {name}")
+            archived.append(path)
+
+    return archived
@@ -0,0 +1,100 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Product, RequestCart, Cart, WishProduct
+from .sharding import HOME, shards, product_db
+
+WISH = "wish"
+CART = "cart"
+PURCHASE = "purchase"
+
+
+def half_life_seconds():
+    return settings.POPULARITY_HALF_LIFE_HOURS * 3600
+
+
+def decay_factor(at=None):
+    # instead of decaying every score over time, newer signals weigh exponentially more
+    # than older ones; the epoch only keeps the numbers within float range
+    elapsed = ((at or timezone.now()) - settings.POPULARITY_EPOCH).total_seconds()
+    return 2 ** (elapsed / half_life_seconds())
+
+
+def score(product_id, signal, quantity=1, at=None):
+    return [product_id, settings.POPULARITY_WEIGHTS[signal] * quantity * decay_factor(at)]
+
+
+def add_popularity(scores):
+    totals = defaultdict(float)
+    for product_id, amount in scores:
+        totals[int(product_id)] += amount
+
+    # a stable order keeps concurrent batches from deadlocking on each other
+    with transaction.atomic():
+        for product_id, amount in sorted(totals.items()):
+            try:
+                db = product_db(product_id)
+            except Product.DoesNotExist:
+                continue
+            Product.objects.using(db).filter(id=product_id).update(popularity=F("popularity") + amount)
+
+
+def read_scores(alias, sources, params):
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f"""
+            SELECT product_id, SUM(weight * power(2, (extract(epoch FROM at) - %(epoch)s) / %(half_life)s))
+            FROM ({" UNION ALL ".join(sources)}) signals
+            GROUP BY product_id
+        """, params)
+        return cursor.fetchall()
+
+
+def recompute_popularity(batch_size=1000):
+    since = timezone.now() - timedelta(hours=settings.POPULARITY_HALF_LIFE_HOURS * settings.POPULARITY_WINDOW_HALF_LIVES)
+    weights = settings.POPULARITY_WEIGHTS
+    params = {
+        "epoch": settings.POPULARITY_EPOCH.timestamp(),
+        "half_life": half_life_seconds(),
+        "since": since,
+        "purchase": weights[PURCHASE],
+        "cart": weights[CART],
+        "wish": weights[WISH],
+    }
+    product_table = Product._meta.db_table
+
+    # carts and wishes live at home, orders next to their products; each shard gets the home
+    # scores too, the UPDATE only matches the products it holds
+    home = read_scores(HOME, [
+        f"SELECT product_id, %(cart)s * quantity AS weight, created_at AS at "
+        f"FROM {Cart._meta.db_table} WHERE created_at >= %(since)s",
+        f"SELECT product_id, %(wish)s, created_at FROM {WishProduct._meta.db_table} WHERE created_at >= %(since)s",
+    ], params)
+
+    total = 0
+    for alias in shards():
+        scores = defaultdict(float)
+        orders = read_scores(alias, [
+            f"SELECT product_id, %(purchase)s * quantity AS weight, created_at AS at "
+            f"FROM {RequestCart._meta.db_table} WHERE created_at >= %(since)s",
+        ], params)
+        for product_id, amount in home + orders:
+            scores[product_id] += amount
+        rows = sorted(scores.items())
+
+        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+            cursor.execute(f"UPDATE {product_table} SET popularity = 0 WHERE popularity <> 0")
+            for offset in range(0, len(rows), batch_size):
+                batch = rows[offset:offset + batch_size]
+                cursor.execute(
+                    f"UPDATE {product_table} p SET popularity = v.score "
+                    f"FROM (VALUES {', '.join(['(%s, %s)'] * len(batch))}) AS v(id, score) WHERE p.id = v.id",
+                    [item for row in batch for item in row]
+                )
+                total += cursor.rowcount
+
+    return total
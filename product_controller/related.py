@@ -0,0 +1,139 @@
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Max
+
+from .models import Product, RequestCart, WishProduct, RelatedProduct
+from .sharding import HOME, shards
+
+PURCHASE_WEIGHT = 1.0
+WISH_WEIGHT = 0.5
+CHUNK_SIZE = 100000
+
+
+def import_numpy():
+    try:
+        import numpy
+        from scipy import sparse
+    except ImportError:
+        raise Exception("numpy and scipy are required to build related products, pip install numpy scipy")
+
+    return numpy, sparse
+
+
+def read_pairs(np, query, user_field, weight):
+    rows = query.order_by().values_list(user_field, "product_id").iterator(chunk_size=CHUNK_SIZE)
+    while True:
+        chunk = list(islice(rows, CHUNK_SIZE))
+        if not chunk:
+            break
+        pairs = np.array(chunk, dtype=np.int64)
+        yield pairs[:, 0], pairs[:, 1], np.full(len(chunk), weight)
+
+
+def product_columns(np, product_ids, ids):
+    # products deleted while the signals were read have no column
+    columns = np.searchsorted(product_ids, ids).clip(max=len(product_ids) - 1)
+    return columns, product_ids[columns] == ids
+
+
+def load_signals(np, sparse):
+    # products and orders are read from every shard, wishes live at home
+    product_ids = np.unique(np.concatenate([np.fromiter(
+        Product.objects.using(alias).order_by().values_list("id", flat=True).iterator(chunk_size=CHUNK_SIZE), dtype=np.int64
+    ) for alias in shards()]))
+
+    users, items, weights = [], [], []
+    sources = [
+        (RequestCart.objects.using(alias), "user_id", PURCHASE_WEIGHT) for alias in shards()
+    ] + [(WishProduct.objects.using(HOME), "wish__user_id", WISH_WEIGHT)]
+    for query, user_field, weight in sources:
+        for user_chunk, item_chunk, weight_chunk in read_pairs(np, query, user_field, weight):
+            users.append(user_chunk)
+            items.append(item_chunk)
+            weights.append(weight_chunk)
+
+    if not users:
+        return product_ids, None
+
+    users, items, weights = np.concatenate(users), np.concatenate(items), np.concatenate(weights)
+    item_index, known = product_columns(np, product_ids, items)
+    _, user_index = np.unique(users[known], return_inverse=True)
+    item_index, weights = item_index[known], weights[known]
+
+    # users x products, repeated signals add up and are then dampened
+    matrix = sparse.csr_matrix((weights, (user_index, item_index)), shape=(user_index.max() + 1, len(product_ids)))
+    matrix.data = np.log1p(matrix.data)
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0))).ravel()
+    norms[norms == 0] = 1
+    return product_ids, matrix @ sparse.diags(1 / norms)
+
+
+def touched_columns(np, product_ids, normalized, since):
+    new = [
+        RequestCart.objects.using(alias).filter(created_at__gte=since).values_list("product_id", flat=True).distinct()
+        for alias in shards()
+    ] + [WishProduct.objects.using(HOME).filter(created_at__gte=since).values_list("product_id", flat=True).distinct()]
+    columns, known = product_columns(np, product_ids, np.fromiter((product_id for ids in new for product_id in ids), dtype=np.int64))
+    columns = np.unique(columns[known])
+
+    # a new signal changes the product's similarity to everything it shares a user with
+    users = np.unique(normalized[:, columns].nonzero()[0])
+    return np.union1d(columns, normalized[users].nonzero()[1])
+
+
+def top_neighbours(np, similarity, row, top_k):
+    start, end = similarity.indptr[row], similarity.indptr[row + 1]
+    columns, scores = similarity.indices[start:end], similarity.data[start:end]
+    if len(scores) > top_k:
+        best = np.argpartition(-scores, top_k)[:top_k]
+        columns, scores = columns[best], scores[best]
+    order = np.argsort(-scores, kind="stable")
+    return columns[order], scores[order]
+
+
+def build_related_products(top_k, batch_size=1000, incremental=False):
+    np, sparse = import_numpy()
+
+    since = None
+    if incremental:
+        since = RelatedProduct.objects.aggregate(since=Max("updated_at"))["since"]
+
+    product_ids, normalized = load_signals(np, sparse)
+    if normalized is None:
+        RelatedProduct.objects.all().delete()
+        return 0
+
+    if since:
+        columns = touched_columns(np, product_ids, normalized, since)
+    else:
+        columns = np.arange(len(product_ids))
+
+    item_vectors = normalized.T.tocsr()
+    total = 0
+
+    for offset in range(0, len(columns), batch_size):
+        batch = columns[offset:offset + batch_size]
+        # cosine similarity of this batch of products against every product
+        similarity = (item_vectors[batch] @ normalized).tocsr()
+        rows = []
+
+        for row, column in enumerate(batch):
+            neighbours, scores = top_neighbours(np, similarity, row, top_k + 1)
+            rank = 0
+            for neighbour, score in zip(neighbours, scores):
+                if neighbour == column or score <= 0 or rank == top_k:
+                    continue
+                rank += 1
+                rows.append(RelatedProduct(
+                    product_id=int(product_ids[column]), related_id=int(product_ids[neighbour]),
+                    rank=rank, score=float(score)
+                ))
+
+        with transaction.atomic():
+            RelatedProduct.objects.filter(product_id__in=[int(product_ids[column]) for column in batch]).delete()
+            RelatedProduct.objects.bulk_create(rows, batch_size=5000)
+        total += len(rows)
+
+    return total
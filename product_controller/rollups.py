@@ -0,0 +1,113 @@
+from collections import defaultdict
+from datetime import date
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Business, RequestCart, SalesRollup, RecordedSale
+from .sharding import business_db
+
+# first key of the advisory locks that keep record_sales and rebuilds of one business apart
+SALES_LOCK = 28
+
+
+def sales_rows(request_carts):
+    return [
+        [item.id, item.business_id, item.product_id, item.created_at.date().isoformat(), item.price, item.quantity]
+        for item in request_carts
+    ]
+
+
+def lock_businesses(business_ids, shared):
+    if connection.vendor != "postgresql":
+        return
+
+    # always in the same order, so two batches can't deadlock on each other
+    function = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+    with connection.cursor() as cursor:
+        for business_id in sorted(business_ids):
+            cursor.execute(f"SELECT {function}(%s, %s)", [SALES_LOCK, business_id])
+
+
+def claim_sales(rows):
+    table = RecordedSale._meta.db_table
+    values = ", ".join(["(%s, %s)"] * len(rows))
+    params = [value for row in rows for value in row[:2]]
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO {table} (request_cart_id, business_id) VALUES {values}
+            ON CONFLICT (request_cart_id) DO NOTHING
+            RETURNING request_cart_id
+        """, params)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def record_sales(rows):
+    if not rows:
+        return
+
+    with transaction.atomic():
+        lock_businesses({row[1] for row in rows}, shared=True)
+        claimed = claim_sales(rows)
+
+        totals = defaultdict(lambda: [0, 0, 0])
+        for request_cart_id, business_id, product_id, day, price, quantity in rows:
+            if request_cart_id not in claimed:
+                continue
+            row = totals[(business_id, product_id, date.fromisoformat(day))]
+            row[0] += price
+            row[1] += quantity
+            row[2] += 1
+
+        if not totals:
+            return
+
+        table = SalesRollup._meta.db_table
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(totals))
+        params = [value for key, row in totals.items() for value in (*key, *row)]
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {table} (business_id, product_id, day, revenue, units, orders)
+                VALUES {values}
+                ON CONFLICT (business_id, day, product_id) DO UPDATE SET
+                    revenue = {table}.revenue + EXCLUDED.revenue,
+                    units = {table}.units + EXCLUDED.units,
+                    orders = {table}.orders + EXCLUDED.orders
+            """, params)
+
+
+def rebuild_business_rollups(business_id, batch_size=10000):
+    orders = RequestCart.objects.using(business_db(business_id)).filter(business_id=business_id).order_by()
+
+    with transaction.atomic():
+        # queued record_sales tasks of this business wait, and afterwards skip the orders counted here
+        lock_businesses([business_id], shared=False)
+        SalesRollup.objects.filter(business_id=business_id).delete()
+        RecordedSale.objects.filter(business_id=business_id).delete()
+
+        ids = orders.values_list("id", flat=True).iterator(chunk_size=batch_size)
+        while True:
+            batch = [RecordedSale(request_cart_id=request_cart_id, business_id=business_id)
+                     for request_cart_id in islice(ids, batch_size)]
+            if not batch:
+                break
+            RecordedSale.objects.bulk_create(batch)
+
+        rollups = SalesRollup.objects.bulk_create([
+            SalesRollup(business_id=business_id, **row) for row in orders.values(
+                "product_id", day=TruncDate("created_at", tzinfo=timezone.utc)
+            ).annotate(revenue=Sum("price"), units=Sum("quantity"), orders=Count("id"))
+        ], batch_size=batch_size)
+
+    return len(rollups)
+
+
+def rebuild_sales_rollups(business_id=None):
+    # one business per transaction, so the locks are short and other businesses keep recording
+    business_ids = [business_id] if business_id else Business.objects.order_by("id").values_list("id", flat=True)
+    return sum(rebuild_business_rollups(business_id) for business_id in business_ids)
@@ -1,12 +1,32 @@
 import graphene
+import channels_graphql_ws
+from datetime import datetime, time, timedelta
 from graphene_django import DjangoObjectType
+from django.conf import settings
+from django.utils import timezone
 from ecommerce_api.permissions import paginate, is_authenticated, get_query
-from django.db.models import Q
+from ecommerce_api.loaders import get_loader, TopPerParentLoader
+from ecommerce_api.channel_layer import require_shared_layer
+from django.db import transaction
+from django.db.models import Q, Sum, Count
 
 from .models import (
     Category, Business, Product, ProductComment, 
-    ProductImage, Wish, Cart, RequestCart
+    ProductImage, Wish, Cart, RequestCart, SalesRollup
 ) 
+from .rollups import sales_rows
+from .facets import get_facets, requested_facets
+from .autocomplete import prefix_index
+from . import outbox
+from .tasks import record_sales_task, add_popularity_task
+from . import popularity
+from .loaders import WishedLoader, InCartLoader, RelatedProductsLoader, AvailableLoader, CategoryCountLoader
+from . import stock
+from .carts import business_subtotals, order_carts
+from .sharding import (
+    business_db, product_db, user_business_db, shards, scatter, sharding_enabled,
+    delete_products
+)
 
 
 class CategoryType(DjangoObjectType):
@@ -14,9 +34,13 @@ class CategoryType(DjangoObjectType):
 
     class Meta:
         model = Category
+        # every product in the category, count and products(category:) page through them
+        exclude = ("product_categories",)
 
     def resolve_count(self, info):
-        return self.product_categories.count()
+        if hasattr(self, "product_count"):
+            return self.product_count
+        return get_loader(info, CategoryCountLoader).load(self.id)
 
 
 
@@ -24,12 +48,54 @@ class BusinessType(DjangoObjectType):
     
     class Meta:
         model = Business
+        # unbounded, and the business's orders and buyers; products(business:) and requestCarts page through them
+        exclude = ("business_products", "business_requests")
+
+
+def nested_size(size=None):
+    default = settings.GRAPHENE["NESTED_LIST_SIZE"]
+    return min(max(size or default, 1), settings.GRAPHENE["MAX_NESTED_LIST_SIZE"])
 
 
 class ProductType(DjangoObjectType):
-    
+    is_wished = graphene.Boolean()
+    in_cart = graphene.Boolean()
+    available = graphene.Int()
+    related_products = graphene.List(lambda: ProductType, limit=graphene.Int())
+    product_comments = graphene.List(lambda: ProductCommentType, size=graphene.Int())
+    product_images = graphene.List(lambda: ProductImageType, size=graphene.Int())
+
     class Meta:
         model = Product
+        # unbounded, and other users' wishes, carts and orders; isWished and inCart answer for the viewer
+        exclude = ("products_wished", "product_carts", "product_requests")
+
+    def resolve_is_wished(self, info):
+        if not info.context.user:
+            return False
+        return get_loader(info, WishedLoader, info.context.user.id).load(self.id)
+
+    def resolve_in_cart(self, info):
+        if not info.context.user:
+            return False
+        return get_loader(info, InCartLoader, info.context.user.id).load(self.id)
+
+    def resolve_available(self, info):
+        # stock not held by any cart; products nobody has carted yet have no counters
+        return get_loader(info, AvailableLoader).load(self.id).then(
+            lambda available: self.total_available if available is None else available)
+
+    def resolve_related_products(self, info, limit=10):
+        limit = min(max(limit, 1), settings.RELATED_PRODUCTS_TOP_K)
+        return get_loader(info, RelatedProductsLoader, limit).load(self.id)
+
+    def resolve_product_comments(self, info, size=None):
+        return get_loader(info, TopPerParentLoader, ProductComment, "product",
+                          "created_at DESC, id DESC", nested_size(size), tuple(shards())).load(self.id)
+
+    def resolve_product_images(self, info, size=None):
+        return get_loader(info, TopPerParentLoader, ProductImage, "product",
+                          "is_cover DESC, created_at, id", nested_size(size), tuple(shards())).load(self.id)
 
 
 class ProductCommentType(DjangoObjectType):
@@ -62,17 +128,132 @@ class RequestCartType(DjangoObjectType):
         model = RequestCart
 
 
+class SalesDayType(graphene.ObjectType):
+    day = graphene.Date()
+    revenue = graphene.Float()
+    units = graphene.Int()
+    orders = graphene.Int()
+
+
+class SalesSummaryType(graphene.ObjectType):
+    revenue = graphene.Float()
+    units = graphene.Int()
+    orders = graphene.Int()
+    days = graphene.List(SalesDayType)
+
+
+class CartBusinessType(graphene.ObjectType):
+    business_id = graphene.ID()
+    business_name = graphene.String()
+    items = graphene.Int()
+    units = graphene.Int()
+    subtotal = graphene.Float()
+
+
+class CartSummaryType(graphene.ObjectType):
+    items = graphene.Int()
+    units = graphene.Int()
+    total = graphene.Float()
+    businesses = graphene.List(CartBusinessType)
+
+
+class FacetCountType(graphene.ObjectType):
+    id = graphene.ID()
+    name = graphene.String()
+    count = graphene.Int()
+
+
+class PriceBucketType(graphene.ObjectType):
+    min = graphene.Float()
+    max = graphene.Float()
+    count = graphene.Int()
+
+
+class RatingBucketType(graphene.ObjectType):
+    rating = graphene.Int()
+    count = graphene.Int()
+
+
+class ProductFacetsType(graphene.ObjectType):
+    total = graphene.Int()
+    categories = graphene.List(FacetCountType)
+    businesses = graphene.List(FacetCountType)
+    prices = graphene.List(PriceBucketType)
+    ratings = graphene.List(RatingBucketType)
+
+
+# only keys backed by an index on Product
+PRODUCT_SORT_KEYS = ("created_at", "price", "popularity")
+
+
+class AutocompleteType(graphene.ObjectType):
+    kind = graphene.String()
+    id = graphene.ID()
+    name = graphene.String()
+
+
+def filter_products(info, **kwargs):
+    mine = kwargs.get("mine", False)
+    if mine and not info.context.user:
+        raise Exception("User auth required")
+
+    # every filter goes through a to-one join, so no row can repeat and DISTINCT isn't needed
+    query = Product.objects.all()
+
+    if mine:
+        query = query.filter(business__user_id=info.context.user.id)
+
+    if kwargs.get("search", None):
+        qs = kwargs["search"]
+        search_fields = (
+            "name", "description", "category__name"
+        )
+
+        search_data = get_query(qs, search_fields)
+        query = query.filter(search_data)
+
+    if kwargs.get("min_price", None):
+        query = query.filter(price__gte=kwargs["min_price"])
+
+    if kwargs.get("max_price", None):
+        query = query.filter(price__lte=kwargs["max_price"])
+
+    if kwargs.get("category", None):
+        query = query.filter(category__name__icontains=kwargs["category"])
+
+    if kwargs.get("business", None):
+        query = query.filter(business__name__icontains=kwargs["business"])
+
+    return query
+
+
 class Query(graphene.ObjectType):
-    categories = graphene.List(CategoryType, name=graphene.String())
+    categories = graphene.Field(paginate(CategoryType), name=graphene.String(),
+     page=graphene.Int(), size=graphene.Int())
     products = graphene.Field(paginate(ProductType), search=graphene.String(),
      min_price=graphene.Float(), max_price=graphene.Float(), category=graphene.String(),
-     business=graphene.String(), sort_by=graphene.String(), is_asc=graphene.Boolean(), mine=graphene.Boolean())
+     business=graphene.String(), sort_by=graphene.String(), is_asc=graphene.Boolean(), mine=graphene.Boolean(),
+     page=graphene.Int(), size=graphene.Int())
+    product_facets = graphene.Field(ProductFacetsType, search=graphene.String(),
+     min_price=graphene.Float(), max_price=graphene.Float(), category=graphene.String(),
+     business=graphene.String(), sort_by=graphene.String(), is_asc=graphene.Boolean(), mine=graphene.Boolean(),
+     price_bounds=graphene.List(graphene.Float))
+    autocomplete = graphene.List(AutocompleteType, prefix=graphene.String(required=True), limit=graphene.Int())
+    related_products = graphene.List(ProductType, product_id=graphene.ID(required=True), limit=graphene.Int())
     product = graphene.Field(ProductType, id=graphene.ID(required=True))
-    carts = graphene.List(CartType, name=graphene.String())
-    request_carts = graphene.List(RequestCartType, name=graphene.String())
+    carts = graphene.Field(paginate(CartType), name=graphene.String(),
+     page=graphene.Int(), size=graphene.Int())
+    cart_summary = graphene.Field(CartSummaryType)
+    request_carts = graphene.Field(paginate(RequestCartType), name=graphene.String(),
+     start_date=graphene.Date(), end_date=graphene.Date(), page=graphene.Int(), size=graphene.Int())
+    sales_summary = graphene.Field(SalesSummaryType, start_date=graphene.Date(),
+     end_date=graphene.Date(), product_id=graphene.ID())
 
     def resolve_categories(self, info, name=False):
-        query = Category.objects.prefetch_related("product_categories")
+        query = Category.objects.order_by("name")
+        if not sharding_enabled():
+            # the join only sees products at home; shards are counted by the loader instead
+            query = query.annotate(product_count=Count("product_categories"))
 
         if name:
             query = query.filter(Q(name__icontains=name) | Q(name__iexact=name)).distinct()
@@ -81,7 +262,9 @@ class Query(graphene.ObjectType):
 
     @is_authenticated
     def resolve_carts(self, info, name=False):
-        query = Cart.objects.select_related("user", "product").filter(user_id=info.context.user.id)
+        # a sharded product isn't on this database to be joined, the router fetches it instead
+        related = ("user",) if sharding_enabled() else ("user", "product")
+        query = Cart.objects.select_related(*related).filter(user_id=info.context.user.id)
 
         if name:
             query = query.filter(Q(product__name__icontains=name) | Q(product__name__iexact=name)).distinct()
@@ -89,75 +272,182 @@ class Query(graphene.ObjectType):
         return query
 
     @is_authenticated
-    def resolve_request_carts(self, info, name=False):
-        query = RequestCart.objects.select_related(
-            "user", "product", "business").filter(business__user_id=info.context.user.id)
+    def resolve_cart_summary(self, info):
+        businesses = [CartBusinessType(**row) for row in business_subtotals(info.context.user.id)]
+
+        return CartSummaryType(
+            items=sum(business.items for business in businesses),
+            units=sum(business.units for business in businesses),
+            total=sum(business.subtotal for business in businesses),
+            businesses=businesses
+        )
+
+    @is_authenticated
+    def resolve_request_carts(self, info, name=False, start_date=None, end_date=None):
+        related = ("product", "business") if sharding_enabled() else ("user", "product", "business")
+        query = RequestCart.objects.using(user_business_db(info.context.user)).select_related(
+            *related).filter(business__user_id=info.context.user.id)
+
+        # bounding created_at lets postgres prune the monthly partitions
+        if start_date:
+            query = query.filter(created_at__gte=timezone.make_aware(datetime.combine(start_date, time.min)))
+        elif not end_date:
+            query = query.filter(created_at__gte=timezone.now() - timedelta(days=settings.REQUEST_CART_RECENT_DAYS))
+
+        if end_date:
+            query = query.filter(created_at__lt=timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min)))
 
         if name:
             query = query.filter(Q(product__name__icontains=name) | Q(product__name__iexact=name)).distinct()
 
         return query
 
-    def resolve_products(self, info, **kwargs):
+    @is_authenticated
+    def resolve_sales_summary(self, info, **kwargs):
+        try:
+            buss_id = info.context.user.user_business.id
+        except Exception:
+            raise Exception("You do not have a business")
 
-        mine = kwargs.get("mine", False)
-        if mine and not info.context.user:
-            raise Exception("User auth required")
+        query = SalesRollup.objects.filter(business_id=buss_id)
+
+        if kwargs.get("start_date", None):
+            query = query.filter(day__gte=kwargs["start_date"])
+
+        if kwargs.get("end_date", None):
+            query = query.filter(day__lte=kwargs["end_date"])
+
+        if kwargs.get("product_id", None):
+            query = query.filter(product_id=kwargs["product_id"])
+
+        days = [
+            SalesDayType(**row) for row in query.values("day").annotate(
+                revenue=Sum("revenue"), units=Sum("units"), orders=Sum("orders")
+            ).order_by("day")
+        ]
+
+        return SalesSummaryType(
+            revenue=sum(day.revenue for day in days),
+            units=sum(day.units for day in days),
+            orders=sum(day.orders for day in days),
+            days=days
+        )
 
+    def resolve_products(self, info, **kwargs):
+        query = filter_products(info, **kwargs).select_related("category", "business")
 
-        query = Product.objects.select_related("category", "business").prefetch_related(
-            "product_images", "product_comments", "products_wished", "product_carts", "product_requests"
+        if kwargs.get("sort_by", None):
+            sort_by = kwargs["sort_by"]
+            if sort_by not in PRODUCT_SORT_KEYS:
+                raise Exception(f"sort_by must be one of {', '.join(PRODUCT_SORT_KEYS)}")
+
+            direction = "" if kwargs.get("is_asc", False) else "-"
+            query = query.order_by(f"{direction}{sort_by}", f"{direction}id")
+
+        if kwargs.get("mine", False):
+            return query.using(user_business_db(info.context.user))
+        return scatter(query)
+
+    def resolve_product_facets(self, info, price_bounds=None, **kwargs):
+        query = filter_products(info, **kwargs)
+        signature = [kwargs, info.context.user.id if kwargs.get("mine", False) else None]
+        databases = [user_business_db(info.context.user)] if kwargs.get("mine", False) else shards()
+        facets = get_facets(query, signature, requested_facets(info),
+                            price_bounds or settings.PRODUCT_FACET_PRICE_BOUNDS, databases)
+
+        return ProductFacetsType(
+            total=facets.get("total", None),
+            categories=[FacetCountType(**item) for item in facets.get("categories", [])],
+            businesses=[FacetCountType(**item) for item in facets.get("businesses", [])],
+            prices=[PriceBucketType(**item) for item in facets.get("prices", [])],
+            ratings=[RatingBucketType(**item) for item in facets.get("ratings", [])]
         )
 
-        if mine:
-            query = query.filter(business__user_id=info.context.user.id)
+    def resolve_autocomplete(self, info, prefix, limit=10):
+        if not prefix.strip():
+            return []
 
-        if kwargs.get("search", None):
-            qs = kwargs["search"]
-            search_fields = (
-                "name", "description", "category__name"
-            )
+        limit = min(max(limit, 1), settings.AUTOCOMPLETE_MAX_LIMIT)
+        return [AutocompleteType(**item) for item in prefix_index.search(prefix.strip(), limit)]
 
-            search_data = get_query(qs, search_fields)
-            query = query.filter(search_data)
+    def resolve_related_products(self, info, product_id, limit=10):
+        limit = min(max(limit, 1), settings.RELATED_PRODUCTS_TOP_K)
+        return get_loader(info, RelatedProductsLoader, limit).load(int(product_id))
 
-        if kwargs.get("min_price", None):
-            qs = kwargs["min_price"]
+    def resolve_product(self, info, id):
+        query = Product.objects.using(product_db(id)).select_related("category", "business").get(id=id)
 
-            query = query.filter(Q(price__gt=qs) | Q(price=qs)).distinct()
+        return query
 
-        if kwargs.get("max_price", None):
-            qs = kwargs["max_price"]
 
-            query = query.filter(Q(price__lt=qs) | Q(price=qs)).distinct()
+class ProductStockChanged(channels_graphql_ws.Subscription):
+    product_id = graphene.ID()
+    total_available = graphene.Int()
 
-        if kwargs.get("category", None):
-            qs = kwargs["category"]
+    class Arguments:
+        product_id = graphene.ID(required=True)
 
-            query = query.filter(Q(category__name__icontains=qs) 
-            | Q(category__name__iexact=qs)).distinct()
+    @staticmethod
+    def subscribe(root, info, product_id):
+        return [f"product-{product_id}"]
 
-        if kwargs.get("business", None):
-            qs = kwargs["business"]
+    @staticmethod
+    def publish(payload, info, product_id):
+        return ProductStockChanged(**payload)
 
-            query = query.filter(Q(business__name__icontains=qs) 
-            | Q(business__name__iexact=qs)).distinct()
+    @classmethod
+    def notify(cls, product_id, total_available):
+        require_shared_layer()
+        transaction.on_commit(lambda: cls.broadcast(
+            group=f"product-{product_id}",
+            payload={"product_id": product_id, "total_available": total_available}
+        ))
 
-        if kwargs.get("sort_by", None):
-            qs = kwargs["sort_by"]
-            is_asc = kwargs.get("is_asc", False)
-            if not is_asc:
-                qs = f"-{qs}"
-            query = query.order_by(qs)
 
-        return query
+class NewRequestCart(channels_graphql_ws.Subscription):
+    request_cart = graphene.Field(RequestCartType)
 
-    def resolve_product(self, info, id):
-        query = Product.objects.select_related("category", "business").prefetch_related(
-            "product_images", "product_comments", "products_wished", "product_carts", "product_requests"
-        ).get(id=id)
+    @staticmethod
+    def subscribe(root, info):
+        if not info.context.user:
+            raise Exception("You are not authorized to perform operations")
+
+        try:
+            buss_id = info.context.user.user_business.id
+        except Exception:
+            raise Exception("You do not have a business")
+
+        return [f"business-{buss_id}"]
+
+    @staticmethod
+    def publish(payload, info):
+        return NewRequestCart(request_cart=RequestCart(**payload))
+
+    @classmethod
+    def notify(cls, request_carts):
+        require_shared_layer()
+        payloads = [
+            {
+                "id": item.id,
+                "user_id": item.user_id,
+                "business_id": item.business_id,
+                "product_id": item.product_id,
+                "quantity": item.quantity,
+                "price": item.price,
+                "created_at": item.created_at,
+            } for item in request_carts
+        ]
+
+        def send():
+            for payload in payloads:
+                cls.broadcast(group=f"business-{payload['business_id']}", payload=payload)
+
+        transaction.on_commit(send)
 
-        return query
+
+class Subscription(graphene.ObjectType):
+    product_stock_changed = ProductStockChanged.Field()
+    new_request_cart = NewRequestCart.Field()
 
 
 class CreateBusiness(graphene.Mutation):
@@ -167,8 +457,10 @@ class CreateBusiness(graphene.Mutation):
         name = graphene.String(required=True)
 
     @is_authenticated
+    @transaction.atomic
     def mutate(self, info, name):
         buss = Business.objects.create(name=name, user_id=info.context.user.id)
+        outbox.emit(outbox.BUSINESS, outbox.CREATED, buss.id, name=name)
 
         return CreateBusiness(
             business=buss
@@ -182,6 +474,7 @@ class UpdateBusiness(graphene.Mutation):
         name = graphene.String(required=True)
 
     @is_authenticated
+    @transaction.atomic
     def mutate(self, info, name):
         try:
             instance = info.context.user.user_business
@@ -190,6 +483,7 @@ class UpdateBusiness(graphene.Mutation):
 
         instance.name = name
         instance.save()
+        outbox.emit(outbox.BUSINESS, outbox.UPDATED, instance.id, name=name)
 
         return UpdateBusiness(
             business=instance
@@ -200,8 +494,16 @@ class DeleteBusiness(graphene.Mutation):
     status = graphene.Boolean()
 
     @is_authenticated
+    @transaction.atomic
     def mutate(self, info):
-        Business.objects.filter(user_id=info.context.user.id).delete()
+        business_ids = list(Business.objects.filter(user_id=info.context.user.id).values_list("id", flat=True))
+        product_ids = []
+        for business_id in business_ids:
+            product_ids += delete_products(business_db(business_id), business_id=business_id)
+
+        Business.objects.filter(id__in=business_ids).delete()
+        outbox.emit_many(outbox.PRODUCT, outbox.DELETED, product_ids)
+        outbox.emit_many(outbox.BUSINESS, outbox.DELETED, business_ids)
 
         return DeleteBusiness(
             status=True
@@ -228,13 +530,15 @@ class CreateProduct(graphene.Mutation):
         images = graphene.List(ProductImageInput)
 
     @is_authenticated
+    @transaction.atomic
     def mutate(self, info, total_count, product_data, images, **kwargs):
         try:
             buss_id = info.context.user.user_business.id
         except Exception:
             raise Exception("You do not have a business")
 
-        have_product = Product.objects.filter(business_id=buss_id, name=product_data["name"])
+        db = business_db(buss_id)
+        have_product = Product.objects.using(db).filter(business_id=buss_id, name=product_data["name"]).exists()
         if have_product:
             raise Exception("You already have a product with this name")
 
@@ -242,11 +546,13 @@ class CreateProduct(graphene.Mutation):
         product_data["total_count"] = total_count
         product_data["business_id"] = buss_id
 
-        product = Product.objects.create(**product_data, **kwargs)
+        with transaction.atomic(using=db):
+            product = Product.objects.using(db).create(**product_data, **kwargs)
 
-        ProductImage.objects.bulk_create([
-            ProductImage(product_id=product.id, **image_data) for image_data in images
-        ])
+            ProductImage.objects.using(db).bulk_create([
+                ProductImage(product_id=product.id, **image_data) for image_data in images
+            ])
+        outbox.emit(outbox.PRODUCT, outbox.CREATED, product.id, **outbox.product_data(product))
 
         return CreateProduct(
             product=product
@@ -262,21 +568,28 @@ class UpdateProduct(graphene.Mutation):
         product_id = graphene.ID(required=True)
 
     @is_authenticated
+    @transaction.atomic
     def mutate(self, info, product_data, product_id, **kwargs):
         try:
             buss_id = info.context.user.user_business.id
         except Exception:
             raise Exception("You do not have a business")
 
+        db = business_db(buss_id)
         if product_data.get("name", None):
-            have_product = Product.objects.filter(business_id=buss_id, name=product_data["name"])
+            have_product = Product.objects.using(db).filter(business_id=buss_id, name=product_data["name"]).exists()
             if have_product:
                 raise Exception("You already have a product with this name")
 
-        Product.objects.filter(id=product_id, business_id=buss_id).update(**product_data, **kwargs)
+        updated = Product.objects.using(db).filter(id=product_id, business_id=buss_id).update(**product_data, **kwargs)
+        if updated:
+            outbox.emit(outbox.PRODUCT, outbox.UPDATED, product_id, business_id=buss_id, **product_data, **kwargs)
+            if kwargs.get("total_available", None) is not None:
+                stock.set_stock(product_id, kwargs["total_available"])
+                ProductStockChanged.notify(product_id, kwargs["total_available"])
 
         return UpdateProduct(
-            product=Product.objects.get(id=product_id)
+            product=Product.objects.using(db).get(id=product_id)
         )
 
 
@@ -287,8 +600,12 @@ class DeleteProduct(graphene.Mutation):
         product_id = graphene.ID(required=True)
 
     @is_authenticated
+    @transaction.atomic
     def mutate(self, info, product_id):
-        Product.objects.filter(id=product_id, business_id=info.context.user.user_business.id).delete()
+        buss_id = info.context.user.user_business.id
+        deleted = delete_products(business_db(buss_id), id=product_id, business_id=buss_id)
+        if deleted:
+            outbox.emit(outbox.PRODUCT, outbox.DELETED, product_id, business_id=buss_id)
 
         return DeleteProduct(
             status=True
@@ -303,22 +620,26 @@ class UpdateProductImage(graphene.Mutation):
         id = graphene.ID(required=True)
     
     @is_authenticated
+    @transaction.atomic
     def mutate(self, info, image_data, id):
         try:
             buss_id = info.context.user.user_business.id
         except Exception:
             raise Exception("You do not have a business, access denied.")
 
-        my_image = ProductImage.objects.filter(product__business_id=buss_id, id=id)
-        if not my_image:
+        db = business_db(buss_id)
+        my_image = ProductImage.objects.using(db).filter(product__business_id=buss_id, id=id)
+        product_id = my_image.values_list("product_id", flat=True).first()
+        if not product_id:
             raise Exception("You do not own this product")
 
         my_image.update(**image_data)
         if image_data.get("is_cover", False):
-            ProductImage.objects.filter(product__business_id=buss_id).exclude(id=id).update(is_cover=False)
+            ProductImage.objects.using(db).filter(product__business_id=buss_id).exclude(id=id).update(is_cover=False)
+        outbox.emit(outbox.PRODUCT_IMAGE, outbox.UPDATED, id, product_id=product_id, **image_data)
 
         return UpdateProductImage(
-            image = ProductImage.objects.get(id=id)
+            image = ProductImage.objects.using(db).get(id=id)
         )
 
 
@@ -331,6 +652,7 @@ class CreateProductComment(graphene.Mutation):
         rate = graphene.Int()
 
     @is_authenticated
+    @transaction.atomic
     def mutate(self, info, product_id, **kwargs):
         user_buss_id = None
         try:
@@ -338,16 +660,22 @@ class CreateProductComment(graphene.Mutation):
         except Exception:
             pass
 
+        try:
+            db = product_db(product_id)
+        except Product.DoesNotExist:
+            raise Exception("Product with product_id does not exist")
+
         if user_buss_id:
-            own_product = Product.objects.filter(business_id=user_buss_id, id=product_id)
+            own_product = Product.objects.using(db).filter(business_id=user_buss_id, id=product_id)
             if own_product:
                 raise Exception("You cannot comment on you product")
 
-        ProductComment.objects.filter(user=info.context.user.id, product_id=product_id).delete()
+        ProductComment.objects.using(db).filter(user=info.context.user.id, product_id=product_id).delete()
 
-        pc = ProductComment.objects.create(product_id=product_id, **kwargs)
+        pc = ProductComment.objects.using(db).create(product_id=product_id, user_id=info.context.user.id, **kwargs)
+        outbox.emit(outbox.COMMENT, outbox.CREATED, pc.id, product_id=pc.product_id, rate=pc.rate)
 
-        return CreateProduct(
+        return CreateProductComment(
             product_comment = pc
         )
 
@@ -361,26 +689,20 @@ class HandleWishList(graphene.Mutation):
 
     @is_authenticated
     def mutate(self, info, product_id, is_check=False):
-        try:
-            product = Product.objects.get(id=product_id)
-        except Exception:
-            raise Exception("Product with product_id does not exist")
+        user_id = info.context.user.id
 
-        try:
-            user_wish = info.context.user.user_wish
-        except Exception:
-            user_wish = Wish.objects.create(user_id=info.context.user.id)
+        if is_check:
+            has_product = Wish.products.through.objects.filter(
+                wish__user_id=user_id, product_id=product_id).exists()
+            return HandleWishList(status=has_product)
 
-        has_product = user_wish.products.filter(id=product_id)
+        try:
+            added = Wish.objects.toggle_product(user_id, product_id)
+        except Product.DoesNotExist:
+            raise Exception("Product with product_id does not exist")
 
-        if has_product:
-            if is_check:
-                return HandleWishList(status=True)
-            user_wish.products.remove(product)
-        else:
-            if is_check:
-                return HandleWishList(status=False)
-            user_wish.products.add(product)
+        if added:
+            add_popularity_task.delay(scores=[popularity.score(product_id, popularity.WISH)])
 
         return HandleWishList(status=True)
 
@@ -393,10 +715,23 @@ class CreateCartItem(graphene.Mutation):
         quantity = graphene.Int()
 
     @is_authenticated
+    @transaction.atomic
     def mutate(self, info, product_id, **kwargs):
-        Cart.objects.filter(product_id=product_id, user_id=info.context.user.id).delete()
+        previous = list(Cart.objects.filter(
+            product_id=product_id, user_id=info.context.user.id).values_list("id", flat=True))
+        if previous:
+            stock.release(previous)
+            Cart.objects.filter(id__in=previous).delete()
+            outbox.emit_many(outbox.CART, outbox.DELETED, previous)
 
         cart_item = Cart.objects.create(product_id=product_id, user_id=info.context.user.id, **kwargs)
+        try:
+            stock.reserve(cart_item)
+        except Product.DoesNotExist:
+            raise Exception("Product with product_id does not exist")
+        outbox.emit(outbox.CART, outbox.CREATED, cart_item.id,
+                    product_id=cart_item.product_id, quantity=cart_item.quantity)
+        add_popularity_task.delay(scores=[popularity.score(product_id, popularity.CART, cart_item.quantity)])
 
         return CreateCartItem(
             cart_item=cart_item
@@ -411,8 +746,14 @@ class UpdateCartItem(graphene.Mutation):
         quantity = graphene.Int(required=True)
 
     @is_authenticated
+    @transaction.atomic
     def mutate(self, info, cart_id, **kwargs):
-        Cart.objects.filter(id=cart_id, user_id=info.context.user.id).update(**kwargs)
+        cart_item = Cart.objects.filter(id=cart_id, user_id=info.context.user.id).first()
+        if cart_item:
+            stock.release([cart_item.id])
+            stock.reserve(cart_item, kwargs["quantity"])
+            Cart.objects.filter(id=cart_id).update(**kwargs)
+            outbox.emit(outbox.CART, outbox.UPDATED, cart_id, **kwargs)
 
         return UpdateCartItem(
             cart_item = Cart.objects.get(id=cart_id)
@@ -426,8 +767,13 @@ class DeleteCartItem(graphene.Mutation):
         cart_id = graphene.ID(required=True)
 
     @is_authenticated
+    @transaction.atomic
     def mutate(self, info, cart_id):
-        Cart.objects.filter(id=cart_id, user_id=info.context.user.id).delete()
+        cart_items = Cart.objects.filter(id=cart_id, user_id=info.context.user.id)
+        stock.release(cart_items.values_list("id", flat=True))
+        deleted, _ = cart_items.delete()
+        if deleted:
+            outbox.emit(outbox.CART, outbox.DELETED, cart_id)
 
         return DeleteCartItem(
             status = True
@@ -438,20 +784,25 @@ class CompletePayment(graphene.Mutation):
     status = graphene.Boolean()
 
     @is_authenticated
+    @transaction.atomic
     def mutate(self, info):
-        user_carts = Cart.objects.filter(user_id=info.context.user.id)
-
-        RequestCart.objects.bulk_create([
-            RequestCart(
-                user_id=info.context.user.id,
-                business_id=cart_item.product.business.id,
-                product_id=cart_item.product.id,
-                quantity=cart_item.quantity,
-                price=cart_item.quantity * cart_item.product.price
-            ) for cart_item in user_carts
+        # locked so the orders are written from the same carts the stock was checked out for
+        user_carts = Cart.objects.select_for_update().filter(user_id=info.context.user.id)
+        for product_id, data in stock.checkout(user_carts).items():
+            outbox.emit(outbox.PRODUCT, outbox.UPDATED, product_id, **data)
+            ProductStockChanged.notify(product_id, data["total_available"])
+
+        request_carts = order_carts(info.context.user.id)
+        record_sales_task.delay(rows=sales_rows(request_carts))
+        add_popularity_task.delay(scores=[
+            popularity.score(item.product_id, popularity.PURCHASE, item.quantity) for item in request_carts
         ])
+        NewRequestCart.notify(request_carts)
 
-        user_carts.delete()
+        # only the carts that were locked and paid for, one event for each
+        cart_ids = [cart_item.id for cart_item in user_carts]
+        Cart.objects.filter(id__in=cart_ids).delete()
+        outbox.emit_many(outbox.CART, outbox.DELETED, cart_ids)
 
         return CompletePayment(
             status=True
@@ -473,7 +824,3 @@ class Mutation(graphene.ObjectType):
     update_cart_item = UpdateCartItem.Field()
     delete_cart_item = DeleteCartItem.Field()
     complete_payment = CompletePayment.Field()
-
-
-
-schema = graphene.Schema(query=Query, mutation=Mutation)
\ No newline at end of file
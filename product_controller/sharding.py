@@ -0,0 +1,325 @@
+import copy
+import heapq
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count
+
+from ecommerce_api.caches import TTLCache
+from .models import (
+    Category, Business, Product, ProductImage, ProductComment, RequestCart,
+    Cart, Wish, SalesRollup, RelatedProduct, ShardAssignment, StockCounter, StockReservation
+)
+
+HOME = "default"
+
+# rows of these live on the shard of the business owning them, parents first
+SHARDED_MODELS = (Product, ProductImage, ProductComment, RequestCart)
+BUSINESS_LOOKUPS = {
+    Product: "business_id",
+    ProductImage: "product__business_id",
+    ProductComment: "product__business_id",
+    RequestCart: "business_id",
+}
+
+# small tables copied to every shard so sharded rows can still join them
+REFERENCE_MODELS = (Category, Business)
+
+business_shards = TTLCache(100000)
+product_shards = TTLCache(100000)
+
+
+def sharding_enabled():
+    return bool(settings.CATALOG_SHARDS)
+
+
+def shards():
+    return settings.CATALOG_SHARDS or [HOME]
+
+
+def cache_expiry():
+    return time.time() + settings.SHARD_MAP_CACHE_SECONDS
+
+
+def business_db(business_id):
+    if not sharding_enabled():
+        return HOME
+
+    shard = business_shards.get(int(business_id))
+    if shard is None:
+        # businesses that were never placed predate sharding and still live at home
+        shard = ShardAssignment.objects.using(HOME).filter(
+            business_id=business_id).values_list("shard", flat=True).first() or HOME
+        business_shards.set(int(business_id), shard, cache_expiry())
+    return shard
+
+
+def user_business_db(user):
+    if not sharding_enabled():
+        return HOME
+
+    business_id = Business.objects.using(HOME).filter(user_id=user.id).values_list("id", flat=True).first()
+    return business_db(business_id) if business_id else HOME
+
+
+def product_db(product_id):
+    if not sharding_enabled():
+        return HOME
+
+    shard = product_shards.get(int(product_id))
+    if shard is None:
+        for alias in shards():
+            business_id = Product.objects.using(alias).filter(id=product_id).values_list("business_id", flat=True).first()
+            # a business being moved has its rows on both shards for a moment
+            if business_id is not None and business_db(business_id) == alias:
+                shard = alias
+                break
+        else:
+            raise Product.DoesNotExist()
+        product_shards.set(int(product_id), shard, cache_expiry())
+    return shard
+
+
+def get_products(product_ids, queryset=None):
+    queryset = Product.objects.all() if queryset is None else queryset
+    products = {}
+    for alias in shards():
+        for product in queryset.using(alias).filter(id__in=product_ids):
+            products[product.id] = product
+    return products
+
+
+def bulk_create_by_business(model, objs):
+    grouped = defaultdict(list)
+    for obj in objs:
+        grouped[business_db(obj.business_id)].append(obj)
+
+    created = []
+    for alias, items in grouped.items():
+        created += model.objects.using(alias).bulk_create(items)
+    return created
+
+
+def delete_products(alias, **filters):
+    queryset = Product.objects.using(alias).filter(**filters)
+    product_ids = list(queryset.values_list("id", flat=True))
+    queryset.delete()
+
+    if alias != HOME and product_ids:
+        # the cascade only reaches rows on the product's own shard
+        Cart.objects.using(HOME).filter(product_id__in=product_ids).delete()
+        Wish.products.through.objects.using(HOME).filter(product_id__in=product_ids).delete()
+        SalesRollup.objects.using(HOME).filter(product_id__in=product_ids).delete()
+        RelatedProduct.objects.using(HOME).filter(product_id__in=product_ids).delete()
+        RelatedProduct.objects.using(HOME).filter(related_id__in=product_ids).delete()
+        StockCounter.objects.using(HOME).filter(product_id__in=product_ids).delete()
+        StockReservation.objects.using(HOME).filter(product_id__in=product_ids).delete()
+
+    return product_ids
+
+
+class Descending:
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class ScatterQuerySet:
+    # one queryset run on every shard; counts add up and slices are merged in the queryset's
+    # order, so Paginator can page through it as if it were one table
+    ordered = True
+
+    def __init__(self, queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not any(field.lstrip("-") in ("id", "pk") for field in ordering):
+            ordering.append("-id" if ordering and ordering[0].startswith("-") else "id")
+
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = ordering
+        self.total = None
+
+    def key(self, item):
+        values = []
+        for field in self.ordering:
+            value = item
+            for part in field.lstrip("-").split("__"):
+                value = getattr(value, part)
+            values.append(Descending(value) if field.startswith("-") else value)
+        return values
+
+    def count(self):
+        if self.total is None:
+            self.total = sum(self.queryset.using(alias).count() for alias in shards())
+        return self.total
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+
+        # any shard may hold the whole page, so each is read up to its end; deep pages cost more
+        start, stop = index.start or 0, index.stop
+        parts = [list(self.queryset.using(alias)[:stop]) for alias in shards()]
+        return list(heapq.merge(*parts, key=self.key))[start:stop]
+
+
+def scatter(queryset):
+    return ScatterQuerySet(queryset) if sharding_enabled() else queryset
+
+
+class ShardRouter:
+    def db_for_read(self, model, **hints):
+        if model not in SHARDED_MODELS:
+            return HOME
+
+        instance = hints.get("instance", None)
+        if instance is None:
+            return None
+        if isinstance(instance, SHARDED_MODELS) and instance._state.db:
+            return instance._state.db
+        if isinstance(instance, (Product, RequestCart)):
+            return business_db(instance.business_id)
+        if isinstance(instance, Business):
+            return business_db(instance.id)
+        if getattr(instance, "product_id", None):
+            return product_db(instance.product_id)
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+def replicate(model, instance, deleted=False):
+    for alias in shards():
+        if alias == HOME:
+            continue
+        if deleted:
+            model.objects.using(alias).filter(pk=instance.pk).delete()
+        else:
+            copy.copy(instance).save(using=alias)
+
+
+def place_business(business):
+    loads = defaultdict(int, {alias: 0 for alias in shards()})
+    loads.update(ShardAssignment.objects.using(HOME).values_list("shard").annotate(total=Count("id")).order_by())
+    loads[HOME] += Business.objects.using(HOME).count() - sum(loads.values())
+
+    shard = min(shards(), key=lambda alias: loads[alias])
+    ShardAssignment.objects.using(HOME).update_or_create(business_id=business.id, defaults={"shard": shard})
+    business_shards.set(business.id, shard, cache_expiry())
+    return shard
+
+
+def copy_reference_tables():
+    for alias in shards():
+        if alias == HOME:
+            continue
+        for model in REFERENCE_MODELS:
+            rows = list(model.objects.using(HOME).all())
+            model.objects.using(alias).bulk_create(rows, ignore_conflicts=True)
+            fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+            model.objects.using(alias).bulk_update(rows, fields, batch_size=1000)
+
+
+def drop_cross_shard_constraints():
+    sharded = {model._meta.db_table for model in SHARDED_MODELS}
+    local = sharded | {model._meta.db_table for model in REFERENCE_MODELS}
+
+    for alias in shards():
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT conrelid::regclass::text, conname, confrelid::regclass::text FROM pg_constraint
+                WHERE contype = 'f' AND conparentid = 0
+            """)
+            for table, name, referenced in cursor.fetchall():
+                if alias == HOME:
+                    # home rows pointing at products that may now live elsewhere
+                    crossing = table not in sharded and referenced in sharded
+                else:
+                    # shard rows pointing at tables only the home database holds
+                    crossing = table in local and referenced not in local
+                if crossing:
+                    cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {connection.ops.quote_name(name)}")
+
+
+def interleave_sequences():
+    # shard i hands out ids i, i + n, i + 2n... so rows keep their id when moved between shards
+    count = len(shards())
+    for model in SHARDED_MODELS:
+        table = model._meta.db_table
+        top = 0
+        for alias in shards():
+            with connections[alias].cursor() as cursor:
+                cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+                top = max(top, cursor.fetchone()[0])
+
+        for index, alias in enumerate(shards()):
+            with connections[alias].cursor() as cursor:
+                cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+                sequence = cursor.fetchone()[0]
+                cursor.execute(f"ALTER SEQUENCE {sequence} INCREMENT BY {count} "
+                               f"RESTART WITH {top - top % count + count + index}")
+
+
+def prepare_shards():
+    copy_reference_tables()
+    if all(connections[alias].vendor == "postgresql" for alias in shards()):
+        drop_cross_shard_constraints()
+        interleave_sequences()
+        return True
+    return False
+
+
+def shard_loads():
+    loads = {alias: {} for alias in shards()}
+    for alias in shards():
+        for business_id, total in Product.objects.using(alias).values_list("business_id").annotate(
+            total=Count("id")
+        ).order_by():
+            if business_db(business_id) == alias:
+                loads[alias][business_id] = total
+    return loads
+
+
+def move_business(business_id, target, batch_size=2000):
+    source = business_db(business_id)
+    if source == target:
+        return 0
+
+    moved = 0
+    with transaction.atomic(using=HOME), transaction.atomic(using=source), transaction.atomic(using=target):
+        # holding the business row keeps two moves of one business apart
+        Business.objects.using(HOME).select_for_update().filter(id=business_id).first()
+
+        for model in SHARDED_MODELS:
+            rows = model.objects.using(source).filter(**{BUSINESS_LOOKUPS[model]: business_id})
+            batch = []
+            for row in rows.iterator(chunk_size=batch_size):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    moved += len(model.objects.using(target).bulk_create(batch))
+                    batch = []
+            moved += len(model.objects.using(target).bulk_create(batch))
+
+        ShardAssignment.objects.using(HOME).update_or_create(business_id=business_id, defaults={"shard": target})
+
+        # children first, and without Django's cascade, which would also take carts and wishes at home
+        for model in reversed(SHARDED_MODELS):
+            rows = model.objects.using(source).filter(**{BUSINESS_LOOKUPS[model]: business_id})
+            rows._raw_delete(source)
+
+    business_shards.set(business_id, target, cache_expiry())
+    product_shards.clear()
+    return moved
@@ -0,0 +1,152 @@
+import random
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Product, StockCounter, StockReservation
+from .sharding import product_db
+
+
+def split(total, slots):
+    return [total // slots + (1 if slot < total % slots else 0) for slot in range(slots)]
+
+
+def ensure_counters(product_id):
+    if StockCounter.objects.filter(product_id=product_id).exists():
+        return
+
+    product = Product.objects.using(product_db(product_id)).get(id=product_id)
+    StockCounter.objects.bulk_create([
+        StockCounter(product_id=product_id, slot=slot, available=available)
+        for slot, available in enumerate(split(product.total_available, settings.STOCK_COUNTER_SLOTS))
+    ], ignore_conflicts=True)
+
+
+def take(product_id, quantity):
+    # one conditional update on a random slot first, only a short slot needs the whole product locked
+    slots = list(range(settings.STOCK_COUNTER_SLOTS))
+    random.shuffle(slots)
+    for slot in slots:
+        if StockCounter.objects.filter(product_id=product_id, slot=slot, available__gte=quantity).update(
+            available=F("available") - quantity
+        ):
+            return {slot: quantity}
+
+    with transaction.atomic():
+        counters = list(StockCounter.objects.select_for_update().filter(product_id=product_id).order_by("slot"))
+        if sum(counter.available for counter in counters) < quantity:
+            return None
+
+        taken = {}
+        for counter in sorted(counters, key=lambda counter: -counter.available):
+            amount = min(counter.available, quantity - sum(taken.values()))
+            if amount:
+                taken[counter.slot] = amount
+                counter.available -= amount
+        StockCounter.objects.bulk_update(counters, ["available"])
+
+    return taken
+
+
+def available(product_ids):
+    return dict(StockCounter.objects.filter(product_id__in=product_ids).values_list("product_id").annotate(
+        total=Sum("available")).order_by())
+
+
+def reserve(cart, quantity=None):
+    quantity = cart.quantity if quantity is None else quantity
+    if quantity < 1:
+        raise Exception("Quantity must be at least 1")
+
+    ensure_counters(cart.product_id)
+
+    taken = take(cart.product_id, quantity)
+    if taken is None:
+        release_expired(product_id=cart.product_id)
+        taken = take(cart.product_id, quantity)
+    if taken is None:
+        raise Exception(f"Only {available([cart.product_id]).get(int(cart.product_id), 0)} left in stock")
+
+    expires_at = timezone.now() + timedelta(seconds=settings.CART_RESERVATION_SECONDS)
+    StockReservation.objects.bulk_create([
+        StockReservation(cart_id=cart.id, product_id=cart.product_id, slot=slot, quantity=amount, expires_at=expires_at)
+        for slot, amount in taken.items()
+    ])
+
+
+def restore(reservations):
+    totals = defaultdict(int)
+    for reservation in reservations:
+        totals[(reservation.product_id, reservation.slot)] += reservation.quantity
+
+    # a stable order keeps concurrent releases from deadlocking on each other
+    for (product_id, slot), quantity in sorted(totals.items()):
+        StockCounter.objects.filter(product_id=product_id, slot=slot).update(available=F("available") + quantity)
+
+    StockReservation.objects.filter(id__in=[reservation.id for reservation in reservations]).delete()
+    return len(reservations)
+
+
+@transaction.atomic
+def release(cart_ids):
+    # locking first means the sweeper and checkout can't both act on one reservation
+    return restore(list(StockReservation.objects.select_for_update().filter(cart_id__in=cart_ids)))
+
+
+def release_expired(product_id=None, batch_size=1000):
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = StockReservation.objects.select_for_update(skip_locked=True).filter(
+                expires_at__lte=timezone.now())
+            if product_id is not None:
+                expired = expired.filter(product_id=product_id)
+
+            batch = restore(list(expired.order_by("expires_at")[:batch_size]))
+        released += batch
+        if batch < batch_size:
+            return released
+
+
+@transaction.atomic
+def checkout(carts):
+    # held stock is sold as it is, carts whose hold lapsed have to win it again
+    held = set()
+    reservations = list(StockReservation.objects.select_for_update().filter(cart_id__in=[cart.id for cart in carts]))
+    for reservation in reservations:
+        held.add(reservation.cart_id)
+    StockReservation.objects.filter(id__in=[reservation.id for reservation in reservations]).delete()
+
+    # counters are locked in product order, like restore(), so two checkouts can't deadlock
+    sold = defaultdict(int)
+    for cart in sorted(carts, key=lambda cart: (cart.product_id, cart.id)):
+        if cart.id not in held:
+            ensure_counters(cart.product_id)
+            if take(cart.product_id, cart.quantity) is None:
+                raise Exception(f"{cart.product.name} is out of stock")
+        sold[cart.product_id] += cart.quantity
+
+    # what is left of each product sold, for the mutation to announce
+    left = {}
+    for product_id, quantity in sorted(sold.items()):
+        products = Product.objects.using(product_db(product_id)).filter(id=product_id)
+        products.update(total_available=Greatest(F("total_available") - quantity, 0))
+        left[product_id] = products.values("business_id", "total_available").get()
+    return left
+
+
+@transaction.atomic
+def set_stock(product_id, total_available):
+    counters = list(StockCounter.objects.select_for_update().filter(product_id=product_id).order_by("slot"))
+    if not counters:
+        return
+
+    held = StockReservation.objects.filter(product_id=product_id).aggregate(total=Sum("quantity"))["total"] or 0
+    for counter, amount in zip(counters, split(max(total_available - held, 0), len(counters))):
+        counter.available = amount
+    StockCounter.objects.bulk_update(counters, ["available"])
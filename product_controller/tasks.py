@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+from task_controller.models import Task
+from task_controller.queue import task
+from .partitions import ensure_partitions
+from .rollups import record_sales
+from .popularity import add_popularity
+
+
+@task("product.record_sales", batch_size=50)
+def record_sales_task(payloads):
+    record_sales([row for payload in payloads for row in payload["rows"]])
+
+
+@task("product.add_popularity", batch_size=200)
+def add_popularity_task(payloads):
+    add_popularity([item for payload in payloads for item in payload["scores"]])
+
+
+@task("product.ensure_partitions")
+def ensure_partitions_task():
+    # reschedules itself while the table is partitioned; the next run commits with this one,
+    # so there is only ever one of them queued
+    if ensure_partitions():
+        ensure_partitions_task.delay(run_at=timezone.now() + timedelta(days=1))
+
+
+def schedule_partition_maintenance():
+    if not Task.objects.filter(
+        name="product.ensure_partitions", status__in=(Task.PENDING, Task.RUNNING)
+    ).exists():
+        ensure_partitions_task.delay()
@@ -1,3 +1,753 @@
-from django.test import TestCase
+import os
+import tempfile
+import tracemalloc
+from datetime import date, datetime, time, timedelta
+from io import StringIO
+from itertools import islice
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, tag, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ecommerce_api import throttling
+from ecommerce_api.channel_layer import check_channel_layer
+from ecommerce_api.authentication import TokenManager, token_cache, user_cache
+from ecommerce_api.revocation import revocation_list
+from user_controller.models import User, ImageUpload
+from .admin import ProductAdmin, CategoryAdmin, BusinessAdmin
+from .management.commands.check_query_plans import Command as CheckQueryPlans
+from . import outbox, partitions, stock
+from .autocomplete import PrefixIndex
+from .related import build_related_products
+from .models import (
+    Category, Business, Product, ProductComment,
+    ProductImage, Wish, Cart, RequestCart, SalesRollup, CatalogEvent, RelatedProduct, StockReservation
+)
+from .rollups import sales_rows, record_sales, rebuild_sales_rollups
+from .schema import ProductStockChanged
+
+# the session and its user, then the page's count and its rows
+CHANGELIST_QUERIES = 4
+# unfiltered lists of large tables ask pg_class for an estimate before counting
+ESTIMATE_QUERIES = 1 if connection.vendor == "postgresql" else 0
+
+
+class GraphQLTestCase(TestCase):
+    # ids are reused between tests, so nothing cached by an earlier one may leak into the next
+    def setUp(self):
+        token_cache.clear()
+        user_cache.clear()
+        revocation_list.reset()
+        throttling.bucket_store = None
+
+    def graphql(self, query, user=None, variables=None, **headers):
+        if user:
+            headers["HTTP_AUTHORIZATION"] = f"JWT {TokenManager.get_token(5, {'user_id': user.id})}"
+        return self.client.post("/graphview/", {"query": query, "variables": variables or {}},
+                                content_type="application/json", **headers)
+
+    def data(self, query, user=None, variables=None, **headers):
+        content = self.graphql(query, user, variables, **headers).json()
+        self.assertNotIn("errors", content)
+        return content["data"]
+
+    def errors(self, query, user=None, variables=None, **headers):
+        # graphql-core logs every resolver exception with its traceback
+        with self.assertLogs("graphql.execution.utils", "ERROR"):
+            return self.graphql(query, user, variables, **headers).json()["errors"]
+
+    @staticmethod
+    def create_catalog(products=3):
+        user = User.objects.create_user("seller@example.com", "password", first_name="first", last_name="last")
+        business = Business.objects.create(user=user, name="Business")
+        category = Category.objects.create(name="Category")
+        return user, [
+            Product.objects.create(
+                category=category, business=business, name=f"Product{i}", price=10 * (i + 1),
+                total_available=5, total_count=5, description="description"
+            ) for i in range(products)
+        ]
+
+
+class WishListTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller, self.products = self.create_catalog()
+        self.user = User.objects.create_user("buyer@example.com", "password", first_name="first", last_name="last")
+
+    def test_is_wished_is_loaded_in_one_query(self):
+        Wish.objects.create(user=self.user).products.add(self.products[0], self.products[2])
+        Cart.objects.create(user=self.user, product=self.products[1])
+
+        with CaptureQueriesContext(connection) as queries:
+            data = self.data("{ products { results { id isWished inCart } } }", self.user)
+
+        flags = {int(item["id"]): (item["isWished"], item["inCart"]) for item in data["products"]["results"]}
+        self.assertEqual(flags, {
+            self.products[0].id: (True, False),
+            self.products[1].id: (False, True),
+            self.products[2].id: (True, False),
+        })
+        wish_queries = [query for query in queries.captured_queries if "wish_products" in query["sql"]]
+        self.assertEqual(len(wish_queries), 1)
+
+    def test_anonymous_users_wish_nothing(self):
+        data = self.data("{ products { results { isWished } } }")
+        self.assertFalse(any(item["isWished"] for item in data["products"]["results"]))
+
+    def test_toggle(self):
+        mutation = "mutation($id: ID!) { handleWishList(productId: $id) { status } }"
+        check = "mutation($id: ID!) { handleWishList(productId: $id, isCheck: true) { status } }"
+        product_id = self.products[0].id
+
+        self.data(mutation, self.user, {"id": product_id})
+        self.assertTrue(self.data(check, self.user, {"id": product_id})["handleWishList"]["status"])
+        self.data(mutation, self.user, {"id": product_id})
+        self.assertFalse(self.data(check, self.user, {"id": product_id})["handleWishList"]["status"])
+
+        errors = self.errors(mutation, self.user, {"id": 0})
+        self.assertEqual(errors[0]["message"], "Product with product_id does not exist")
+
+
+class ExposedRelationTests(GraphQLTestCase):
+    def test_reverse_relations_cannot_be_queried(self):
+        self.create_catalog(1)
+        queries = {
+            "businessRequests": "{ products { results { business { businessRequests { id } } } } }",
+            "businessProducts": "{ products { results { business { businessProducts { id } } } } }",
+            "productCategories": "{ categories { results { productCategories { id } } } }",
+            "productRequests": "{ products { results { productRequests { id } } } }",
+            "userCarts": "{ users { results { userCarts { id } } } }",
+            "userRequests": "{ users { results { userRequests { id } } } }",
+            "userComments": "{ users { results { userComments { id } } } }",
+            "userWish": "{ users { results { userWish { id } } } }",
+            "password": "{ users { results { password } } }",
+        }
+        for field, query in queries.items():
+            with self.subTest(field):
+                errors = self.graphql(query).json()["errors"]
+                self.assertIn(f'Cannot query field "{field}"', errors[0]["message"])
+
+    def test_counts_and_owners_still_can(self):
+        self.create_catalog(2)
+        data = self.data("{ categories { results { name count } } products { results { business { name user { email } } } } }")
+        self.assertEqual(data["categories"]["results"], [{"name": "Category", "count": 2}])
+        self.assertEqual(data["products"]["results"][0]["business"],
+                         {"name": "Business", "user": {"email": "seller@example.com"}})
+
+    @override_settings(CATALOG_SHARDS=["default"])
+    def test_sharded_category_counts(self):
+        self.create_catalog(2)
+        Category.objects.create(name="Empty")
+        # no join to count through, one GROUP BY per shard for the whole page
+        with CaptureQueriesContext(connection) as queries:
+            data = self.data("{ categories { results { name count } } }")
+        self.assertEqual(data["categories"]["results"], [{"name": "Category", "count": 2}, {"name": "Empty", "count": 0}])
+        self.assertEqual(sum("GROUP BY" in query["sql"] for query in queries.captured_queries), 1)
+
+
+class SalesRollupTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller, self.products = self.create_catalog(2)
+        self.business = self.products[0].business
+        self.orders = [
+            RequestCart.objects.create(product=product, business=self.business, user=self.seller,
+                                       quantity=2, price=product.price * 2)
+            for product in self.products + self.products[:1]
+        ]
+
+    def totals(self):
+        return sorted(SalesRollup.objects.values_list("product_id", "revenue", "units", "orders"))
+
+    def expected(self):
+        return [(self.products[0].id, 40, 4, 2), (self.products[1].id, 40, 2, 1)]
+
+    def test_recording_an_order_twice_counts_it_once(self):
+        record_sales(sales_rows(self.orders))
+        record_sales(sales_rows(self.orders[:1]))
+        self.assertEqual(self.totals(), self.expected())
+
+    def test_tasks_queued_before_a_rebuild_add_nothing(self):
+        rows = sales_rows(self.orders)
+        self.assertEqual(rebuild_sales_rollups(self.business.id), 2)
+        record_sales(rows)
+        self.assertEqual(self.totals(), self.expected())
+
+    def test_rebuild_keeps_what_was_recorded(self):
+        record_sales(sales_rows(self.orders[:2]))
+        rebuild_sales_rollups()
+        record_sales(sales_rows(self.orders))
+        self.assertEqual(self.totals(), self.expected())
+
+        summary = self.data("{ salesSummary { revenue units orders } }", self.seller)["salesSummary"]
+        self.assertEqual(summary, {"revenue": 80, "units": 6, "orders": 3})
+
+
+class PartitionTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller, self.products = self.create_catalog(1)
+        self.business = self.products[0].business
+
+    def order(self, days_ago):
+        order = RequestCart.objects.create(product=self.products[0], business=self.business,
+                                           user=self.seller, quantity=1, price=10)
+        RequestCart.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return order.id
+
+    def request_carts(self, **variables):
+        query = "query($start: Date, $end: Date) { requestCarts(startDate: $start, endDate: $end, size: 50) { results { id } } }"
+        data = self.data(query, self.seller, {key: value.isoformat() for key, value in variables.items()})
+        return {int(item["id"]) for item in data["requestCarts"]["results"]}
+
+    def test_add_months(self):
+        self.assertEqual(partitions.add_months(date(2020, 11, 1), 3), date(2021, 2, 1))
+        self.assertEqual(partitions.add_months(date(2021, 1, 1), -1), date(2020, 12, 1))
+        self.assertEqual(partitions.partition_name(date(2021, 2, 1)), "product_controller_requestcart_p202102")
+
+    def test_request_carts_default_to_recent_orders(self):
+        recent, old = self.order(1), self.order(400)
+        today = timezone.now().date()
+
+        self.assertEqual(self.request_carts(), {recent})
+        self.assertEqual(self.request_carts(start=today - timedelta(days=500)), {recent, old})
+        self.assertEqual(self.request_carts(end=today - timedelta(days=300)), {old})
+
+    def test_convert_ensure_and_archive(self):
+        if connection.vendor != "postgresql":
+            self.skipTest("partitioning is postgres only")
+
+        old = self.order(400)
+        self.assertTrue(partitions.convert_to_partitioned(months_ahead=1))
+        self.assertFalse(partitions.convert_to_partitioned(months_ahead=1))
+
+        names = partitions.ensure_partitions(months_ahead=2)
+        with connection.cursor() as cursor:
+            existing = partitions.list_partitions(cursor)
+        self.assertTrue(set(names) <= set(existing))
+        self.assertIn(partitions.partition_name(partitions.add_months(partitions.current_month(), 2)), existing)
+        self.assertEqual(list(RequestCart.objects.values_list("id", flat=True)), [old])
+
+        # a month past the ones created lands in the default partition until its own is made
+        month = partitions.add_months(partitions.current_month(), 4)
+        future = self.order(0)
+        RequestCart.objects.filter(id=future).update(created_at=timezone.make_aware(datetime.combine(month, time.min)))
+        with connection.cursor() as cursor:
+            partitions.create_partition(cursor, month)
+            cursor.execute(f"SELECT id FROM {partitions.partition_name(month)}")
+            self.assertEqual(cursor.fetchall(), [(future,)])
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            archived = partitions.archive_request_carts(partitions.current_month(), output_dir)
+            self.assertTrue(archived and all(os.path.exists(path) for path in archived))
+        self.assertEqual(list(RequestCart.objects.values_list("id", flat=True)), [future])
+
+
+@override_settings(CATALOG_OUTBOX_SETTLE_SECONDS=0, CATALOG_OUTBOX_GAP_SECONDS=60)
+class OutboxTests(GraphQLTestCase):
+    def events(self, entity):
+        return list(CatalogEvent.objects.filter(entity=entity).values_list("action", "entity_id"))
+
+    def test_gaps_are_read_again_until_they_land(self):
+        first, second, third = [outbox.emit(outbox.PRODUCT, outbox.CREATED, i) for i in range(3)]
+        # the second is still in an open transaction when the others are read
+        CatalogEvent.objects.filter(id=second.id).delete()
+
+        position, gaps = outbox.advance(0, {}, outbox.read_events())
+        self.assertEqual((position, list(gaps)), (third.id, [str(second.id)]))
+        self.assertEqual(outbox.read_events(position, gaps=gaps), [])
+
+        second.save()
+        late = outbox.read_events(position, gaps=gaps)
+        self.assertEqual(late, [second])
+        self.assertEqual(outbox.advance(position, gaps, late), (third.id, {}))
+
+    def test_gaps_are_given_up_on(self):
+        gaps = {"1": 0}
+        self.assertEqual(outbox.advance(2, gaps, []), (2, {}))
+
+    def test_consumer_cursor(self):
+        outbox.emit(outbox.PRODUCT, outbox.CREATED, 1)
+        events = outbox.next_batch("tests")
+        self.assertEqual(len(events), 1)
+        outbox.acknowledge("tests", events)
+        self.assertEqual(outbox.next_batch("tests"), [])
+
+    def test_replaced_carts_are_deleted_in_the_outbox(self):
+        _, products = self.create_catalog(1)
+        user = User.objects.create_user("buyer@example.com", "password", first_name="first", last_name="last")
+        mutation = "mutation($id: ID!) { createCartItem(productId: $id, quantity: 1) { cartItem { id } } }"
+
+        first = self.data(mutation, user, {"id": products[0].id})["createCartItem"]["cartItem"]["id"]
+        second = self.data(mutation, user, {"id": products[0].id})["createCartItem"]["cartItem"]["id"]
+        self.assertEqual(self.events(outbox.CART), [
+            (outbox.CREATED, int(first)), (outbox.DELETED, int(first)), (outbox.CREATED, int(second))
+        ])
+
+        self.data("mutation { completePayment { status } }", user)
+        self.assertEqual(self.events(outbox.CART)[-1], (outbox.DELETED, int(second)))
+
+    def test_categories(self):
+        category = Category.objects.create(name="Category")
+        category.name = "Renamed"
+        category.save()
+        category_id = category.id
+        category.delete()
+
+        self.assertEqual(self.events(outbox.CATEGORY), [
+            (outbox.CREATED, category_id), (outbox.UPDATED, category_id), (outbox.DELETED, category_id)
+        ])
+        self.assertEqual(CatalogEvent.objects.filter(entity=outbox.CATEGORY).first().data, {"name": "Category"})
+
+
+class ChannelLayerTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        _, self.products = self.create_catalog(1)
+        self.user = User.objects.create_user("buyer@example.com", "password", first_name="first", last_name="last")
+        Cart.objects.create(user=self.user, product=self.products[0], quantity=1)
+
+    @override_settings(CHANNEL_REDIS_URL="", CHANNEL_LAYER_IN_MEMORY=False)
+    def test_broadcasts_need_a_shared_layer(self):
+        errors = self.errors("mutation { completePayment { status } }", self.user)
+        self.assertIn("CHANNEL_REDIS_URL", errors[0]["message"])
+        # the payment rolled back with it
+        self.assertTrue(Cart.objects.filter(user=self.user).exists())
+        self.assertFalse(RequestCart.objects.exists())
+
+        self.assertEqual([warning.id for warning in check_channel_layer(None)], ["ecommerce_api.W001"])
+        call_command("check", stdout=StringIO(), stderr=StringIO())
+
+    @override_settings(CHANNEL_REDIS_URL="redis://localhost:6379", CHANNEL_LAYER_IN_MEMORY=False)
+    def test_redis_layer(self):
+        self.assertEqual(check_channel_layer(None), [])
+
+    @override_settings(CHANNEL_REDIS_URL="", CHANNEL_LAYER_IN_MEMORY=True)
+    def test_in_memory_layer_in_one_process(self):
+        self.assertEqual(check_channel_layer(None), [])
+        self.assertTrue(self.data("mutation { completePayment { status } }", self.user)["completePayment"]["status"])
+
+
+class StockTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        _, self.products = self.create_catalog(1)
+        self.product = self.products[0]
+        self.user = User.objects.create_user("buyer@example.com", "password", first_name="first", last_name="last")
+
+    def add_to_cart(self, quantity):
+        mutation = "mutation($id: ID!, $quantity: Int) { createCartItem(productId: $id, quantity: $quantity) { cartItem { id } } }"
+        return self.graphql(mutation, self.user, {"id": self.product.id, "quantity": quantity}).json()
+
+    def test_reserve(self):
+        self.add_to_cart(2)
+        self.assertEqual(stock.available([self.product.id]), {self.product.id: 3})
+        self.assertEqual(sum(StockReservation.objects.values_list("quantity", flat=True)), 2)
+        # the product row is only written at checkout
+        self.assertEqual(Product.objects.get(id=self.product.id).total_available, 5)
+
+        # the new cart replaces the old one, whose hold is handed back first
+        with self.assertLogs("graphql.execution.utils", "ERROR"):
+            content = self.add_to_cart(6)
+        self.assertEqual(content["errors"][0]["message"], "Only 5 left in stock")
+
+    def test_expired_reservations_are_released(self):
+        cart = Cart.objects.create(user=self.user, product=self.product, quantity=4)
+        stock.reserve(cart)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        # a reservation that would not fit sweeps the lapsed ones first
+        other = Cart.objects.create(user=User.objects.create_user(
+            "other@example.com", "password", first_name="first", last_name="last"), product=self.product, quantity=3)
+        stock.reserve(other)
+        self.assertEqual(stock.available([self.product.id]), {self.product.id: 2})
+        self.assertEqual(list(StockReservation.objects.values_list("cart_id", flat=True).distinct()), [other.id])
+
+    def test_checkout(self):
+        self.add_to_cart(2)
+        with mock.patch.object(ProductStockChanged, "notify") as notify:
+            self.data("mutation { completePayment { status } }", self.user)
+
+        self.assertEqual(Product.objects.get(id=self.product.id).total_available, 3)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(stock.available([self.product.id]), {self.product.id: 3})
+
+        event = CatalogEvent.objects.filter(entity=outbox.PRODUCT).get()
+        self.assertEqual((event.action, event.entity_id), (outbox.UPDATED, self.product.id))
+        self.assertEqual(event.data, {"business_id": self.product.business_id, "total_available": 3})
+        notify.assert_called_once_with(self.product.id, 3)
+
+    def test_lapsed_holds_are_won_again(self):
+        Cart.objects.create(user=self.user, product=self.product, quantity=6)
+        errors = self.errors("mutation { completePayment { status } }", self.user)
+        self.assertEqual(errors[0]["message"], "Product0 is out of stock")
+        self.assertEqual(Product.objects.get(id=self.product.id).total_available, 5)
+
+        Cart.objects.filter(user=self.user).update(quantity=5)
+        self.data("mutation { completePayment { status } }", self.user)
+        self.assertEqual(Product.objects.get(id=self.product.id).total_available, 0)
+
+
+class CartSummaryTests(GraphQLTestCase):
+    QUERY = "{ cartSummary { items units total businesses { businessId businessName items units subtotal } } }"
+
+    def setUp(self):
+        super().setUp()
+        _, self.products = self.create_catalog(2)
+        other = Business.objects.create(user=User.objects.create_user(
+            "other@example.com", "password", first_name="first", last_name="last"), name="Other")
+        self.products.append(Product.objects.create(
+            category=self.products[0].category, business=other, name="Boot", price=100,
+            total_available=5, total_count=5, description="description"))
+        self.user = User.objects.create_user("buyer@example.com", "password", first_name="first", last_name="last")
+        # prices 10, 20 and 100
+        for product, quantity in zip(self.products, (3, 1, 2)):
+            Cart.objects.create(user=self.user, product=product, quantity=quantity)
+
+    def expected(self):
+        business, other = self.products[0].business, self.products[2].business
+        return {"items": 3, "units": 6, "total": 250, "businesses": [
+            {"businessId": str(business.id), "businessName": "Business", "items": 2, "units": 4, "subtotal": 50},
+            {"businessId": str(other.id), "businessName": "Other", "items": 1, "units": 2, "subtotal": 200},
+        ]}
+
+    def test_summary(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.data(self.QUERY, self.user)
+        self.assertEqual(data["cartSummary"], self.expected())
+        # one grouped aggregate, not a query per cart
+        self.assertEqual(sum("GROUP BY" in query["sql"] for query in queries.captured_queries), 1)
+
+    @override_settings(CATALOG_SHARDS=["default"])
+    def test_sharded_summary(self):
+        self.assertEqual(self.data(self.QUERY, self.user)["cartSummary"], self.expected())
+
+    def test_empty_cart(self):
+        Cart.objects.all().delete()
+        self.assertEqual(self.data(self.QUERY, self.user)["cartSummary"],
+                         {"items": 0, "units": 0, "total": 0, "businesses": []})
+
+    def test_orders_are_priced_in_the_database(self):
+        self.data("mutation { completePayment { status } }", self.user)
+        self.assertEqual(sorted(RequestCart.objects.values_list("business__name", "quantity", "price")),
+                         [("Business", 1, 20), ("Business", 3, 30), ("Other", 2, 200)])
+
+
+class FacetTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.seller, self.products = self.create_catalog(3)
+        other = Business.objects.create(user=User.objects.create_user(
+            "other@example.com", "password", first_name="first", last_name="last"), name="Other")
+        self.products.append(Product.objects.create(
+            category=Category.objects.create(name="Shoes"), business=other, name="Boot", price=100,
+            total_available=5, total_count=5, description="description"))
+        for product, rates in zip(self.products, ([5, 4], [2], [], [1])):
+            for rate in rates:
+                ProductComment.objects.create(product=product, user=self.seller, comment="comment", rate=rate)
+
+    def facets(self, fields, **variables):
+        query = "query($category: String, $bounds: [Float]) { productFacets(category: $category, priceBounds: $bounds) { %s } }"
+        return self.data(query % fields, variables=variables)["productFacets"]
+
+    def test_counts(self):
+        facets = self.facets(
+            "total categories { name count } businesses { name count } prices { min max count } ratings { rating count }",
+            bounds=[0, 25, 50])
+
+        self.assertEqual(facets["total"], 4)
+        self.assertEqual(facets["categories"], [{"name": "Category", "count": 3}, {"name": "Shoes", "count": 1}])
+        self.assertEqual(facets["businesses"], [{"name": "Business", "count": 3}, {"name": "Other", "count": 1}])
+        # prices 10, 20, 30 and 100
+        self.assertEqual(facets["prices"], [
+            {"min": 0, "max": 25, "count": 2}, {"min": 25, "max": 50, "count": 1}, {"min": 50, "max": None, "count": 1}
+        ])
+        # averages 4.5, 2 and 1, the product without comments has no rating
+        self.assertEqual([bucket["count"] for bucket in facets["ratings"]], [1, 1, 0, 1, 0])
+
+    def test_filters(self):
+        facets = self.facets("total businesses { name count }", category="Shoes")
+        self.assertEqual(facets, {"total": 1, "businesses": [{"name": "Other", "count": 1}]})
+
+    def test_only_requested_facets_are_counted(self):
+        with self.assertNumQueries(1):
+            self.facets("total prices { count }")
+        with self.assertNumQueries(1):
+            self.facets("categories { name }")
+        with self.assertNumQueries(2):
+            self.facets("total businesses { name }", category="Category")
+
+    @override_settings(CATALOG_SHARDS=["default", "default"])
+    def test_shards_are_added_up(self):
+        # the same database twice, so every count doubles
+        facets = self.facets("total categories { name count } prices { count } ratings { count }", bounds=[0, 25, 50])
+        self.assertEqual(facets["total"], 8)
+        self.assertEqual(facets["categories"], [{"name": "Category", "count": 6}, {"name": "Shoes", "count": 2}])
+        self.assertEqual([bucket["count"] for bucket in facets["prices"]], [4, 2, 2])
+        self.assertEqual([bucket["count"] for bucket in facets["ratings"]], [2, 2, 0, 2, 0])
+
+    def test_cached_by_signature(self):
+        self.facets("total")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.facets("total"), {"total": 4})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.facets("total", category="Shoes"), {"total": 1})
+
+
+@override_settings(CATALOG_OUTBOX_SETTLE_SECONDS=0)
+class AutocompleteTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller, self.products = self.create_catalog(2)
+        self.index = PrefixIndex()
+        self.index.start = mock.Mock()
+
+    def autocomplete(self, prefix, limit=10):
+        query = "query($prefix: String!, $limit: Int) { autocomplete(prefix: $prefix, limit: $limit) { kind name } }"
+        with mock.patch("product_controller.schema.prefix_index", self.index):
+            return self.data(query, variables={"prefix": prefix, "limit": limit})["autocomplete"]
+
+    def test_tables_are_searched_until_the_index_is_built(self):
+        self.assertEqual(self.autocomplete("Product"), [
+            {"kind": "product", "name": "Product0"}, {"kind": "product", "name": "Product1"}
+        ])
+        self.assertEqual(self.autocomplete("Product", limit=1), [{"kind": "product", "name": "Product0"}])
+        self.index.start.assert_called()
+
+    def test_index(self):
+        self.index.build()
+        self.assertEqual(self.autocomplete("c"), [{"kind": "category", "name": "Category"}])
+        self.assertEqual([item["name"] for item in self.autocomplete("PRODUCT")], ["Product0", "Product1"])
+
+    def test_sync(self):
+        self.index.build()
+        Category.objects.create(name="Cameras")
+        Category.objects.get(name="Category").delete()
+
+        self.index.sync()
+        self.assertEqual(self.autocomplete("ca"), [{"kind": "category", "name": "Cameras"}])
+
+
+class RelatedProductTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller, products = self.create_catalog(5)
+        self.a, self.b, self.c, self.d, self.e = products
+        self.users = [
+            User.objects.create_user(f"user{i}@example.com", "password", first_name="first", last_name="last")
+            for i in range(3)
+        ]
+
+    def buy(self, user, *products):
+        for product in products:
+            RequestCart.objects.create(product=product, business=product.business, user=user, quantity=1, price=10)
+
+    def related(self, product):
+        return list(RelatedProduct.objects.filter(product=product).order_by("rank").values_list("related", flat=True))
+
+    def test_ranking(self):
+        self.buy(self.users[0], self.a, self.b)
+        self.buy(self.users[1], self.a, self.b, self.c)
+        self.buy(self.users[2], self.c, self.d)
+
+        build_related_products(top_k=2)
+
+        # b was bought with a by both users, c by one of them
+        self.assertEqual(self.related(self.a), [self.b.id, self.c.id])
+        self.assertEqual(self.related(self.d), [self.c.id])
+        self.assertEqual(self.related(self.e), [])
+
+        data = self.data("query($id: ID!) { relatedProducts(productId: $id) { id } }", variables={"id": self.a.id})
+        self.assertEqual([int(item["id"]) for item in data["relatedProducts"]], [self.b.id, self.c.id])
+
+    def test_incremental_build_picks_up_wishes(self):
+        self.buy(self.users[0], self.a, self.b)
+        self.buy(self.users[2], self.d)
+        build_related_products(top_k=2)
+        self.assertEqual(self.related(self.a), [self.b.id])
+
+        # the new wish relates e to everything user 0 bought, and changes a's and b's lists too
+        Wish.objects.create(user=self.users[0]).products.add(self.e)
+        build_related_products(top_k=2, incremental=True)
+
+        self.assertEqual(set(self.related(self.e)), {self.a.id, self.b.id})
+        self.assertEqual(set(self.related(self.a)), {self.b.id, self.e.id})
+        self.assertEqual(set(self.related(self.b)), {self.a.id, self.e.id})
+        self.assertEqual(self.related(self.d), [])
+
+
+class AdminQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin@example.com", "password")
+
+        for i in range(3):
+            user = User.objects.create_user(f"user{i}@example.com", "password", first_name="first", last_name="last")
+            category = Category.objects.create(name=f"Category{i}")
+            business = Business.objects.create(user=user, name=f"Business{i}")
+            product = Product.objects.create(
+                category=category, business=business, name=f"Product{i}", price=10,
+                total_available=5, total_count=5, description="description"
+            )
+            ProductImage.objects.create(product=product, image=ImageUpload.objects.create(image="images/product.png"))
+            ProductComment.objects.create(product=product, user=user, comment="comment", rate=4)
+            Wish.objects.create(user=user).products.add(product)
+            Cart.objects.create(product=product, user=user)
+            RequestCart.objects.create(product=product, business=business, user=user, quantity=1, price=10)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assertChangelistQueries(self, model, queries, **params):
+        url = reverse(f"admin:{model._meta.app_label}_{model._meta.model_name}_changelist")
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["cl"].result_count, 1 if params else model.objects.count())
+
+    def assertChangelistUsesPrimaryKey(self, model):
+        url = reverse(f"admin:{model._meta.app_label}_{model._meta.model_name}_changelist")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        table = model._meta.db_table
+        rows = [query["sql"] for query in queries.captured_queries if f'FROM "{table}"' in query["sql"] and "ORDER BY" in query["sql"]]
+        self.assertRegex(rows[-1], rf'ORDER BY "{table}"."id" DESC( LIMIT \d+)?$')
+
+        if connection.vendor == "postgresql":
+            # sequential scans are priced out, small as the table is; the rows come off the primary
+            # key backwards, the partitions' keys for a partitioned table
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute(f"EXPLAIN {rows[-1]}")
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+            self.assertRegex(plan, rf"Index (Only )?Scan Backward using \S+ on {table}")
+
+    def test_large_table_changelists(self):
+        for model in (Product, ProductImage, ProductComment, Wish, Cart, RequestCart):
+            with self.subTest(model=model.__name__):
+                self.assertChangelistQueries(model, CHANGELIST_QUERIES + ESTIMATE_QUERIES)
+
+    def test_large_table_changelists_are_ordered_by_the_primary_key(self):
+        for model in (Product, ProductImage, ProductComment, Wish, Cart, RequestCart):
+            with self.subTest(model=model.__name__):
+                self.assertChangelistUsesPrimaryKey(model)
+
+    def test_small_table_changelists(self):
+        # show_full_result_count is left on for these, so the total is counted a second time
+        for model in (Category, Business):
+            with self.subTest(model=model.__name__):
+                self.assertChangelistQueries(model, CHANGELIST_QUERIES + 1)
+
+    def test_prefix_searches(self):
+        # filtered lists skip the estimate and count exactly
+        self.assertChangelistQueries(Product, CHANGELIST_QUERIES, q="Product1")
+        self.assertChangelistQueries(Category, CHANGELIST_QUERIES + 1, q="Category1")
+        self.assertChangelistQueries(Business, CHANGELIST_QUERIES + 1, q="Business1")
+
+    def test_prefix_searches_are_indexed(self):
+        if connection.vendor != "postgresql":
+            self.skipTest("pattern ops indexes are postgres only")
+
+        # Django gives unique varchar columns a varchar_pattern_ops "_like" index of its own,
+        # product name, which isn't unique, has product_name_prefix_idx
+        for admin_class, model in ((CategoryAdmin, Category), (BusinessAdmin, Business), (ProductAdmin, Product)):
+            column = admin_class.search_fields[0].split("__")[0]
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT indexdef FROM pg_indexes WHERE tablename = %s", [model._meta.db_table])
+                definitions = [row[0] for row in cursor.fetchall()]
+            self.assertTrue(any(f"({column} varchar_pattern_ops)" in definition for definition in definitions),
+                            f"{model.__name__}.{column} has no prefix index")
+
+
+class QueryPlanTests(TestCase):
+    def test_seq_scans_under_a_limit_are_allowed(self):
+        plan = {"Node Type": "Nested Loop", "Plans": [
+            {"Node Type": "Seq Scan", "Relation Name": "product_controller_cart"},
+            {"Node Type": "Limit", "Plans": [{"Node Type": "Seq Scan", "Relation Name": "product_controller_product"}]},
+        ]}
+        self.assertEqual(list(CheckQueryPlans.seq_scans(plan)), ["product_controller_cart"])
+
+    def test_resolver_querysets_run(self):
+        # the command builds its querysets from the resolvers, so it breaks when they change
+        user = User.objects.create_user("seller@example.com", "password", first_name="first", last_name="last")
+        business = Business.objects.create(user=user, name="Business")
+        Product.objects.create(
+            category=Category.objects.create(name="Category"), business=business, name="Product", price=10,
+            total_available=5, total_count=5, description="description"
+        )
+
+        for name, queryset in CheckQueryPlans().resolver_querysets():
+            with self.subTest(name):
+                list(queryset)
+
+    def test_resolver_plans_use_indexes(self):
+        if connection.vendor != "postgresql":
+            self.skipTest("query plans are only checked on postgres")
+
+        # raises CommandError when a resolver's plan falls back to a sequential scan
+        call_command("check_query_plans", seed=20000, stdout=StringIO(), stderr=StringIO())
+
+
+@tag("slow")
+class OrderExportTests(TestCase):
+    ROWS = 1000000
+    SMALL_ROWS = 10000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("seller@example.com", "password", first_name="first", last_name="last")
+        category = Category.objects.create(name="Category")
+        business = Business.objects.create(user=cls.user, name="Business")
+        cls.small, large = [
+            Product.objects.create(
+                category=category, business=business, name=f"Product{i}", price=10,
+                total_available=5, total_count=5, description="description"
+            ) for i in range(2)
+        ]
+
+        # generated and inserted a batch at a time, so the fixture itself stays small
+        rows = (
+            RequestCart(
+                product=cls.small if i < cls.SMALL_ROWS else large, business=business,
+                user=cls.user, quantity=1, price=10
+            ) for i in range(cls.ROWS)
+        )
+        while True:
+            batch = list(islice(rows, 10000))
+            if not batch:
+                break
+            RequestCart.objects.bulk_create(batch)
+
+    def export(self, **params):
+        token = TokenManager.get_token(5, {"user_id": self.user.id})
+        tracemalloc.start()
+        try:
+            response = self.client.get("/exports/request-carts/", params, HTTP_AUTHORIZATION=f"JWT {token}")
+            lines = sum(chunk.count(b"\n") for chunk in response.streaming_content)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(response.status_code, 200)
+        return lines, peak
+
+    def test_memory_stays_flat(self):
+        small_lines, small_peak = self.export(product_id=self.small.id)
+        lines, peak = self.export()
+
+        # a header line, then a line per order
+        self.assertEqual(small_lines, self.SMALL_ROWS + 1)
+        self.assertEqual(lines, self.ROWS + 1)
+        # a hundred times the rows, about the same memory: one chunk of rows is held at a time
+        self.assertLess(peak, small_peak * 2)
+
+    def test_jsonl_streams_every_row(self):
+        lines, _ = self.export(format="jsonl")
+        self.assertEqual(lines, self.ROWS)
@@ -0,0 +1,40 @@
+from datetime import date
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from ecommerce_api.authentication import Authentication
+from .exports import FORMATS, order_rows, batched
+from .models import Business
+from .sharding import business_db
+
+
+@require_GET
+def export_request_carts(request):
+    user = Authentication(request).authenticate()
+    if not user:
+        return HttpResponse("You are not authorized to perform operations", status=401)
+
+    business = Business.objects.filter(user_id=user.id).first()
+    if not business:
+        return HttpResponse("You do not have a business", status=403)
+
+    export_format = request.GET.get("format", "csv")
+    if export_format not in FORMATS:
+        return HttpResponse(f"format must be one of {', '.join(FORMATS)}", status=400)
+
+    try:
+        start_date = date.fromisoformat(request.GET["start_date"]) if request.GET.get("start_date") else None
+        end_date = date.fromisoformat(request.GET["end_date"]) if request.GET.get("end_date") else None
+        product_ids = [int(product_id) for product_id in request.GET.getlist("product_id")]
+    except ValueError:
+        return HttpResponse("Dates must be YYYY-MM-DD and product ids numbers", status=400)
+
+    lines, content_type = FORMATS[export_format]
+    rows = order_rows(business_db(business.id), business.id, start_date, end_date, product_ids)
+
+    response = StreamingHttpResponse(
+        batched(lines(rows), settings.ORDER_EXPORT_CHUNK_SIZE), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="orders-{business.id}.{export_format}"'
+    return response
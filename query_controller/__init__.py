@@ -0,0 +1 @@
+default_app_config = 'query_controller.apps.QueryControllerConfig'
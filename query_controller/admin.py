@@ -0,0 +1,8 @@
+from django.contrib import admin
+from .models import SlowQuery
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ("fingerprint", "database", "calls", "total_ms", "max_ms", "operation", "last_seen")
+    ordering = ("-total_ms",)
@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+def install_slow_query_log(sender, connection, **kwargs):
+    from ecommerce_api.slow_queries import log_slow_query
+
+    # first in line, since execute_wrapper() blocks pop the last wrapper when they exit
+    if settings.SLOW_QUERY_LOG["THRESHOLD_MS"] and log_slow_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, log_slow_query)
+
+
+class QueryControllerConfig(AppConfig):
+    name = 'query_controller'
+
+    def ready(self):
+        connection_created.connect(install_slow_query_log)
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from ecommerce_api.slow_queries import slow_query_buffer
+from query_controller.models import SlowQuery
+
+ORDERINGS = {
+    "total": F("total_ms").desc(),
+    "max": F("max_ms").desc(),
+    "calls": F("calls").desc(),
+    "mean": (F("total_ms") / F("calls")).desc(),
+}
+
+
+class Command(BaseCommand):
+    help = "List the slow queries logged so far, worst first"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=20)
+        parser.add_argument("--order-by", choices=sorted(ORDERINGS), default="total")
+        parser.add_argument("--plans", action="store_true", help="Show the captured EXPLAIN output")
+        parser.add_argument("--examples", action="store_true", help="Show the slowest statement with its params")
+        parser.add_argument("--reset", action="store_true", help="Forget every logged query")
+
+    def handle(self, *args, **options):
+        slow_query_buffer.flush()
+
+        if options["reset"]:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f"Forgot {deleted} slow query fingerprint(s)"))
+            return
+
+        queries = SlowQuery.objects.order_by(ORDERINGS[options["order_by"]])[:options["top"]]
+        for query in queries:
+            self.stdout.write(
+                f"{query.total_ms:>10.0f}ms total  {query.calls:>6} calls  "
+                f"{query.total_ms / query.calls:>8.1f}ms mean  {query.max_ms:>8.1f}ms max  {query.database}")
+            if query.operation:
+                self.stdout.write(f"  slowest in {query.operation} at {query.path or '-'}")
+            self.stdout.write(f"  {query.query}")
+
+            if options["examples"] and query.example:
+                self.stdout.write(f"  {query.example}")
+            if options["plans"] and query.plan:
+                self.stdout.write("  " + query.plan.replace("\n", "\n  "))
+            self.stdout.write("")
+
+        if not queries:
+            self.stdout.write("No slow queries logged")
@@ -0,0 +1,20 @@
+from django.db import models
+
+
+class SlowQuery(models.Model):
+    fingerprint = models.CharField(max_length=40, unique=True)
+    query = models.TextField()
+    database = models.CharField(max_length=100)
+    calls = models.BigIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    # the operation, resolver path and statement of the slowest call seen, its text params redacted
+    operation = models.CharField(max_length=255, blank=True)
+    path = models.TextField(blank=True)
+    example = models.TextField(blank=True)
+    plan = models.TextField(blank=True)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.fingerprint} {self.calls} calls, {self.total_ms:.0f}ms"
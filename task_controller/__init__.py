@@ -0,0 +1 @@
+default_app_config = 'task_controller.apps.TaskControllerConfig'
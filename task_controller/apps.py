@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class TaskControllerConfig(AppConfig):
+    name = 'task_controller'
+
+    def ready(self):
+        autodiscover_modules("tasks")
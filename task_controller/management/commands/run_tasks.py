@@ -0,0 +1,63 @@
+import logging
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from task_controller.queue import run_next
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Run background task workers for the configured queues"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queue", action="append", dest="queues",
+                            help="Queue to work on, can be repeated (defaults to every configured queue)")
+        parser.add_argument("--concurrency", type=int, help="Worker threads per queue, overrides TASK_QUEUES")
+        parser.add_argument("--once", action="store_true", help="Exit once the queues are drained")
+
+    def handle(self, *args, **options):
+        queues = options["queues"] or list(settings.TASK_QUEUES)
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping workers after their current tasks")
+            stopping.set()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        workers = []
+        for queue in queues:
+            concurrency = options["concurrency"] or settings.TASK_QUEUES.get(queue, {}).get("concurrency", 1)
+            for _ in range(concurrency):
+                worker = threading.Thread(target=self.work, args=(queue, stopping, options["once"]))
+                worker.start()
+                workers.append(worker)
+            self.stdout.write(f"Started {concurrency} worker(s) on queue '{queue}'")
+
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(0.5)
+
+    @staticmethod
+    def work(queue, stopping, once):
+        try:
+            while not stopping.is_set():
+                try:
+                    done = run_next(queue)
+                except Exception:
+                    logger.exception("Worker on queue %s crashed, reconnecting", queue)
+                    connection.close()
+                    done = 0
+
+                if not done:
+                    if once:
+                        break
+                    stopping.wait(settings.TASK_POLL_INTERVAL)
+        finally:
+            connection.close()
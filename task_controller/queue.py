@@ -0,0 +1,135 @@
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+
+
+class TaskHandler:
+    def __init__(self, func, name, queue, batch_size, max_attempts, backoff):
+        self.func = func
+        self.name = name
+        self.queue = queue
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def run(self, payloads):
+        if self.batch_size > 1:
+            return self.func(payloads)
+
+        for payload in payloads:
+            self.func(**payload)
+
+    def retry_at(self, attempts):
+        delay = self.backoff * 2 ** (attempts - 1)
+        return timezone.now() + timedelta(seconds=delay + random.uniform(0, delay / 2))
+
+
+def task(name=None, queue="default", batch_size=1, max_attempts=5, backoff=10):
+    def decorator(func):
+        task_name = name or f"{func.__module__}.{func.__name__}"
+        REGISTRY[task_name] = TaskHandler(func, task_name, queue, batch_size, max_attempts, backoff)
+        func.delay = lambda run_at=None, **payload: enqueue(task_name, run_at, **payload)
+        return func
+
+    return decorator
+
+
+def enqueue(name, run_at=None, **payload):
+    try:
+        handler = REGISTRY[name]
+    except KeyError:
+        raise Exception(f"Unknown task {name}")
+
+    return Task.objects.create(
+        name=name,
+        queue=handler.queue,
+        payload=payload,
+        run_at=run_at or timezone.now()
+    )
+
+
+def claim_tasks(queue):
+    now = timezone.now()
+    ready = Q(status=Task.PENDING, run_at__lte=now) | Q(status=Task.RUNNING, locked_until__lt=now)
+
+    with transaction.atomic():
+        first = Task.objects.select_for_update(skip_locked=True).filter(ready, queue=queue).first()
+        if not first:
+            return None, []
+
+        tasks = [first]
+        handler = REGISTRY.get(first.name)
+        if handler and handler.batch_size > 1:
+            tasks += Task.objects.select_for_update(skip_locked=True).filter(
+                ready, queue=queue, name=first.name
+            ).exclude(id=first.id)[:handler.batch_size - 1]
+
+        Task.objects.filter(id__in=[item.id for item in tasks]).update(
+            status=Task.RUNNING,
+            attempts=F("attempts") + 1,
+            locked_until=now + timedelta(seconds=settings.TASK_LEASE_SECONDS)
+        )
+
+    for item in tasks:
+        item.attempts += 1
+
+    return handler, tasks
+
+
+def run_next(queue):
+    handler, tasks = claim_tasks(queue)
+    if not tasks:
+        return 0
+
+    if not handler:
+        Task.objects.filter(id__in=[item.id for item in tasks]).update(
+            status=Task.FAILED, last_error=f"Unknown task {tasks[0].name}")
+        return len(tasks)
+
+    # a lease that ran out on the last attempt means the task took its worker down every time
+    exhausted = [item for item in tasks if item.attempts > handler.max_attempts]
+    if exhausted:
+        Task.objects.filter(id__in=[item.id for item in exhausted]).update(
+            status=Task.FAILED, locked_until=None, last_error="Lease expired on the last attempt")
+        tasks = [item for item in tasks if item.attempts <= handler.max_attempts]
+        if not tasks:
+            return len(exhausted)
+
+    try:
+        # the handler's writes and the delete commit together, so a crash in between can't
+        # run the tasks twice; the row locks keep a worker reclaiming an expired lease away
+        with transaction.atomic():
+            locked = Task.objects.select_for_update().filter(id__in=[item.id for item in tasks])
+            list(locked)
+            handler.run([item.payload for item in tasks])
+            locked.delete()
+    except Exception:
+        logger.exception("Task %s failed", handler.name)
+        fail_tasks(handler, tasks, traceback.format_exc())
+
+    return len(tasks) + len(exhausted)
+
+
+def fail_tasks(handler, tasks, error):
+    for item in tasks:
+        if item.attempts >= handler.max_attempts:
+            item.status = Task.FAILED
+        else:
+            item.status = Task.PENDING
+            item.run_at = handler.retry_at(item.attempts)
+        item.locked_until = None
+        item.last_error = error
+
+    Task.objects.bulk_update(tasks, ["status", "run_at", "locked_until", "last_error"])
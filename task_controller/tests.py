@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from .models import Task
+from .queue import task, enqueue, run_next
+
+calls = []
+
+
+@task("tests.record", queue="tests")
+def record(value):
+    calls.append(value)
+
+
+@task("tests.record_batch", queue="tests", batch_size=3)
+def record_batch(payloads):
+    calls.append([payload["value"] for payload in payloads])
+
+
+@task("tests.fail", queue="tests", max_attempts=2, backoff=10)
+def fail(value):
+    calls.append(value)
+    raise ValueError(value)
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_runs_and_deletes(self):
+        record.delay(value=1)
+
+        self.assertEqual(run_next("tests"), 1)
+        self.assertEqual(calls, [1])
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(run_next("tests"), 0)
+
+    def test_waits_for_run_at(self):
+        record.delay(run_at=timezone.now() + timedelta(minutes=1), value=1)
+
+        self.assertEqual(run_next("tests"), 0)
+        self.assertEqual(calls, [])
+
+    def test_batches_tasks_of_one_name(self):
+        for value in range(4):
+            record_batch.delay(value=value)
+        record.delay(value="other")
+
+        self.assertEqual(run_next("tests"), 3)
+        self.assertEqual(calls, [[0, 1, 2]])
+        self.assertEqual(Task.objects.count(), 2)
+
+    def test_retries_with_backoff_then_fails(self):
+        item = fail.delay(value=1)
+
+        before = timezone.now()
+        with self.assertLogs("task_controller.queue", "ERROR"):
+            run_next("tests")
+        item.refresh_from_db()
+        self.assertEqual((item.status, item.attempts), (Task.PENDING, 1))
+        # ten seconds, plus up to half again of jitter
+        self.assertGreaterEqual(item.run_at, before + timedelta(seconds=10))
+        self.assertLessEqual(item.run_at, timezone.now() + timedelta(seconds=15))
+        self.assertIn("ValueError", item.last_error)
+
+        Task.objects.filter(id=item.id).update(run_at=timezone.now())
+        with self.assertLogs("task_controller.queue", "ERROR"):
+            run_next("tests")
+        item.refresh_from_db()
+        self.assertEqual((item.status, item.attempts), (Task.FAILED, 2))
+        self.assertEqual(calls, [1, 1])
+        self.assertEqual(run_next("tests"), 0)
+
+    def test_reclaims_expired_leases(self):
+        item = record.delay(value=1)
+        Task.objects.filter(id=item.id).update(
+            status=Task.RUNNING, attempts=1, locked_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(run_next("tests"), 1)
+        self.assertEqual(calls, [1])
+
+    def test_running_leases_are_left_alone(self):
+        item = record.delay(value=1)
+        Task.objects.filter(id=item.id).update(
+            status=Task.RUNNING, attempts=1, locked_until=timezone.now() + timedelta(minutes=1))
+
+        self.assertEqual(run_next("tests"), 0)
+
+    def test_expired_lease_on_the_last_attempt_fails(self):
+        item = fail.delay(value=1)
+        Task.objects.filter(id=item.id).update(
+            status=Task.RUNNING, attempts=2, locked_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(run_next("tests"), 1)
+        item.refresh_from_db()
+        self.assertEqual(item.status, Task.FAILED)
+        self.assertEqual(item.last_error, "Lease expired on the last attempt")
+        self.assertEqual(calls, [])
+
+    def test_unknown_tasks(self):
+        with self.assertRaisesMessage(Exception, "Unknown task tests.missing"):
+            enqueue("tests.missing")
+
+        Task.objects.create(name="tests.missing", queue="tests")
+        self.assertEqual(run_next("tests"), 1)
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
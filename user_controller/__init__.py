@@ -0,0 +1 @@
+default_app_config = 'user_controller.apps.UserControllerConfig'
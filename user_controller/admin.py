@@ -1,5 +1,36 @@
 from django.contrib import admin
+
+from ecommerce_api.admin import LargeTableAdmin
 from .models import User, ImageUpload, UserProfile, UserAddress
 
 
-admin.site.register((User, ImageUpload, UserProfile, UserAddress, ))
+@admin.register(User)
+class UserAdmin(LargeTableAdmin):
+    list_display = ("email", "first_name", "last_name", "is_staff", "is_active", "created_at")
+    search_fields = ("email__startswith",)
+    filter_horizontal = ("groups", "user_permissions")
+
+    def formfield_for_manytomany(self, db_field, request=None, **kwargs):
+        if db_field.name == "user_permissions":
+            kwargs["queryset"] = db_field.remote_field.model.objects.select_related("content_type")
+        return super().formfield_for_manytomany(db_field, request=request, **kwargs)
+
+
+@admin.register(ImageUpload)
+class ImageUploadAdmin(LargeTableAdmin):
+    list_display = ("id", "image")
+
+
+@admin.register(UserProfile)
+class UserProfileAdmin(LargeTableAdmin):
+    list_display = ("user", "phone", "created_at")
+    list_select_related = ("user",)
+    autocomplete_fields = ("user",)
+    raw_id_fields = ("profile_picture",)
+
+
+@admin.register(UserAddress)
+class UserAddressAdmin(LargeTableAdmin):
+    list_display = ("user_profile", "city", "state", "country", "is_default")
+    list_select_related = ("user_profile__user",)
+    raw_id_fields = ("user_profile",)
@@ -1,5 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete
+
+
+def forget_cached_user(sender, instance, **kwargs):
+    from ecommerce_api.authentication import Authentication
+
+    Authentication.forget_user(instance.id)
 
 
 class UserControllerConfig(AppConfig):
     name = 'user_controller'
+
+    def ready(self):
+        from .models import User
+
+        post_save.connect(forget_cached_user, sender=User)
+        post_delete.connect(forget_cached_user, sender=User)
@@ -46,7 +46,9 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.email
 
     def save(self, *args, **kwargs):
-        super().full_clean()
+        # partial saves come from internal updates that don't touch validated fields
+        if not kwargs.get("update_fields"):
+            super().full_clean()
         super().save(*args, **kwargs)
 
 
@@ -85,4 +87,12 @@ class UserAddress(models.Model):
         return self.user_profile.user.email
 
 
+class RevokedToken(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, related_name="revoked_tokens", on_delete=models.CASCADE, null=True)
+    revoked_before = models.DateTimeField(null=True)
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
 
+    def __str__(self):
+        return self.key
@@ -2,17 +2,21 @@ import graphene
 from .models import User, ImageUpload, UserProfile, UserAddress
 from graphene_django import DjangoObjectType
 from django.contrib.auth import authenticate
-from datetime import datetime
-from ecommerce_api.authentication import TokenManager
+from django.utils import timezone
+from ecommerce_api.authentication import TokenManager, Authentication
 from ecommerce_api.permissions import is_authenticated, paginate
 from graphene_file_upload.scalars import Upload
 from django.conf import settings
+from ecommerce_api.activity import record_activity
 
 
 class UserType(DjangoObjectType):
 
     class Meta:
         model = User
+        # users is public, so nothing private or unbounded: carts, orders, comments and wishes are
+        # read through their own fields for the viewer
+        exclude = ("password", "user_carts", "user_requests", "user_comments", "user_wish")
 
 
 class ImageUploadType(DjangoObjectType):
@@ -20,6 +24,7 @@ class ImageUploadType(DjangoObjectType):
 
     class Meta:
         model = ImageUpload
+        exclude = ("image_product", "user_images")
 
     def resolve_image(self, info):
         if self.image:
@@ -73,8 +78,8 @@ class LoginUser(graphene.Mutation):
         if not user:
             raise Exception("invalid credentials")
 
-        user.last_login = datetime.now()
-        user.save()
+        user.last_login = timezone.now()
+        record_activity(user.id, "last_login", user.last_login)
 
         access = TokenManager.get_access({"user_id": user.id})
         refresh = TokenManager.get_refresh({"user_id": user.id})
@@ -105,6 +110,51 @@ class GetAccess(graphene.Mutation):
         )
 
 
+class LogoutUser(graphene.Mutation):
+    status = graphene.Boolean()
+
+    class Arguments:
+        refresh = graphene.String()
+
+    @is_authenticated
+    def mutate(self, info, refresh=None):
+        TokenManager.revoke_token(Authentication(info.context).get_token())
+
+        if refresh:
+            TokenManager.revoke_token(refresh)
+
+        return LogoutUser(
+            status=True
+        )
+
+
+class ChangePassword(graphene.Mutation):
+    access = graphene.String()
+    refresh = graphene.String()
+
+    class Arguments:
+        old_password = graphene.String(required=True)
+        new_password = graphene.String(required=True)
+
+    @is_authenticated
+    def mutate(self, info, old_password, new_password):
+        user = info.context.user
+
+        if not user.check_password(old_password):
+            raise Exception("invalid credentials")
+
+        user.set_password(new_password)
+        user.save()
+
+        # every token issued before now, on any device, stops working
+        TokenManager.revoke_user(user.id)
+
+        return ChangePassword(
+            access=TokenManager.get_access({"user_id": user.id}),
+            refresh=TokenManager.get_refresh({"user_id": user.id})
+        )
+
+
 class ImageUploadMain(graphene.Mutation):
     image = graphene.Field(ImageUploadType)
 
@@ -248,8 +298,8 @@ class DeleteUserAddress(graphene.Mutation):
 
 
 class Query(graphene.ObjectType):
-    users = graphene.Field(paginate(UserType), page=graphene.Int())
-    image_uploads = graphene.Field(paginate(ImageUploadType), page=graphene.Int())
+    users = graphene.Field(paginate(UserType), page=graphene.Int(), size=graphene.Int())
+    image_uploads = graphene.Field(paginate(ImageUploadType), page=graphene.Int(), size=graphene.Int())
     me = graphene.Field(UserType)
 
     def resolve_users(self, info, **kwargs):
@@ -267,12 +317,11 @@ class Mutation(graphene.ObjectType):
     register_user = RegisterUser.Field()
     login_user = LoginUser.Field()
     get_access = GetAccess.Field()
+    logout_user = LogoutUser.Field()
+    change_password = ChangePassword.Field()
     image_upload = ImageUploadMain.Field()
     create_user_profile = CreateUserProfile.Field()
     update_user_profile = UpdateUserProfile.Field()
     create_user_address = CreateUserAddress.Field()
     update_user_address = UpdateUserAddress.Field()
     delete_user_address = DeleteUserAddress.Field()
-
-
-schema = graphene.Schema(query=Query, mutation=Mutation)
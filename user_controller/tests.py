@@ -1,3 +1,226 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ecommerce_api.activity import ActivityBuffer, activity_buffer, write_activity
+from ecommerce_api.authentication import TokenManager
+from ecommerce_api.revocation import BloomFilter, RevocationList
+from product_controller.tests import GraphQLTestCase
+from .models import User, UserProfile, UserAddress, RevokedToken
+
+# the session and its user, then the page's count and its rows
+CHANGELIST_QUERIES = 4
+# unfiltered lists of large tables ask pg_class for an estimate before counting
+ESTIMATE_QUERIES = 1 if connection.vendor == "postgresql" else 0
+
+
+class AdminQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin@example.com", "password")
+
+        for i in range(3):
+            user = User.objects.create_user(f"user{i}@example.com", "password", first_name="first", last_name="last")
+            profile = UserProfile.objects.create(user=user, dob=date(2000, 1, 1), phone=8000000000 + i)
+            UserAddress.objects.create(user_profile=profile, street="street", city="city", state="state")
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assertChangelistQueries(self, model, queries, **params):
+        url = reverse(f"admin:{model._meta.app_label}_{model._meta.model_name}_changelist")
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["cl"].result_count, 1 if params else model.objects.count())
+
+    def assertChangelistUsesPrimaryKey(self, model):
+        url = reverse(f"admin:{model._meta.app_label}_{model._meta.model_name}_changelist")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        table = model._meta.db_table
+        rows = [query["sql"] for query in queries.captured_queries if f'FROM "{table}"' in query["sql"] and "ORDER BY" in query["sql"]]
+        self.assertRegex(rows[-1], rf'ORDER BY "{table}"."id" DESC( LIMIT \d+)?$')
+
+        if connection.vendor == "postgresql":
+            # sequential scans are priced out, small as the table is; the rows come off the primary
+            # key backwards, the partitions' keys for a partitioned table
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute(f"EXPLAIN {rows[-1]}")
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+            self.assertRegex(plan, rf"Index (Only )?Scan Backward using \S+ on {table}")
+
+    def test_changelists(self):
+        for model in (User, UserProfile, UserAddress):
+            with self.subTest(model=model.__name__):
+                self.assertChangelistQueries(model, CHANGELIST_QUERIES + ESTIMATE_QUERIES)
+
+    def test_changelists_are_ordered_by_the_primary_key(self):
+        for model in (User, UserProfile, UserAddress):
+            with self.subTest(model=model.__name__):
+                self.assertChangelistUsesPrimaryKey(model)
+
+    def test_email_search(self):
+        self.assertChangelistQueries(User, CHANGELIST_QUERIES, q="user1@")
+
+    def test_user_change_form(self):
+        # every permission's content type comes in the one query that lists them, not one query each
+        user = User.objects.get(email="user0@example.com")
+        with self.assertNumQueries(10):
+            response = self.client.get(reverse("admin:user_controller_user_change", args=[user.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_email_search_is_indexed(self):
+        if connection.vendor != "postgresql":
+            self.skipTest("pattern ops indexes are postgres only")
+
+        # email is unique, so Django gives it a varchar_pattern_ops "_like" index of its own
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexdef FROM pg_indexes WHERE tablename = %s", [User._meta.db_table])
+            definitions = [row[0] for row in cursor.fetchall()]
+        self.assertTrue(any("(email varchar_pattern_ops)" in definition for definition in definitions))
+
+
+class RevocationTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("user@example.com", "password", first_name="first", last_name="last")
+
+    def session(self):
+        payload = {"user_id": self.user.id}
+        return TokenManager.get_access(payload), TokenManager.get_refresh(payload)
+
+    def me(self, access):
+        query = "{ me { email } }"
+        content = self.graphql(query, HTTP_AUTHORIZATION=f"JWT {access}").json()
+        if "errors" in content:
+            return None
+        return content["data"]["me"]
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 0.01)
+        keys = [f"key{i}" for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+
+        self.assertTrue(all(key in bloom for key in keys))
+        self.assertLess(sum(f"other{i}" in bloom for i in range(1000)), 50)
+
+    def test_logout(self):
+        (access, refresh), (other_access, _) = self.session(), self.session()
+        self.data("mutation($refresh: String) { logoutUser(refresh: $refresh) { status } }",
+                  variables={"refresh": refresh}, HTTP_AUTHORIZATION=f"JWT {access}")
+
+        with self.assertLogs("graphql.execution.utils", "ERROR"):
+            self.assertIsNone(self.me(access))
+        errors = self.errors("mutation($refresh: String!) { getAccess(refresh: $refresh) { access } }",
+                             variables={"refresh": refresh})
+        self.assertEqual(errors[0]["message"], "Invalid token or has expired")
+        # the other session is left alone
+        self.assertEqual(self.me(other_access), {"email": "user@example.com"})
+
+    def test_change_password_revokes_every_session(self):
+        (access, _), (other_access, _) = self.session(), self.session()
+        data = self.data('mutation { changePassword(oldPassword: "password", newPassword: "changed") { access } }',
+                         HTTP_AUTHORIZATION=f"JWT {access}")
+
+        with self.assertLogs("graphql.execution.utils", "ERROR"):
+            self.assertIsNone(self.me(other_access))
+        self.assertEqual(self.me(data["changePassword"]["access"]), {"email": "user@example.com"})
+
+    @override_settings(REVOCATION_REFRESH_SECONDS=0)
+    def test_other_workers_pick_revocations_up(self):
+        worker = RevocationList()
+        claims = TokenManager.decode_token(self.session()[0])
+        self.assertFalse(worker.is_revoked(claims))
+
+        TokenManager.revoke_user(self.user.id)
+        self.assertTrue(worker.is_revoked(claims))
+
+        # a second change of password gets a row of its own, above the last one the worker loaded
+        later = TokenManager.decode_token(self.session()[0])
+        self.assertFalse(worker.is_revoked(later))
+        TokenManager.revoke_user(self.user.id)
+        self.assertTrue(worker.is_revoked(later))
+        self.assertEqual(RevokedToken.objects.filter(user=self.user).count(), 1)
+
+        single = self.session()[0]
+        claims = TokenManager.decode_token(single)
+        TokenManager.revoke_token(single)
+        self.assertTrue(worker.is_revoked(claims))
+
+    @override_settings(REVOCATION_REFRESH_SECONDS=0, REVOCATION_REBUILD_SECONDS=0)
+    def test_rebuild_drops_expired_revocations(self):
+        RevokedToken.objects.create(key="expired", expires_at=timezone.now() - timedelta(seconds=1))
+        RevokedToken.objects.create(key="live", expires_at=timezone.now() + timedelta(hours=1))
+
+        worker = RevocationList()
+        self.assertTrue(worker.is_revoked({"jti": "live"}))
+        self.assertEqual(list(RevokedToken.objects.values_list("key", flat=True)), ["live"])
+
+
+class ActivityTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("user@example.com", "password", first_name="first", last_name="last")
+        self.buffer = ActivityBuffer()
+        self.buffer.start = mock.Mock()
+
+    def last_login(self):
+        return User.objects.values_list("last_login", flat=True).get(id=self.user.id)
+
+    @override_settings(ACTIVITY_FLUSH_INTERVAL=10, ACTIVITY_MAX_PENDING=2)
+    def test_buffer_keeps_the_newest_timestamp(self):
+        now = timezone.now()
+        self.buffer.record(self.user.id, "last_login", now)
+        self.buffer.record(self.user.id, "last_login", now - timedelta(minutes=1))
+        self.assertIsNone(self.last_login())
+        self.assertFalse(self.buffer.wakeup.is_set())
+
+        # a full buffer wakes the flusher early
+        self.buffer.record(0, "last_login", now)
+        self.assertTrue(self.buffer.wakeup.is_set())
+
+        self.buffer.flush()
+        self.assertEqual(self.last_login(), now)
+        self.assertEqual(self.buffer.pending, {})
+
+    @override_settings(ACTIVITY_FLUSH_INTERVAL=0)
+    def test_no_interval_writes_at_once(self):
+        now = timezone.now()
+        self.buffer.record(self.user.id, "last_login", now)
+        self.assertEqual(self.last_login(), now)
+
+        with self.assertRaisesMessage(Exception, "Unknown activity column email"):
+            self.buffer.record(self.user.id, "email", now)
+
+    def test_timestamps_never_move_back(self):
+        if connection.vendor != "postgresql":
+            self.skipTest("other databases write every row as it is")
+
+        now = timezone.now()
+        write_activity("last_login", {self.user.id: now})
+        with self.assertNumQueries(1):
+            write_activity("last_login", {self.user.id: now - timedelta(minutes=1), 0: now})
+        self.assertEqual(self.last_login(), now)
+
+    @override_settings(ACTIVITY_FLUSH_INTERVAL=10)
+    def test_login_is_one_query(self):
+        query = 'mutation { loginUser(email: "user@example.com", password: "password") { access } }'
+        with mock.patch.object(activity_buffer, "start"), self.assertNumQueries(1):
+            self.assertTrue(self.data(query)["loginUser"]["access"])
+
+        self.assertIn(self.user.id, activity_buffer.pending["last_login"])
+        activity_buffer.flush()
+        self.assertIsNotNone(self.last_login())
+
+    def test_partial_saves_skip_validation(self):
+        self.user.first_name = "changed"
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=["first_name"])